@@ -6,15 +6,27 @@ Analiza chats exportados de Telegram con estilo minimalista y claro
 
 import sys
 import os
+import asyncio
+import time
+import random
 import sqlite3
 import json
 import re
+import calendar
 import subprocess
 import urllib.request
 import shutil
-from datetime import datetime
-from typing import List, Dict, Optional, Any
-from dataclasses import dataclass
+import hashlib
+import importlib.util
+import threading
+import multiprocessing
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Any, get_type_hints, get_origin, get_args
+from dataclasses import dataclass, fields, is_dataclass, MISSING
 from enum import Enum
 
 from PyQt6.QtWidgets import (
@@ -23,10 +35,16 @@ from PyQt6.QtWidgets import (
     QFileDialog, QMessageBox, QSplitter, QStackedWidget,
     QLineEdit, QComboBox, QTextEdit, QDialog, QDialogButtonBox,
     QFormLayout, QSpinBox, QApplication, QProgressBar,
-    QGraphicsDropShadowEffect, QSizePolicy
+    QGraphicsDropShadowEffect, QListView, QStyledItemDelegate, QStyle, QMenu
+)
+from PyQt6.QtCore import (
+    Qt, QThread, pyqtSignal, QSize, QPropertyAnimation, QEasingCurve,
+    QAbstractListModel, QModelIndex, QRect, QRectF, QPoint
+)
+from PyQt6.QtGui import (
+    QIcon, QFont, QColor, QPalette, QAction, QPainter, QPen, QBrush, QPixmap,
+    QFontMetrics, QPainterPath, QCursor
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSize, QPropertyAnimation, QEasingCurve
-from PyQt6.QtGui import QIcon, QFont, QColor, QPalette, QAction, QPainter, QPen, QBrush, QPixmap
 
 from bs4 import BeautifulSoup
 
@@ -274,22 +292,198 @@ QMenu::item:selected {{
 # BASE DE DATOS
 # ============================================================
 
+# Perfil de conexión: WAL permite que los workers escriban mientras la UI lee
+DB_BUSY_TIMEOUT_MS = 30000
+DB_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -64000),       # ~64 MB de caché de páginas
+    ('mmap_size', 268435456),     # 256 MB mapeados en memoria
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', DB_BUSY_TIMEOUT_MS),
+]
+
+# Índices de la BD: (nombre, tabla, columnas/expresiones). _run_migrations los crea si faltan.
+DB_INDEXES = [
+    ('idx_messages_person_ts', 'messages', 'person_id, timestamp'),
+    ('idx_messages_person_day', 'messages', 'person_id, SUBSTR(timestamp, 1, 10)'),
+    ('idx_messages_day', 'messages', 'SUBSTR(timestamp, 1, 10)'),
+    ('idx_messages_ts', 'messages', 'timestamp'),
+    ('idx_persons_name', 'persons', 'name'),
+    ('idx_persons_total_messages', 'persons', 'total_messages'),
+    ('idx_tasks_assigned_status', 'tasks', 'assigned_to, status'),
+    ('idx_tasks_status', 'tasks', 'status'),
+    ('idx_behavior_alerts_person', 'behavior_alerts', 'person_id, is_dismissed'),
+    ('idx_commitments_person', 'commitments', 'person_id'),
+    ('idx_attachments_type', 'attachments', 'media_type'),
+    ('idx_links_url', 'links', 'url'),
+    ('idx_links_shared_by', 'links', 'shared_by'),
+    ('idx_llm_cache_last_used', 'llm_cache', 'last_used_at'),
+]
+# Índices sustituidos por otros: _create_indexes los elimina de las BD existentes
+DB_OBSOLETE_INDEXES = ['idx_messages_person_date', 'idx_messages_date']
+
+# Caché persistente de respuestas de la IA (tabla llm_cache)
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 3600  # Las respuestas caducan a los 30 días
+LLM_CACHE_MAX_ENTRIES = 2000  # Se descartan las menos usadas recientemente por encima de este límite
+LLM_CACHE_COUNTERS = ('llm_cache:hits', 'llm_cache:misses')
+
+
+def _counter_upsert(name_sql: str, delta_sql: str) -> str:
+    return (f"INSERT INTO stats_counters (name, value) VALUES ({name_sql}, {delta_sql}) "
+            f"ON CONFLICT(name) DO UPDATE SET value = value + ({delta_sql});")
+
+
+# Triggers que mantienen stats_counters al día en cualquier ruta de escritura
+STATS_COUNTER_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_messages_insert AFTER INSERT ON messages BEGIN
+        {_counter_upsert("'messages'", "1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_messages_delete AFTER DELETE ON messages BEGIN
+        {_counter_upsert("'messages'", "-1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_patterns_insert AFTER INSERT ON patterns BEGIN
+        {_counter_upsert("'patterns'", "1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_patterns_delete AFTER DELETE ON patterns BEGIN
+        {_counter_upsert("'patterns'", "-1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_tasks_insert AFTER INSERT ON tasks BEGIN
+        {_counter_upsert("'tasks'", "1")}
+        {_counter_upsert("'tasks:' || COALESCE(NEW.status, '')", "1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_tasks_delete AFTER DELETE ON tasks BEGIN
+        {_counter_upsert("'tasks'", "-1")}
+        {_counter_upsert("'tasks:' || COALESCE(OLD.status, '')", "-1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_tasks_status AFTER UPDATE OF status ON tasks
+        WHEN COALESCE(OLD.status, '') != COALESCE(NEW.status, '') BEGIN
+        {_counter_upsert("'tasks:' || COALESCE(OLD.status, '')", "-1")}
+        {_counter_upsert("'tasks:' || COALESCE(NEW.status, '')", "1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_persons_insert AFTER INSERT ON persons
+        WHEN NEW.total_messages > 0 BEGIN
+        {_counter_upsert("'persons_active'", "1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_persons_delete AFTER DELETE ON persons
+        WHEN OLD.total_messages > 0 BEGIN
+        {_counter_upsert("'persons_active'", "-1")} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_stats_persons_active AFTER UPDATE OF total_messages ON persons
+        WHEN (OLD.total_messages > 0) != (NEW.total_messages > 0) BEGIN
+        {_counter_upsert("'persons_active'", "(NEW.total_messages > 0) - (OLD.total_messages > 0)")} END""",
+]
+STATS_COUNTER_TRIGGER_NAMES = [re.search(r'TRIGGER IF NOT EXISTS (\w+)', sql).group(1) for sql in STATS_COUNTER_TRIGGERS]
+# Las importaciones masivas suspenden este trigger y suman el total una vez por lote
+STATS_BULK_MESSAGE_TRIGGERS = ['trg_stats_messages_insert']
+
+# Orden de las tareas: (expresión SQL, dirección, alias). El alias se devuelve en cada fila
+# y sirve de cursor para la paginación por keyset.
+TASK_SORT_COLUMNS = [
+    ("CASE t.status WHEN 'completed' THEN 1 ELSE 0 END", 'ASC', 'status_rank'),
+    ("CASE t.priority WHEN 'urgent' THEN 1 WHEN 'high' THEN 2 WHEN 'medium' THEN 3 ELSE 4 END", 'ASC', 'priority_rank'),
+    ("COALESCE(t.created_at, '')", 'DESC', 'created_key'),
+    ("t.id", 'DESC', 'id'),
+]
+
+# Estados de una tarea en el orden en que puede avanzar al re-analizar (ver Database.upsert_task)
+TASK_STATUS_PROGRESSION = ['pending', 'in_progress', 'completed']
+
+TASK_CATEGORY_ORDER = ['mentoría', 'mentoria', 'técnico', 'tecnico', 'marketing',
+                       'ventas', 'negocio', 'diseño', 'contenido', 'administrativo', 'general']
+
+TASK_CATEGORY_SORT_COLUMNS = [
+    ("CASE LOWER(COALESCE(NULLIF(t.category, ''), 'general')) "
+     + ' '.join(f"WHEN '{name}' THEN {rank}" for rank, name in enumerate(TASK_CATEGORY_ORDER))
+     + " ELSE 999 END", 'ASC', 'category_rank'),
+    ("COALESCE(NULLIF(t.category, ''), 'general')", 'ASC', 'category_key'),
+]
+
+
+def _sort_index_columns(sort_columns: List[tuple]) -> str:
+    """Columnas de un índice de expresiones con el mismo orden que sort_columns (sin el alias t.)"""
+    return ', '.join(re.sub(r'\bt\.', '', expr) + f" {direction}" for expr, direction, _ in sort_columns)
+
+
+# Índices con las expresiones exactas del ORDER BY de get_all_tasks: cada página se lee del
+# índice en orden en lugar de ordenar toda la tabla
+DB_INDEXES += [
+    ('idx_tasks_sort', 'tasks', _sort_index_columns(TASK_SORT_COLUMNS)),
+    ('idx_tasks_category_sort', 'tasks', _sort_index_columns(TASK_CATEGORY_SORT_COLUMNS + TASK_SORT_COLUMNS)),
+]
+
+
+def _keyset_condition(sort_columns: List[tuple], cursor: List[Any]) -> tuple:
+    """Condición WHERE para continuar después de cursor con el orden de sort_columns.
+    
+    La cota redundante sobre la primera columna permite a SQLite empezar la búsqueda en el
+    índice (el OR de la condición completa no se puede usar como rango).
+    """
+    first_expr, first_direction, _ = sort_columns[0]
+    clauses = []
+    params = [cursor[0]]
+    for i, (expr, direction, _) in enumerate(sort_columns):
+        parts = [f"{prev_expr} = ?" for prev_expr, _, _ in sort_columns[:i]]
+        parts.append(f"{expr} {'>' if direction == 'ASC' else '<'} ?")
+        clauses.append(f"({' AND '.join(parts)})")
+        params.extend(cursor[:i + 1])
+    bound = f"{first_expr} {'>=' if first_direction == 'ASC' else '<='} ?"
+    return f"({bound} AND ({' OR '.join(clauses)}))", params
+
+
+# Consultas representativas para el informe de planes de ejecución (antes/después de índices)
+QUERY_PLAN_CHECKS = [
+    ('get_messages_for_person',
+     'SELECT m.*, p.name FROM messages m {hint} JOIN persons p ON m.person_id = p.id '
+     'WHERE m.person_id = ? ORDER BY m.timestamp ASC', (1,)),
+    ('get_activity_by_date (persona)',
+     'SELECT SUBSTR(timestamp, 1, 10) as date, COUNT(*) FROM messages {hint} WHERE person_id = ? '
+     'GROUP BY SUBSTR(timestamp, 1, 10) ORDER BY date DESC LIMIT 30', (1,)),
+    ('get_activity_by_date',
+     'SELECT SUBSTR(timestamp, 1, 10) as date, COUNT(*) FROM messages {hint} '
+     'GROUP BY SUBSTR(timestamp, 1, 10) ORDER BY date DESC LIMIT 30', ()),
+    ('get_person_stats',
+     'SELECT COUNT(*) FROM messages {hint} WHERE person_id = ?', (1,)),
+    ('get_person_stats (tareas)',
+     'SELECT COUNT(*) FROM tasks {hint} WHERE assigned_to = ? AND status = ?', (1, 'pending')),
+    ('get_alerts_for_person',
+     'SELECT * FROM behavior_alerts {hint} WHERE person_id = ? AND is_dismissed = 0', (1,)),
+    ('get_commitments_by_person',
+     'SELECT * FROM commitments {hint} WHERE person_id = ?', (1,)),
+    ('add_link',
+     'SELECT id, mention_count FROM links {hint} WHERE url = ?', ('https://example.com',)),
+    ('get_media_stats (persona)',
+     'SELECT a.media_type, COUNT(*) FROM messages m {hint} JOIN attachments a ON a.message_id = m.id '
+     'WHERE m.person_id = ? GROUP BY a.media_type', (1,)),
+]
+
+
 class Database:
     """Clase para gestionar la base de datos SQLite local"""
     
+    _schema_lock = threading.Lock()
+    _schema_ready = set()  # Rutas cuyo esquema ya se creó/migró en este proceso
+    
     def __init__(self, db_path: str = "telegram_analyzer.db"):
         self.db_path = db_path
         self.conn = None
         self.cursor = None
         
     def connect(self):
-        self.conn = sqlite3.connect(self.db_path)
+        self.conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
         self.conn.row_factory = sqlite3.Row
+        self._apply_pragmas()
         self.cursor = self.conn.cursor()
-        self._create_tables()
         
+        # DDL y migraciones solo la primera vez por proceso (cada :memory: es una BD nueva)
+        schema_key = os.path.abspath(self.db_path) if self.db_path != ':memory:' else None
+        with Database._schema_lock:
+            if schema_key is None or schema_key not in Database._schema_ready:
+                self._create_tables()
+                if schema_key:
+                    Database._schema_ready.add(schema_key)
+        
+    def _apply_pragmas(self):
+        for pragma, value in DB_PRAGMAS:
+            self.conn.execute(f'PRAGMA {pragma} = {value}')
+    
     def close(self):
         if self.conn:
+            try:
+                self.conn.execute('PRAGMA optimize')  # Mantiene al día las estadísticas de los índices
+            except sqlite3.Error:
+                pass
             self.conn.close()
             
     def _create_tables(self):
@@ -319,6 +513,7 @@ class Database:
                 sentiment TEXT DEFAULT 'neutral',
                 sentiment_score REAL DEFAULT 0.0,
                 avatar_path TEXT,
+                ai_watermark_message_id INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
@@ -376,11 +571,84 @@ class Database:
                 person_id INTEGER,
                 content TEXT,
                 timestamp TIMESTAMP,
+                message_key TEXT,
                 FOREIGN KEY (chat_id) REFERENCES chats(id),
                 FOREIGN KEY (person_id) REFERENCES persons(id)
             )
         ''')
         
+        # Adjuntos de los mensajes (solo metadatos: la ruta apunta a la carpeta de la exportación)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attachments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER NOT NULL UNIQUE,
+                media_type TEXT NOT NULL,
+                file_path TEXT,
+                file_size INTEGER,
+                duration INTEGER,
+                FOREIGN KEY (message_id) REFERENCES messages(id)
+            )
+        ''')
+        
+        # Caché de respuestas de la IA, direccionada por contenido (ver llm_cache_key)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hits INTEGER DEFAULT 0
+            )
+        ''')
+        
+        # Trabajos del Batch API (análisis nocturno) y sus peticiones, para ingerir los resultados
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ai_batch_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                provider TEXT NOT NULL,
+                model TEXT,
+                backend TEXT NOT NULL,
+                remote_id TEXT,
+                input_path TEXT,
+                status TEXT DEFAULT 'created',
+                request_count INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ai_batch_requests (
+                job_id INTEGER NOT NULL,
+                custom_id TEXT NOT NULL,
+                schema TEXT NOT NULL,
+                person_id INTEGER,
+                watermark_message_id INTEGER,
+                prompt TEXT NOT NULL,
+                system_prompt TEXT,
+                PRIMARY KEY (job_id, custom_id),
+                FOREIGN KEY (job_id) REFERENCES ai_batch_jobs(id),
+                FOREIGN KEY (person_id) REFERENCES persons(id)
+            )
+        ''')
+        
+        # Archivos ya importados (por hash de contenido) para importaciones incrementales
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imported_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                file_hash TEXT NOT NULL UNIQUE,
+                file_path TEXT,
+                message_count INTEGER DEFAULT 0,
+                parser_version INTEGER DEFAULT 0,
+                imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (chat_id) REFERENCES chats(id)
+            )
+        ''')
+        
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS patterns (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -545,6 +813,146 @@ class Database:
             except:
                 pass
         
+        # Migración: último mensaje incluido en el análisis con IA (análisis incremental)
+        if 'ai_watermark_message_id' not in existing_columns:
+            try:
+                self.cursor.execute('ALTER TABLE persons ADD COLUMN ai_watermark_message_id INTEGER')
+                self.conn.commit()
+            except:
+                pass
+        
+        # Migración: versión del parser con que se leyó cada archivo importado
+        self.cursor.execute("PRAGMA table_info(imported_files)")
+        if 'parser_version' not in {row[1] for row in self.cursor.fetchall()}:
+            try:
+                self.cursor.execute('ALTER TABLE imported_files ADD COLUMN parser_version INTEGER DEFAULT 0')
+                self.conn.commit()
+            except:
+                pass
+        
+        # Migración: clave de deduplicación de mensajes (importación incremental)
+        self.cursor.execute("PRAGMA table_info(messages)")
+        message_columns = {row[1] for row in self.cursor.fetchall()}
+        if 'message_key' not in message_columns:
+            try:
+                self.cursor.execute('ALTER TABLE messages ADD COLUMN message_key TEXT')
+                self.conn.commit()
+            except:
+                pass
+        self.cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_key
+            ON messages(chat_id, message_key)
+        ''')
+        self.conn.commit()
+        self._backfill_message_keys()
+        
+        # Migración: índices para evitar escaneos completos en las vistas por persona
+        self._create_indexes()
+        
+        # Migración: contadores materializados para el dashboard
+        self._create_stats_counters()
+    
+    def _backfill_message_keys(self):
+        """Da clave a los mensajes importados antes de que existiera message_key.
+        
+        Sin ella la siguiente importación volvería a insertar todo el historial. Los duplicados
+        exactos que dejaron las versiones antiguas se quedan sin clave (el índice es único).
+        """
+        if self.get_setting('message_keys_backfilled'):
+            return
+        self.cursor.execute('''
+            SELECT m.id, m.chat_id, p.name, m.timestamp, m.content
+            FROM messages m LEFT JOIN persons p ON m.person_id = p.id
+            WHERE m.message_key IS NULL
+            ORDER BY m.id
+        ''')
+        seen = set()
+        updates = []
+        for row in self.cursor.fetchall():
+            key = legacy_message_key(row['name'], row['timestamp'], row['content'])
+            if (row['chat_id'], key) in seen:
+                continue
+            seen.add((row['chat_id'], key))
+            updates.append((key, row['id']))
+        self.cursor.executemany('UPDATE messages SET message_key = ? WHERE id = ?', updates)
+        self.set_setting('message_keys_backfilled', '1')
+    
+    def _create_indexes(self):
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing_indexes = {row[0] for row in self.cursor.fetchall()}
+        
+        for name in DB_OBSOLETE_INDEXES:
+            if name in existing_indexes:
+                self.cursor.execute(f'DROP INDEX IF EXISTS {name}')
+        
+        created = False
+        for name, table, columns in DB_INDEXES:
+            if name not in existing_indexes:
+                self.cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+                created = True
+        if created:
+            self.cursor.execute('ANALYZE')
+        self.conn.commit()
+    
+    def _create_stats_counters(self):
+        """Tabla stats_counters mantenida por triggers para que el dashboard no haga COUNT(*)"""
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats_counters'")
+        is_new = self.cursor.fetchone() is None
+        
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self._create_stats_triggers()
+        self.conn.commit()
+        
+        if is_new:
+            self.rebuild_stats_counters()
+    
+    def _create_stats_triggers(self):
+        for trigger_sql in STATS_COUNTER_TRIGGERS:
+            self.cursor.execute(trigger_sql)
+    
+    def _drop_stats_triggers(self, names: List[str]):
+        """Suspende triggers de contadores; deben recrearse en la misma transacción"""
+        if not self.conn.in_transaction:
+            self.cursor.execute('BEGIN')  # El DDL no abre transacción por sí solo
+        for name in names:
+            self.cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    
+    def rebuild_stats_counters(self):
+        """Recalcula todos los contadores desde cero (solo al crear la tabla o para repararla)"""
+        # Los aciertos/fallos de la caché de IA no se pueden recalcular: se conservan
+        self.cursor.execute(
+            f"DELETE FROM stats_counters WHERE name NOT IN ({', '.join('?' * len(LLM_CACHE_COUNTERS))})",
+            LLM_CACHE_COUNTERS
+        )
+        self.cursor.execute('''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'messages', COUNT(*) FROM messages
+            UNION ALL SELECT 'patterns', COUNT(*) FROM patterns
+            UNION ALL SELECT 'tasks', COUNT(*) FROM tasks
+            UNION ALL SELECT 'persons_active', COUNT(*) FROM persons WHERE total_messages > 0
+        ''')
+        self.cursor.execute('''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'tasks:' || COALESCE(status, ''), COUNT(*) FROM tasks GROUP BY COALESCE(status, '')
+        ''')
+        self.conn.commit()
+    
+    def get_query_plan_report(self) -> str:
+        """Compara el plan de ejecución de las consultas principales sin índices (NOT INDEXED) y con ellos"""
+        lines = []
+        for label, query, params in QUERY_PLAN_CHECKS:
+            lines.append(f"== {label} ==")
+            for title, hint in (('antes', 'NOT INDEXED'), ('después', '')):
+                self.cursor.execute('EXPLAIN QUERY PLAN ' + query.format(hint=hint), params)
+                plan = '; '.join(row[3] for row in self.cursor.fetchall())
+                lines.append(f"  {title}: {plan}")
+        return "\n".join(lines)
+        
     def add_chat(self, name: str, chat_type: str = 'group', file_path: str = None) -> int:
         self.cursor.execute(
             'INSERT INTO chats (name, type, file_path) VALUES (?, ?, ?)',
@@ -553,6 +961,49 @@ class Database:
         self.conn.commit()
         return self.cursor.lastrowid
     
+    def get_chat_by_name(self, name: str) -> Optional[Dict]:
+        self.cursor.execute('SELECT * FROM chats WHERE name = ? ORDER BY id LIMIT 1', (name,))
+        row = self.cursor.fetchone()
+        return dict(row) if row else None
+    
+    def is_file_imported(self, file_hash: str) -> bool:
+        """Si el archivo ya se importó con la versión actual del parser (las anteriores perdían mensajes)"""
+        self.cursor.execute(
+            'SELECT 1 FROM imported_files WHERE file_hash = ? AND parser_version >= ?',
+            (file_hash, HTML_PARSER_VERSION)
+        )
+        return self.cursor.fetchone() is not None
+    
+    def add_imported_file(self, chat_id: int, file_hash: str, file_path: str, message_count: int = 0):
+        self.cursor.execute('''
+            INSERT INTO imported_files (chat_id, file_hash, file_path, message_count, parser_version)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(file_hash) DO UPDATE SET
+                file_path = excluded.file_path, message_count = excluded.message_count,
+                parser_version = excluded.parser_version, imported_at = CURRENT_TIMESTAMP
+        ''', (chat_id, file_hash, file_path, message_count, HTML_PARSER_VERSION))
+        self.conn.commit()
+    
+    def get_message_keys(self, chat_id: int) -> set:
+        """Claves de deduplicación de los mensajes ya guardados en un chat"""
+        self.cursor.execute(
+            'SELECT message_key FROM messages WHERE chat_id = ? AND message_key IS NOT NULL',
+            (chat_id,)
+        )
+        return {row[0] for row in self.cursor.fetchall()}
+    
+    def refresh_message_counts(self, chat_id: int, person_ids: List[int]):
+        """Recalcula total_messages de chat y personas a partir de la tabla messages"""
+        self.cursor.execute('''
+            UPDATE chats SET total_messages = (SELECT COUNT(*) FROM messages WHERE chat_id = ?)
+            WHERE id = ?
+        ''', (chat_id, chat_id))
+        self.cursor.executemany('''
+            UPDATE persons SET total_messages = (SELECT COUNT(*) FROM messages WHERE person_id = ?)
+            WHERE id = ?
+        ''', [(person_id, person_id) for person_id in person_ids])
+        self.conn.commit()
+    
     def get_all_chats(self) -> List[Dict]:
         self.cursor.execute('SELECT * FROM chats ORDER BY import_date DESC')
         return [dict(row) for row in self.cursor.fetchall()]
@@ -587,6 +1038,31 @@ class Database:
         )
         return [dict(row) for row in self.cursor.fetchall()]
     
+    def get_all_persons_with_skills(self, min_messages: int = 1, skills_limit: int = 3) -> List[Dict]:
+        """Personas con sus mejores skills en una sola consulta (sin N+1)"""
+        self.cursor.execute('''
+            SELECT p.*, COALESCE((
+                SELECT json_group_array(json_object('name', top.name, 'category', top.category, 'score', top.score))
+                FROM (
+                    SELECT s.name, s.category, ps.score
+                    FROM person_skills ps
+                    JOIN skills s ON ps.skill_id = s.id
+                    WHERE ps.person_id = p.id
+                    ORDER BY ps.score DESC
+                    LIMIT ?
+                ) top
+            ), '[]') AS skills_json
+            FROM persons p
+            WHERE p.total_messages >= ?
+            ORDER BY p.total_messages DESC
+        ''', (skills_limit, min_messages))
+        persons = []
+        for row in self.cursor.fetchall():
+            person = dict(row)
+            person['skills'] = json.loads(person.pop('skills_json'))
+            persons.append(person)
+        return persons
+    
     def get_me(self) -> Optional[Dict]:
         self.cursor.execute('SELECT * FROM persons WHERE is_me = 1')
         row = self.cursor.fetchone()
@@ -598,7 +1074,7 @@ class Database:
         self.conn.commit()
     
     def update_person(self, person_id: int, **kwargs):
-        allowed = ['name', 'role', 'role_confidence', 'profile_summary', 'total_messages', 'is_me', 'ai_analyzed', 'ai_analyzed_at', 'sentiment', 'sentiment_score', 'avatar_path']
+        allowed = ['name', 'role', 'role_confidence', 'profile_summary', 'total_messages', 'is_me', 'ai_analyzed', 'ai_analyzed_at', 'sentiment', 'sentiment_score', 'avatar_path', 'ai_watermark_message_id']
         updates = []
         values = []
         for key, value in kwargs.items():
@@ -615,7 +1091,11 @@ class Database:
     
     def delete_person(self, person_id: int):
         """Elimina una persona y todos sus datos asociados"""
-        # Eliminar mensajes de la persona
+        # Eliminar mensajes de la persona (y sus adjuntos)
+        self.cursor.execute(
+            'DELETE FROM attachments WHERE message_id IN (SELECT id FROM messages WHERE person_id = ?)',
+            (person_id,)
+        )
         self.cursor.execute('DELETE FROM messages WHERE person_id = ?', (person_id,))
         # Eliminar skills asociados
         self.cursor.execute('DELETE FROM person_skills WHERE person_id = ?', (person_id,))
@@ -674,7 +1154,46 @@ class Database:
         self.conn.commit()
         return self.cursor.lastrowid
     
-    def get_all_tasks(self, status: str = None, person_id: int = None) -> List[Dict]:
+    def upsert_task(self, title: str, assigned_to: int, description: str = None, status: str = 'pending',
+                    priority: str = 'medium', due_date: str = None, category: str = 'general',
+                    source_message: str = None) -> int:
+        """Actualiza la tarea con el mismo título de la persona o la crea si no existe.
+        
+        En una tarea existente el estado solo avanza (pending → in_progress → completed) y la
+        prioridad guardada se conserva, para no deshacer lo que el usuario haya cambiado.
+        """
+        self.cursor.execute('''
+            SELECT id, status FROM tasks WHERE assigned_to IS ? AND LOWER(TRIM(title)) = LOWER(TRIM(?))
+        ''', (assigned_to, title))
+        existing = self.cursor.fetchone()
+        if not existing:
+            return self.add_task(title=title, description=description, status=status, priority=priority,
+                                 category=category, assigned_to=assigned_to,
+                                 source_message=source_message, due_date=due_date)
+        current = existing['status']
+        if (current in TASK_STATUS_PROGRESSION and status in TASK_STATUS_PROGRESSION
+                and TASK_STATUS_PROGRESSION.index(status) > TASK_STATUS_PROGRESSION.index(current)):
+            completed_at = datetime.now().isoformat() if status == 'completed' else None
+            self.cursor.execute(
+                'UPDATE tasks SET status = ?, completed_at = ? WHERE id = ?',
+                (status, completed_at, existing['id'])
+            )
+        self.cursor.execute('''
+            UPDATE tasks SET
+                description = COALESCE(NULLIF(?, ''), description),
+                due_date = COALESCE(?, due_date)
+            WHERE id = ?
+        ''', (description, due_date, existing['id']))
+        self.conn.commit()
+        return existing['id']
+    
+    def get_all_tasks(self, status: str = None, person_id: int = None, limit: int = None,
+                      after: Dict = None, order_by_category: bool = False) -> List[Dict]:
+        """Tareas ordenadas por estado, prioridad y fecha.
+        
+        Paginación por keyset: limit fija el tamaño de página y after es la última
+        tarea de la página anterior (con el mismo status/person_id/order_by_category).
+        """
         conditions = []
         params = []
         
@@ -686,22 +1205,26 @@ class Database:
             conditions.append("t.assigned_to = ?")
             params.append(person_id)
         
+        sort_columns = (TASK_CATEGORY_SORT_COLUMNS if order_by_category else []) + TASK_SORT_COLUMNS
+        if after:
+            keyset_sql, keyset_params = _keyset_condition(sort_columns, [after[alias] for _, _, alias in sort_columns])
+            conditions.append(keyset_sql)
+            params.extend(keyset_params)
+        
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        select_keys = ', '.join(f"{expr} AS {alias}" for expr, _, alias in sort_columns if alias != 'id')
+        order_by = ', '.join(f"{expr} {direction}" for expr, direction, _ in sort_columns)
+        limit_clause = "LIMIT ?" if limit else ""
+        if limit:
+            params.append(limit)
         
         query = f'''
-            SELECT t.*, p.name as assigned_to_name
+            SELECT t.*, p.name as assigned_to_name, {select_keys}
             FROM tasks t
             LEFT JOIN persons p ON t.assigned_to = p.id
             {where_clause}
-            ORDER BY 
-                CASE t.status WHEN 'completed' THEN 1 ELSE 0 END,
-                CASE t.priority 
-                    WHEN 'urgent' THEN 1 
-                    WHEN 'high' THEN 2 
-                    WHEN 'medium' THEN 3 
-                    ELSE 4 
-                END,
-                t.created_at DESC
+            ORDER BY {order_by}
+            {limit_clause}
         '''
         
         self.cursor.execute(query, params)
@@ -713,8 +1236,10 @@ class Database:
             return []
         return self.get_tasks_for_person(me['id'])
     
-    def get_tasks_grouped_by_category(self, status: str = None, person_id: int = None) -> Dict[str, List[Dict]]:
-        tasks = self.get_all_tasks(status, person_id)
+    def get_tasks_grouped_by_category(self, status: str = None, person_id: int = None, limit: int = None,
+                                      after: Dict = None) -> Dict[str, List[Dict]]:
+        """Tareas agrupadas por categoría (en el orden de TASK_CATEGORY_ORDER), paginables como get_all_tasks"""
+        tasks = self.get_all_tasks(status, person_id, limit=limit, after=after, order_by_category=True)
         grouped = {}
         for task in tasks:
             category = task.get('category', 'general') or 'general'
@@ -723,6 +1248,23 @@ class Database:
             grouped[category].append(task)
         return grouped
     
+    def get_task_counts_by_category(self, status: str = None, person_id: int = None) -> Dict[str, int]:
+        conditions = []
+        params = []
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if person_id:
+            conditions.append("assigned_to = ?")
+            params.append(person_id)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        self.cursor.execute(f'''
+            SELECT COALESCE(NULLIF(category, ''), 'general') as category, COUNT(*) as count
+            FROM tasks {where_clause}
+            GROUP BY COALESCE(NULLIF(category, ''), 'general')
+        ''', params)
+        return {row['category']: row['count'] for row in self.cursor.fetchall()}
+    
     def get_task_categories(self) -> List[str]:
         self.cursor.execute('SELECT DISTINCT category FROM tasks WHERE category IS NOT NULL')
         return [row['category'] for row in self.cursor.fetchall()]
@@ -753,17 +1295,118 @@ class Database:
         self.conn.commit()
         return self.cursor.lastrowid
     
-    def get_messages_for_person(self, person_id: int) -> List[Dict]:
-        """Obtiene todos los mensajes de una persona"""
+    def add_messages_bulk(self, chat_id: int, rows, batch_size: int = 5000, on_batch=None) -> int:
+        """Inserta mensajes (person_id, content, timestamp, message_key) con executemany en una sola transacción.
+        
+        Los mensajes cuya clave ya existe en el chat se ignoran. on_batch(procesados)
+        se llama tras cada lote para informar del progreso. Devuelve los insertados.
+        """
+        inserted = 0
+        processed = 0
+        batch = []
+        try:
+            # Sin trigger por fila: el contador se actualiza una vez con el total insertado.
+            # La transacción mantiene el bloqueo de escritura, así que nadie inserta sin trigger
+            self._drop_stats_triggers(STATS_BULK_MESSAGE_TRIGGERS)
+            for person_id, content, timestamp, message_key in rows:
+                batch.append((chat_id, person_id, content, timestamp, message_key))
+                if len(batch) >= batch_size:
+                    inserted += self._insert_message_batch(batch)
+                    processed += len(batch)
+                    batch = []
+                    if on_batch:
+                        on_batch(processed)
+            if batch:
+                inserted += self._insert_message_batch(batch)
+                processed += len(batch)
+                if on_batch:
+                    on_batch(processed)
+            self.cursor.execute(_counter_upsert("'messages'", str(int(inserted))))
+            self._create_stats_triggers()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return inserted
+    
+    def _insert_message_batch(self, batch: List[tuple]) -> int:
+        self.cursor.executemany('''
+            INSERT OR IGNORE INTO messages (chat_id, person_id, content, timestamp, message_key)
+            VALUES (?, ?, ?, ?, ?)
+        ''', batch)
+        return max(self.cursor.rowcount, 0)
+    
+    def add_attachments_bulk(self, chat_id: int, rows) -> int:
+        """Guarda adjuntos (message_key, media_type, file_path, file_size, duration) de mensajes ya insertados.
+        
+        El mensaje se localiza por su clave de deduplicación en el chat; los que ya
+        tienen adjunto se ignoran. Devuelve los insertados.
+        """
+        try:
+            self.cursor.executemany('''
+                INSERT OR IGNORE INTO attachments (message_id, media_type, file_path, file_size, duration)
+                SELECT id, ?, ?, ?, ? FROM messages WHERE chat_id = ? AND message_key = ?
+            ''', ((media_type, file_path, file_size, duration, chat_id, message_key)
+                  for message_key, media_type, file_path, file_size, duration in rows))
+            inserted = max(self.cursor.rowcount, 0)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return inserted
+    
+    def get_media_stats(self, person_id: int = None) -> Dict[str, Dict]:
+        """Adjuntos por tipo (cantidad, bytes y segundos totales), de una persona o de todas"""
+        where = 'WHERE m.person_id = ?' if person_id is not None else ''
+        self.cursor.execute(f'''
+            SELECT a.media_type, COUNT(*) as count,
+                   COALESCE(SUM(a.file_size), 0) as total_size,
+                   COALESCE(SUM(a.duration), 0) as total_duration
+            FROM messages m
+            JOIN attachments a ON a.message_id = m.id
+            {where}
+            GROUP BY a.media_type
+            ORDER BY count DESC
+        ''', (person_id,) if person_id is not None else ())
+        return {row['media_type']: dict(row) for row in self.cursor.fetchall()}
+    
+    def get_messages_for_person(self, person_id: int, after_id: int = None) -> List[Dict]:
+        """Obtiene los mensajes de una persona (solo los de id > after_id si se indica)"""
         self.cursor.execute('''
             SELECT m.*, p.name as sender_name
             FROM messages m
             JOIN persons p ON m.person_id = p.id
-            WHERE m.person_id = ?
+            WHERE m.person_id = ? AND m.id > ?
             ORDER BY m.timestamp ASC
-        ''', (person_id,))
+        ''', (person_id, after_id or 0))
         return [dict(row) for row in self.cursor.fetchall()]
     
+    def get_person_analysis_snapshot(self, person_id: int) -> Optional[Dict]:
+        """Estado actual del perfil analizado de una persona (para el análisis incremental)"""
+        person = self.get_person_with_skills(person_id)
+        if not person:
+            return None
+        self.cursor.execute('''
+            SELECT title, status, priority, due_date FROM tasks
+            WHERE assigned_to = ? ORDER BY created_at DESC
+        ''', (person_id,))
+        person['tasks'] = [dict(row) for row in self.cursor.fetchall()]
+        self.cursor.execute('''
+            SELECT title, commitment_type, status, due_date FROM commitments
+            WHERE person_id = ? ORDER BY created_at DESC
+        ''', (person_id,))
+        person['commitments'] = [dict(row) for row in self.cursor.fetchall()]
+        self.cursor.execute('''
+            SELECT name, status FROM projects WHERE client_id = ? ORDER BY created_at DESC
+        ''', (person_id,))
+        person['projects'] = [dict(row) for row in self.cursor.fetchall()]
+        self.cursor.execute('''
+            SELECT alert_type, severity, title FROM behavior_alerts
+            WHERE person_id = ? AND is_dismissed = 0 ORDER BY created_at DESC
+        ''', (person_id,))
+        person['alerts'] = [dict(row) for row in self.cursor.fetchall()]
+        return person
+    
     def get_all_messages(self) -> List[Dict]:
         """Obtiene todos los mensajes con información del remitente"""
         self.cursor.execute('''
@@ -800,28 +1443,21 @@ class Database:
         return patterns
     
     def get_dashboard_stats(self) -> Dict:
-        stats = {}
-        self.cursor.execute('SELECT COUNT(*) as count FROM persons WHERE total_messages > 0')
-        stats['total_persons'] = self.cursor.fetchone()['count']
-        
-        self.cursor.execute('SELECT status, COUNT(*) as count FROM tasks GROUP BY status')
-        stats['tasks_by_status'] = {row['status']: row['count'] for row in self.cursor.fetchall()}
-        
-        self.cursor.execute('SELECT COUNT(*) as count FROM tasks')
-        stats['total_tasks'] = self.cursor.fetchone()['count']
-        
-        self.cursor.execute('SELECT COUNT(*) as count FROM messages')
-        stats['total_messages'] = self.cursor.fetchone()['count']
-        
-        self.cursor.execute('SELECT COUNT(*) as count FROM patterns')
-        stats['total_patterns'] = self.cursor.fetchone()['count']
-        
-        self.cursor.execute('SELECT COUNT(*) as count FROM tasks WHERE status = "pending"')
-        stats['pending_tasks'] = self.cursor.fetchone()['count']
-        
-        self.cursor.execute('SELECT COUNT(*) as count FROM tasks WHERE status = "completed"')
-        stats['completed_tasks'] = self.cursor.fetchone()['count']
+        # Una sola lectura de la tabla de contadores (mantenida por triggers)
+        self.cursor.execute('SELECT name, value FROM stats_counters')
+        counters = {row['name']: row['value'] for row in self.cursor.fetchall()}
         
+        stats = {}
+        stats['total_persons'] = counters.get('persons_active', 0)
+        stats['tasks_by_status'] = {
+            name[len('tasks:'):]: value for name, value in counters.items()
+            if name.startswith('tasks:') and value > 0
+        }
+        stats['total_tasks'] = counters.get('tasks', 0)
+        stats['total_messages'] = counters.get('messages', 0)
+        stats['total_patterns'] = counters.get('patterns', 0)
+        stats['pending_tasks'] = counters.get('tasks:pending', 0)
+        stats['completed_tasks'] = counters.get('tasks:completed', 0)
         return stats
     
     def get_person_stats(self, person_id: int) -> Dict:
@@ -842,6 +1478,8 @@ class Database:
         result = self.cursor.fetchone()
         stats['avg_skill_score'] = result['avg'] if result['avg'] else 0
         
+        stats['media'] = self.get_media_stats(person_id)
+        
         return stats
     
     def set_setting(self, key: str, value: str):
@@ -857,14 +1495,140 @@ class Database:
         return result['value'] if result else default
     
     def clear_all_data(self):
-        tables = ['messages', 'person_skills', 'tasks', 'patterns', 'persons', 'skills', 'chats', 'links', 'objectives', 'projects']
+        tables = ['attachments', 'messages', 'person_skills', 'tasks', 'patterns', 'persons', 'skills', 'chats', 'links', 'objectives', 'projects', 'imported_files']
+        # Los triggers de contadores se disparan por fila: se suspenden y los contadores se ponen a cero
+        self._drop_stats_triggers(STATS_COUNTER_TRIGGER_NAMES)
         for table in tables:
             try:
                 self.cursor.execute(f'DELETE FROM {table}')
             except:
                 pass
+        self._create_stats_triggers()
+        self.rebuild_stats_counters()
+    
+    # === CACHÉ DE RESPUESTAS DE IA ===
+    def get_cached_llm_response(self, cache_key: str, ttl_seconds: int = LLM_CACHE_TTL_SECONDS) -> Optional[str]:
+        """Devuelve la respuesta guardada si existe y no ha caducado, y cuenta el acierto/fallo"""
+        now = datetime.now().timestamp()
+        self.cursor.execute(
+            'SELECT response FROM llm_cache WHERE cache_key = ? AND created_at >= ?',
+            (cache_key, now - ttl_seconds)
+        )
+        row = self.cursor.fetchone()
+        if row:
+            self.cursor.execute(
+                'UPDATE llm_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?',
+                (now, cache_key)
+            )
+        self.cursor.execute(
+            _counter_upsert('?', '1'), ('llm_cache:hits' if row else 'llm_cache:misses',)
+        )
+        self.conn.commit()
+        return row['response'] if row else None
+    
+    def set_cached_llm_response(self, cache_key: str, provider: str, model: str, response: str,
+                                ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+                                max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        now = datetime.now().timestamp()
+        self.cursor.execute('''
+            INSERT OR REPLACE INTO llm_cache (cache_key, provider, model, response, created_at, last_used_at, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        ''', (cache_key, provider, model, response, now, now))
+        self.conn.commit()
+        self.evict_llm_cache(ttl_seconds, max_entries)
+    
+    def evict_llm_cache(self, ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+                        max_entries: int = LLM_CACHE_MAX_ENTRIES) -> int:
+        """Elimina las respuestas caducadas y las menos usadas por encima de max_entries"""
+        self.cursor.execute('DELETE FROM llm_cache WHERE created_at < ?',
+                            (datetime.now().timestamp() - ttl_seconds,))
+        removed = self.cursor.rowcount
+        self.cursor.execute('''
+            DELETE FROM llm_cache WHERE cache_key IN (
+                SELECT cache_key FROM llm_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
+        removed += self.cursor.rowcount
+        self.conn.commit()
+        return removed
+    
+    def get_llm_cache_stats(self) -> Dict:
+        self.cursor.execute('''
+            SELECT COUNT(*) as entries, COALESCE(SUM(LENGTH(response)), 0) as size
+            FROM llm_cache
+        ''')
+        row = self.cursor.fetchone()
+        self.cursor.execute(
+            f"SELECT name, value FROM stats_counters WHERE name IN ({', '.join('?' * len(LLM_CACHE_COUNTERS))})",
+            LLM_CACHE_COUNTERS
+        )
+        counters = {r['name']: r['value'] for r in self.cursor.fetchall()}
+        hits = counters.get('llm_cache:hits', 0)
+        misses = counters.get('llm_cache:misses', 0)
+        return {
+            'entries': row['entries'],
+            'size_bytes': row['size'],
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
+    
+    def clear_llm_cache(self):
+        self.cursor.execute('DELETE FROM llm_cache')
+        self.cursor.execute(
+            f"DELETE FROM stats_counters WHERE name IN ({', '.join('?' * len(LLM_CACHE_COUNTERS))})",
+            LLM_CACHE_COUNTERS
+        )
+        self.conn.commit()
+    
+    # === TRABAJOS BATCH DE IA ===
+    def add_ai_batch_job(self, provider: str, model: str, backend: str, input_path: str,
+                         requests: List[Dict]) -> int:
+        """Registra un trabajo por lotes con sus peticiones (antes de enviarlo al proveedor)"""
+        self.cursor.execute('''
+            INSERT INTO ai_batch_jobs (provider, model, backend, input_path, request_count)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (provider, model, backend, input_path, len(requests)))
+        job_id = self.cursor.lastrowid
+        self.cursor.executemany('''
+            INSERT INTO ai_batch_requests
+            (job_id, custom_id, schema, person_id, watermark_message_id, prompt, system_prompt)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(job_id, r['custom_id'], r['schema'], r.get('person_id'), r.get('watermark'),
+               r['prompt'], r.get('system_prompt')) for r in requests])
+        self.conn.commit()
+        return job_id
+    
+    def update_ai_batch_job(self, job_id: int, status: str, remote_id: str = None, error: str = None):
+        self.cursor.execute('''
+            UPDATE ai_batch_jobs SET status = ?, remote_id = COALESCE(?, remote_id),
+                error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, remote_id, error, job_id))
         self.conn.commit()
     
+    def get_pending_ai_batch_jobs(self, provider: str = None) -> List[Dict]:
+        """Trabajos enviados cuyos resultados aún no se han ingerido"""
+        if provider:
+            self.cursor.execute('''
+                SELECT * FROM ai_batch_jobs WHERE status IN ('submitted', 'running') AND provider = ?
+                ORDER BY created_at ASC
+            ''', (provider,))
+        else:
+            self.cursor.execute('''
+                SELECT * FROM ai_batch_jobs WHERE status IN ('submitted', 'running')
+                ORDER BY created_at ASC
+            ''')
+        return [dict(row) for row in self.cursor.fetchall()]
+    
+    def get_ai_batch_requests(self, job_id: int) -> List[Dict]:
+        self.cursor.execute('SELECT * FROM ai_batch_requests WHERE job_id = ?', (job_id,))
+        return [dict(row) for row in self.cursor.fetchall()]
+    
+    def get_ai_batch_jobs(self, limit: int = 20) -> List[Dict]:
+        self.cursor.execute('SELECT * FROM ai_batch_jobs ORDER BY created_at DESC, id DESC LIMIT ?', (limit,))
+        return [dict(row) for row in self.cursor.fetchall()]
+    
     # === FUNCIONES DE ENLACES ===
     def add_link(self, url: str, title: str = None, link_type: str = 'general', 
                  context: str = None, shared_by: int = None, mention_count: int = 1) -> int:
@@ -922,6 +1686,25 @@ class Database:
         self.conn.commit()
         return self.cursor.lastrowid
     
+    def upsert_commitment(self, person_id: int, title: str, commitment_type: str = 'promise',
+                          due_date: str = None, evidence: str = None) -> int:
+        """Actualiza el compromiso con el mismo título de la persona o lo crea si no existe"""
+        self.cursor.execute('''
+            SELECT id FROM commitments WHERE person_id = ? AND LOWER(TRIM(title)) = LOWER(TRIM(?))
+        ''', (person_id, title))
+        existing = self.cursor.fetchone()
+        if not existing:
+            return self.add_commitment(person_id=person_id, title=title, commitment_type=commitment_type,
+                                       due_date=due_date, evidence=evidence)
+        self.cursor.execute('''
+            UPDATE commitments SET commitment_type = ?,
+                due_date = COALESCE(?, due_date),
+                evidence = COALESCE(NULLIF(?, ''), evidence)
+            WHERE id = ?
+        ''', (commitment_type, due_date, evidence, existing['id']))
+        self.conn.commit()
+        return existing['id']
+    
     def get_all_commitments(self, status: str = None) -> List[Dict]:
         if status:
             self.cursor.execute('''
@@ -981,6 +1764,24 @@ class Database:
         self.conn.commit()
         return self.cursor.lastrowid
     
+    def upsert_project(self, name: str, client_id: int, description: str = None, status: str = None) -> int:
+        """Actualiza el proyecto con el mismo nombre de la persona o lo crea si no existe"""
+        self.cursor.execute('''
+            SELECT id FROM projects WHERE client_id = ? AND LOWER(TRIM(name)) = LOWER(TRIM(?))
+        ''', (client_id, name))
+        existing = self.cursor.fetchone()
+        if not existing:
+            project_id = self.add_project(name=name, description=description, client_id=client_id)
+        else:
+            project_id = existing['id']
+            self.cursor.execute('''
+                UPDATE projects SET description = COALESCE(NULLIF(?, ''), description) WHERE id = ?
+            ''', (description, project_id))
+        if status:
+            self.cursor.execute('UPDATE projects SET status = ? WHERE id = ?', (status, project_id))
+        self.conn.commit()
+        return project_id
+    
     def get_all_projects(self) -> List[Dict]:
         self.cursor.execute('''
             SELECT p.*, c.name as client_name
@@ -1026,6 +1827,30 @@ class Database:
         self.conn.commit()
         return self.cursor.lastrowid
     
+    def upsert_behavior_alert(self, person_id: int, alert_type: str, title: str,
+                              description: str = None, severity: str = 'medium', evidence: str = None,
+                              message_examples: str = None, recommendation: str = None) -> int:
+        """Actualiza la alerta del mismo tipo y título (sin tocar is_dismissed) o la crea"""
+        self.cursor.execute('''
+            SELECT id FROM behavior_alerts
+            WHERE person_id = ? AND alert_type = ? AND LOWER(TRIM(title)) = LOWER(TRIM(?))
+        ''', (person_id, alert_type, title))
+        existing = self.cursor.fetchone()
+        if not existing:
+            return self.add_behavior_alert(person_id=person_id, alert_type=alert_type, title=title,
+                                           description=description, severity=severity, evidence=evidence,
+                                           message_examples=message_examples, recommendation=recommendation)
+        self.cursor.execute('''
+            UPDATE behavior_alerts SET severity = ?,
+                description = COALESCE(NULLIF(?, ''), description),
+                evidence = COALESCE(NULLIF(?, ''), evidence),
+                message_examples = COALESCE(NULLIF(?, '[]'), message_examples),
+                recommendation = COALESCE(NULLIF(?, ''), recommendation)
+            WHERE id = ?
+        ''', (severity, description, evidence, message_examples, recommendation, existing['id']))
+        self.conn.commit()
+        return existing['id']
+    
     def get_alerts_for_person(self, person_id: int, include_dismissed: bool = False) -> List[Dict]:
         if include_dismissed:
             self.cursor.execute('''
@@ -1083,47 +1908,646 @@ class Database:
     
     # === FUNCIONES DE ACTIVIDAD ===
     def get_activity_by_date(self, person_id: int = None) -> List[Dict]:
+        # Día local del mensaje: DATE() pasaría a UTC las fechas que llevan zona horaria
         if person_id:
             self.cursor.execute('''
-                SELECT DATE(timestamp) as date, COUNT(*) as count
+                SELECT SUBSTR(timestamp, 1, 10) as date, COUNT(*) as count
                 FROM messages WHERE person_id = ?
-                GROUP BY DATE(timestamp)
+                GROUP BY SUBSTR(timestamp, 1, 10)
                 ORDER BY date DESC
                 LIMIT 30
             ''', (person_id,))
         else:
             self.cursor.execute('''
-                SELECT DATE(timestamp) as date, COUNT(*) as count
+                SELECT SUBSTR(timestamp, 1, 10) as date, COUNT(*) as count
                 FROM messages
-                GROUP BY DATE(timestamp)
+                GROUP BY SUBSTR(timestamp, 1, 10)
                 ORDER BY date DESC
                 LIMIT 30
             ''')
         return [dict(row) for row in self.cursor.fetchall()]
 
 
-# ============================================================
-# PARSER DE TELEGRAM
-# ============================================================
-
+class ConnectionManager:
+    """Entrega una conexión Database lista por hilo para una ruta de BD.
+    
+    Los QThread piden su conexión con connection() y la cierran con release() al
+    terminar; nunca comparten la conexión de otro hilo.
+    """
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+    
+    def connection(self) -> Database:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = Database(self.db_path)
+            db.connect()
+            self._local.db = db
+        return db
+    
+    def release(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+_connection_managers: Dict[str, ConnectionManager] = {}
+_connection_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path: str = "telegram_analyzer.db") -> ConnectionManager:
+    with _connection_managers_lock:
+        manager = _connection_managers.get(db_path)
+        if manager is None:
+            manager = ConnectionManager(db_path)
+            _connection_managers[db_path] = manager
+        return manager
+
+
+# ============================================================
+# PARSER DE TELEGRAM
+# ============================================================
+
+def _lxml_available() -> bool:
+    return importlib.util.find_spec('lxml') is not None
+
+
+def _lxml_text(element) -> str:
+    """Equivalente a get_text(strip=True) de BeautifulSoup"""
+    return ''.join(part.strip() for part in element.itertext())
+
+
+def _lxml_find_class(element, class_name: str):
+    """Primer descendiente con la clase dada (equivalente a select_one('.clase'))"""
+    for child in element.iterdescendants():
+        if class_name in (child.get('class') or '').split():
+            return child
+    return None
+
+
+def _lxml_has_message_ancestor(element) -> bool:
+    for ancestor in element.iterancestors('div'):
+        if 'message' in (ancestor.get('class') or '').split():
+            return True
+    return False
+
+
+# Clase CSS del contenedor de cada adjunto en las exportaciones HTML de Telegram -> tipo de mensaje
+# Se incrementa cuando el parser empieza a extraer mensajes que antes descartaba: los archivos
+# importados con una versión anterior se vuelven a leer (la deduplicación evita repetir mensajes)
+# 1: mensajes de servicio y adjuntos sin texto
+HTML_PARSER_VERSION = 1
+
+TELEGRAM_MEDIA_CLASSES = {
+    'photo_wrap': 'photo',
+    'media_photo': 'photo',
+    'video_file_wrap': 'video',
+    'media_video': 'video_message',
+    'animated_wrap': 'animation',
+    'sticker_wrap': 'sticker',
+    'media_voice_message': 'voice',
+    'media_audio_file': 'audio',
+    'media_file': 'file',
+    'media_poll': 'poll',
+    'media_contact': 'contact',
+    'media_location': 'location',
+    'media_live_location': 'location',
+    'media_call': 'call',
+    'media_game': 'game',
+    'media_invoice': 'invoice',
+}
+TELEGRAM_MEDIA_TYPES = frozenset(TELEGRAM_MEDIA_CLASSES.values())
+REPLY_TO_RE = re.compile(r'go_to_message(\d+)')
+MEDIA_DURATION_RE = re.compile(r'\b(?:(\d+):)?(\d{1,2}):(\d{2})\b')
+MEDIA_SIZE_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*(B|KB|MB|GB)\b')
+MEDIA_SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+DATE_SEPARATOR_ID_RE = re.compile(r'message-\d+$')  # Separadores de fecha ("message-1"), no son mensajes
+
+
+def parse_media_status(text: str) -> tuple:
+    """(tamaño en bytes, duración en segundos) del texto de estado de un adjunto.
+    
+    Telegram escribe cosas como "00:05, 12.3 KB" (notas de voz, audio, vídeo) o
+    "1.5 MB" (archivos); lo que falte se devuelve como None.
+    """
+    size = duration = None
+    match = MEDIA_SIZE_RE.search(text or '')
+    if match:
+        size = int(float(match.group(1).replace(',', '.')) * MEDIA_SIZE_UNITS[match.group(2)])
+    match = MEDIA_DURATION_RE.search(text or '')
+    if match:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+    return size, duration
+
+
+class LxmlNodes:
+    """Acceso a los nodos de lxml para TelegramHTMLParser._walk_message_element"""
+    
+    @staticmethod
+    def classed_descendants(node) -> list:
+        """(nodo, clases) de los descendientes con atributo class, en orden de documento"""
+        found = []
+        for child in node.iterdescendants():
+            classes = child.get('class')
+            if classes:
+                found.append((child, classes.split()))
+        return found
+    
+    @staticmethod
+    def classes(node) -> List[str]:
+        return (node.get('class') or '').split()
+    
+    text = staticmethod(_lxml_text)
+    
+    @staticmethod
+    def own_text(node) -> str:
+        """Texto propio del nodo, sin el de sus hijos (p. ej. la fecha dentro de from_name)"""
+        return (node.text or '').strip()
+    
+    @staticmethod
+    def link(node) -> str:
+        anchor = node.find('.//a')
+        return anchor.get('href', '') if anchor is not None else ''
+    
+    @staticmethod
+    def is_inside(node, container) -> bool:
+        return any(ancestor is container for ancestor in node.iterancestors())
+
+
+class SoupNodes:
+    """Acceso a los nodos de BeautifulSoup para TelegramHTMLParser._walk_message_element"""
+    
+    @staticmethod
+    def classed_descendants(node) -> list:
+        return [(child, child['class']) for child in node.find_all(class_=True)]
+    
+    @staticmethod
+    def classes(node) -> List[str]:
+        return node.get('class') or []
+    
+    @staticmethod
+    def text(node) -> str:
+        return node.get_text(strip=True)
+    
+    @staticmethod
+    def own_text(node) -> str:
+        return ''.join(node.find_all(string=True, recursive=False)).strip()
+    
+    @staticmethod
+    def link(node) -> str:
+        anchor = node.find('a')
+        return anchor.get('href', '') if anchor is not None else ''
+    
+    @staticmethod
+    def is_inside(node, container) -> bool:
+        return any(parent is container for parent in node.parents)
+
+
+MESSAGE_EPOCH = datetime(1970, 1, 1)
+NO_TIMESTAMP = -(2 ** 63)  # Mensaje sin fecha en la columna de timestamps
+NO_UTC_OFFSET = -(2 ** 31)  # Fecha sin zona horaria en la columna de desfases
+MESSAGE_ID_RE = re.compile(r'message(\d+)$')
+MESSAGE_COLUMNS = ('sender', 'content', 'timestamp', 'message_id', 'type', 'reply_to', 'forwarded_from',
+                   'media_path', 'media_size', 'media_duration')
+
+
+_FIXED_TIMEZONES = {}
+
+
+def fixed_timezone(offset_seconds: int) -> timezone:
+    """Zona horaria de desfase fijo, compartida entre todas las fechas con el mismo desfase"""
+    tz = _FIXED_TIMEZONES.get(offset_seconds)
+    if tz is None:
+        tz = _FIXED_TIMEZONES[offset_seconds] = timezone(timedelta(seconds=offset_seconds))
+    return tz
+
+
+def split_timestamp(timestamp: str) -> Optional[tuple]:
+    """(segundos epoch UTC, desfase UTC en segundos o None) de una fecha ISO; None si no lo es.
+    
+    Las fechas sin zona horaria se tratan como UTC.
+    """
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    offset = dt.utcoffset()
+    if offset is None:
+        return int((dt - MESSAGE_EPOCH).total_seconds()), None
+    return int((dt.replace(tzinfo=None) - offset - MESSAGE_EPOCH).total_seconds()), int(offset.total_seconds())
+
+
+def timestamp_to_epoch(timestamp: str) -> Optional[int]:
+    """Segundos epoch UTC de una fecha ISO (None si no es una fecha ISO)"""
+    parts = split_timestamp(timestamp) if timestamp else None
+    return parts[0] if parts else None
+
+
+def epoch_to_timestamp(epoch: int, offset: int = None) -> str:
+    if offset is None:
+        return (MESSAGE_EPOCH + timedelta(seconds=epoch)).isoformat()
+    local = MESSAGE_EPOCH + timedelta(seconds=epoch + offset)
+    return local.replace(tzinfo=fixed_timezone(offset)).isoformat()
+
+
+class TelegramDateParser:
+    """Convierte las fechas de la exportación a ISO 8601 conservando el desfase UTC.
+    
+    Una exportación de Telegram usa siempre el mismo formato ("02.04.2021 11:21:00 UTC+02:00"
+    en el title de .date), así que el formato se detecta con la primera fecha y las siguientes
+    se parsean con su regex precompilada; los valores repetidos salen de un memo. Si una
+    fecha no encaja se vuelve a detectar y, como último recurso, se prueba con strptime.
+    """
+    # Los rangos de cada campo se validan en la propia regex y la fecha ISO se compone
+    # directamente con los grupos, sin pasar por datetime
+    _DAY, _MONTH, _YEAR = r'(?P<d>0[1-9]|[12]\d|3[01])', r'(?P<mo>0[1-9]|1[0-2])', r'(?P<y>\d{4})'
+    _TIME = r'(?P<h>[01]\d|2[0-3]):(?P<mi>[0-5]\d)(?::(?P<s>[0-5]\d))?(?: ?(?:UTC)?(?P<off>[+-]\d{2}:\d{2}))?$'
+    FAST_FORMATS = [
+        re.compile(_DAY + r'\.' + _MONTH + r'\.' + _YEAR + ' ' + _TIME),  # Title de Telegram
+        re.compile(_YEAR + '-' + _MONTH + '-' + _DAY + '[ T]' + _TIME),
+        re.compile(_DAY + '/' + _MONTH + '/' + _YEAR + ' ' + _TIME),
+    ]
+    FALLBACK_FORMATS = [
+        '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M',
+        '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
+        '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M',
+        '%d %B %Y',  # Para fechas de servicio como "4 April 2021"
+    ]
+    MEMO_MAX_ENTRIES = 100000
+    
+    def __init__(self):
+        self._format = None  # Formato detectado en la exportación
+        self._memo = {}
+    
+    def parse(self, date_str: str) -> Optional[str]:
+        if not date_str:
+            return None
+        result = self._memo.get(date_str)
+        if result is not None:
+            return result
+        
+        value = date_str.strip()
+        result = self._parse_fast(value, self._format) if self._format else None
+        if result is None:
+            for fmt in self.FAST_FORMATS:
+                result = self._parse_fast(value, fmt)
+                if result is not None:
+                    self._format = fmt
+                    break
+            else:
+                result = self._parse_fallback(value)
+        
+        if len(self._memo) >= self.MEMO_MAX_ENTRIES:
+            self._memo.clear()
+        self._memo[date_str] = result
+        return result
+    
+    @staticmethod
+    def _parse_fast(value: str, pattern) -> Optional[str]:
+        match = pattern.match(value)
+        if not match:
+            return None
+        year, month, day, hour, minute, second, offset = match.group('y', 'mo', 'd', 'h', 'mi', 's', 'off')
+        if day > '28' and int(day) > calendar.monthrange(int(year), int(month))[1]:
+            return None  # La regex no conoce el calendario (31.02, 29.02 de años no bisiestos)
+        return f"{year}-{month}-{day}T{hour}:{minute}:{second or '00'}{offset or ''}"
+    
+    def _parse_fallback(self, value: str) -> str:
+        clean_date = re.sub(r'\s*UTC[+-]\d{2}:\d{2}', '', value).strip()
+        for fmt in self.FALLBACK_FORMATS:
+            try:
+                return datetime.strptime(clean_date, fmt).isoformat()
+            except ValueError:
+                continue
+        return value
+
+
+class MessageStore:
+    """Almacén columnar de los mensajes de un chat parseado.
+    
+    En lugar de un dict por mensaje guarda columnas compactas: remitente, autor del
+    reenvío y tipo como índices en tablas de valores internados, la fecha en segundos
+    epoch UTC (int64) con su desfase horario, los ids numéricos de Telegram (mensaje y
+    respuesta) y todo el texto en un único buffer UTF-8 con offsets. Se comporta como una
+    lista de mensajes (len, índice, iteración, extend) que crea los dicts bajo demanda, así
+    que el código que recibe List[Dict] lo acepta tal cual. Los valores que no caben en las
+    columnas (fechas sin parsear, ids no numéricos, otras claves) se guardan aparte.
+    Los adjuntos guardan su ruta en un segundo buffer y tamaño/duración en columnas (-1 = sin dato).
+    """
+    
+    def __init__(self, messages=None):
+        self.senders = []  # Nombres internados (remitentes y autores de reenvíos): la posición es su id
+        self._sender_ids = {}
+        self.types = ['text']  # Tipos de mensaje internados; 0 = texto
+        self._type_ids = {'text': 0}
+        self._sender_col = array('i')
+        self._timestamp_col = array('q')
+        self._offset_col = array('i')
+        self._message_id_col = array('q')
+        self._type_col = array('b')
+        self._reply_to_col = array('q')
+        self._forwarded_col = array('i')
+        self._media_size_col = array('q')
+        self._media_duration_col = array('i')
+        self._content = bytearray()
+        self._offsets = array('q', [0])
+        self._media_paths = bytearray()
+        self._media_path_offsets = array('q', [0])
+        self._extras = {}  # posición -> valores fuera de columna
+        self._sorted = True  # Fechas no decrecientes: los cortes por fecha usan bisección
+        if messages:
+            self.extend(messages)
+    
+    def _columns(self) -> tuple:
+        """Columnas numéricas en el orden de las filas de _append_columns"""
+        return (self._sender_col, self._timestamp_col, self._offset_col, self._message_id_col,
+                self._type_col, self._reply_to_col, self._forwarded_col,
+                self._media_size_col, self._media_duration_col)
+    
+    def _sender_id(self, name: Optional[str]) -> int:
+        if name is None:
+            return -1
+        sender_id = self._sender_ids.get(name)
+        if sender_id is None:
+            sender_id = self._sender_ids[name] = len(self.senders)
+            self.senders.append(name)
+        return sender_id
+    
+    def _type_id(self, message_type: str) -> int:
+        type_id = self._type_ids.get(message_type)
+        if type_id is None:
+            type_id = self._type_ids[message_type] = len(self.types)
+            self.types.append(message_type)
+        return type_id
+    
+    @staticmethod
+    def _numeric_id(value, key: str, extras: Dict) -> int:
+        """Número de un id "message12345" (-1 si falta; los que no siguen el formato van a extras)"""
+        match = MESSAGE_ID_RE.match(value) if isinstance(value, str) else None
+        if match:
+            return int(match.group(1))
+        if value is not None:
+            extras[key] = value
+        return -1
+    
+    @staticmethod
+    def _quantity(value, key: str, extras: Dict) -> int:
+        """Entero no negativo para las columnas de tamaño/duración (-1 si falta; el resto va a extras)"""
+        if isinstance(value, int) and value >= 0:
+            return value
+        if value is not None:
+            extras[key] = value
+        return -1
+    
+    def _append_columns(self, row: tuple, content: bytes, extras: Dict, media_path: bytes = b''):
+        if self._sorted and self._timestamp_col and row[1] < self._timestamp_col[-1]:
+            self._sorted = False
+        if extras:
+            self._extras[len(self._sender_col)] = extras
+        for column, value in zip(self._columns(), row):
+            column.append(value)
+        self._content += content
+        self._offsets.append(len(self._content))
+        self._media_paths += media_path
+        self._media_path_offsets.append(len(self._media_paths))
+    
+    def append(self, message: Dict):
+        extras = {key: value for key, value in message.items() if key not in MESSAGE_COLUMNS}
+        
+        timestamp = message.get('timestamp')
+        parts = split_timestamp(timestamp) if timestamp else None
+        if parts and epoch_to_timestamp(*parts) == timestamp:
+            epoch, offset = parts[0], NO_UTC_OFFSET if parts[1] is None else parts[1]
+        else:
+            epoch, offset = NO_TIMESTAMP, NO_UTC_OFFSET
+            if timestamp is not None:
+                extras['timestamp'] = timestamp
+        
+        row = (
+            self._sender_id(message.get('sender')), epoch, offset,
+            self._numeric_id(message.get('message_id'), 'message_id', extras),
+            self._type_id(message.get('type') or 'text'),
+            self._numeric_id(message.get('reply_to'), 'reply_to', extras),
+            self._sender_id(message.get('forwarded_from')),
+            self._quantity(message.get('media_size'), 'media_size', extras),
+            self._quantity(message.get('media_duration'), 'media_duration', extras),
+        )
+        self._append_columns(row, (message.get('content') or '').encode('utf-8'), extras,
+                             (message.get('media_path') or '').encode('utf-8'))
+    
+    def extend(self, messages):
+        """Añade mensajes; otro MessageStore se concatena columna a columna sin crear dicts"""
+        if not isinstance(messages, MessageStore):
+            for message in messages:
+                self.append(message)
+            return
+        
+        base = len(self)
+        if messages._timestamp_col and self._timestamp_col:
+            self._sorted = self._sorted and messages._sorted and messages._timestamp_col[0] >= self._timestamp_col[-1]
+        else:
+            self._sorted = self._sorted and messages._sorted
+        names = [self._sender_id(name) for name in messages.senders]
+        types = [self._type_id(message_type) for message_type in messages.types]
+        self._sender_col.extend([names[name_id] if name_id >= 0 else -1 for name_id in messages._sender_col])
+        self._forwarded_col.extend([names[name_id] if name_id >= 0 else -1 for name_id in messages._forwarded_col])
+        self._type_col.extend([types[type_id] for type_id in messages._type_col])
+        for column, other in ((self._timestamp_col, messages._timestamp_col), (self._offset_col, messages._offset_col),
+                              (self._message_id_col, messages._message_id_col),
+                              (self._reply_to_col, messages._reply_to_col),
+                              (self._media_size_col, messages._media_size_col),
+                              (self._media_duration_col, messages._media_duration_col)):
+            column.extend(other[:])
+        offset = len(self._content)
+        self._offsets.extend([end + offset for end in messages._offsets[1:]])
+        self._content += bytes(messages._content)
+        offset = len(self._media_paths)
+        self._media_path_offsets.extend([end + offset for end in messages._media_path_offsets[1:]])
+        self._media_paths += bytes(messages._media_paths)
+        self._extras.update({base + position: dict(extras) for position, extras in messages._extras.items()})
+    
+    def select(self, positions) -> 'MessageStore':
+        """Nuevo almacén con los mensajes de las posiciones dadas (en ese orden)"""
+        subset = MessageStore()
+        for position in positions:
+            extras = self._extras.get(position)
+            row = (
+                subset._sender_id(self.sender(position)), self._timestamp_col[position],
+                self._offset_col[position], self._message_id_col[position],
+                subset._type_id(self.types[self._type_col[position]]), self._reply_to_col[position],
+                subset._sender_id(self.forwarded_from(position)),
+                self._media_size_col[position], self._media_duration_col[position],
+            )
+            subset._append_columns(
+                row, self._content[self._offsets[position]:self._offsets[position + 1]],
+                dict(extras) if extras else None,
+                self._media_paths[self._media_path_offsets[position]:self._media_path_offsets[position + 1]]
+            )
+        return subset
+    
+    def __len__(self) -> int:
+        return len(self._sender_col)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.select(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('MessageStore index out of range')
+        message = {
+            'sender': self.sender(index),
+            'content': self.content(index),
+            'timestamp': self.timestamp(index),
+            'type': self.message_type(index),
+            'message_id': self.message_id(index),
+        }
+        reply_to = self.reply_to(index)
+        if reply_to:
+            message['reply_to'] = reply_to
+        forwarded_from = self.forwarded_from(index)
+        if forwarded_from:
+            message['forwarded_from'] = forwarded_from
+        for key, value in (('media_path', self.media_path(index)), ('media_size', self.media_size(index)),
+                           ('media_duration', self.media_duration(index))):
+            if value is not None:
+                message[key] = value
+        extras = self._extras.get(index)
+        if extras:
+            message.update(extras)
+        return message
+    
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+    
+    def sender(self, index: int) -> Optional[str]:
+        sender_id = self._sender_col[index]
+        return self.senders[sender_id] if sender_id >= 0 else None
+    
+    def forwarded_from(self, index: int) -> Optional[str]:
+        name_id = self._forwarded_col[index]
+        return self.senders[name_id] if name_id >= 0 else None
+    
+    def message_type(self, index: int) -> str:
+        return self.types[self._type_col[index]]
+    
+    def content(self, index: int) -> str:
+        return self._content[self._offsets[index]:self._offsets[index + 1]].decode('utf-8')
+    
+    def media_path(self, index: int) -> Optional[str]:
+        """Ruta del adjunto relativa a la carpeta de la exportación (None si no tiene)"""
+        path = self._media_paths[self._media_path_offsets[index]:self._media_path_offsets[index + 1]]
+        return path.decode('utf-8') if path else None
+    
+    def media_size(self, index: int) -> Optional[int]:
+        size = self._media_size_col[index]
+        return size if size >= 0 else None
+    
+    def media_duration(self, index: int) -> Optional[int]:
+        duration = self._media_duration_col[index]
+        return duration if duration >= 0 else None
+    
+    def epoch(self, index: int) -> Optional[int]:
+        epoch = self._timestamp_col[index]
+        return None if epoch == NO_TIMESTAMP else epoch
+    
+    def timestamp(self, index: int) -> Optional[str]:
+        extras = self._extras.get(index)
+        if extras and 'timestamp' in extras:
+            return extras['timestamp']
+        epoch = self._timestamp_col[index]
+        if epoch == NO_TIMESTAMP:
+            return None
+        return epoch_to_timestamp(epoch, self.utc_offset(index))
+    
+    def utc_offset(self, index: int) -> Optional[int]:
+        """Desfase UTC de la fecha del mensaje en segundos (None si no tiene zona horaria)"""
+        offset = self._offset_col[index]
+        return None if offset == NO_UTC_OFFSET else offset
+    
+    def _id_value(self, index: int, key: str, column: array) -> Optional[str]:
+        extras = self._extras.get(index)
+        if extras and key in extras:
+            return extras[key]
+        value = column[index]
+        return f"message{value}" if value >= 0 else None
+    
+    def message_id(self, index: int) -> Optional[str]:
+        return self._id_value(index, 'message_id', self._message_id_col)
+    
+    def reply_to(self, index: int) -> Optional[str]:
+        """Id del mensaje al que responde ("message12345") o None"""
+        return self._id_value(index, 'reply_to', self._reply_to_col)
+    
+    def sender_index(self) -> Dict[str, List[int]]:
+        """Posiciones de los mensajes de cada remitente, en una pasada sobre la columna de ids"""
+        positions = [[] for _ in self.senders]
+        for position, sender_id in enumerate(self._sender_col):
+            if sender_id >= 0:
+                positions[sender_id].append(position)
+        return {name: found for name, found in zip(self.senders, positions) if found}
+    
+    def for_sender(self, name: str) -> 'MessageStore':
+        sender_id = self._sender_ids.get(name)
+        if sender_id is None:
+            return MessageStore()
+        return self.select(position for position, value in enumerate(self._sender_col) if value == sender_id)
+    
+    def between(self, start: str = None, end: str = None) -> 'MessageStore':
+        """Mensajes con fecha en [start, end) (fechas ISO; None = sin límite)"""
+        low = timestamp_to_epoch(start) if start else NO_TIMESTAMP + 1
+        high = timestamp_to_epoch(end) if end else None
+        if self._sorted:
+            first = bisect_left(self._timestamp_col, low)
+            last = bisect_left(self._timestamp_col, high) if high is not None else len(self)
+            return self.select(range(first, last))
+        return self.select(
+            position for position, epoch in enumerate(self._timestamp_col)
+            if epoch >= low and (high is None or epoch < high)
+        )
+    
+    def date_range(self) -> tuple:
+        dated = [position for position, epoch in enumerate(self._timestamp_col) if epoch != NO_TIMESTAMP]
+        dates = []
+        if dated:
+            first = min(dated, key=self._timestamp_col.__getitem__)
+            last = max(dated, key=self._timestamp_col.__getitem__)
+            dates = [self.timestamp(first), self.timestamp(last)]
+        dates += [extras['timestamp'] for extras in self._extras.values() if extras.get('timestamp')]
+        if not dates:
+            return (None, None)
+        return (min(dates), max(dates))
+
+
 class TelegramHTMLParser:
     def __init__(self):
-        self.messages = []
+        self.messages = MessageStore()
+        self.date_parser = TelegramDateParser()
         self.participants = {}
         self.chat_name = ""
         self.date_range = (None, None)
         self.links = []  # Lista de enlaces encontrados
         
-    def parse_file(self, file_path: str) -> Dict:
+    def parse_file(self, file_path: str, streaming: bool = True) -> Dict:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Archivo no encontrado: {file_path}")
+        
+        # Modo streaming: no construye el árbol completo del HTML (exportaciones de cientos de MB)
+        if streaming and _lxml_available():
+            for message_data in self.iter_messages(file_path):
+                self._add_message(message_data)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+                
+            soup = BeautifulSoup(content, 'html.parser')
+            self._extract_chat_name(soup)
+            self._extract_messages(soup)
             
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        soup = BeautifulSoup(content, 'html.parser')
-        self._extract_chat_name(soup)
-        self._extract_messages(soup)
         self._extract_links()  # Extraer enlaces de los mensajes
         self._calculate_date_range()
         self._clean_participants()
@@ -1137,6 +2561,129 @@ class TelegramHTMLParser:
             'links': self.links  # Incluir enlaces
         }
     
+    def iter_messages(self, file_path: str):
+        """Recorre el HTML en streaming con lxml.iterparse y va liberando cada div.message.
+        
+        Genera los mismos diccionarios que _parse_message_element; la memoria queda
+        acotada al tamaño de un mensaje, no al del archivo completo.
+        """
+        from lxml import etree
+        
+        current_sender = None
+        context = etree.iterparse(
+            file_path, events=('end',), tag=('div', 'title'),
+            html=True, encoding='utf-8', huge_tree=True
+        )
+        for _, element in context:
+            classes = (element.get('class') or '').split()
+            
+            if element.tag == 'title':
+                if not self.chat_name:
+                    self.chat_name = _lxml_text(element)
+                continue
+            
+            if 'page_header' in classes:
+                name_element = _lxml_find_class(element, 'text')
+                self.chat_name = _lxml_text(name_element if name_element is not None else element)
+                continue
+            
+            if 'message' not in classes and not (
+                'message_default' in classes and not _lxml_has_message_ancestor(element)
+            ):
+                continue
+            
+            message_data = self._parse_lxml_message_element(element, current_sender)
+            if message_data:
+                current_sender = message_data.get('sender') or current_sender
+                yield message_data
+            
+            # Liberar el elemento procesado y los hermanos anteriores ya consumidos
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+        del context
+    
+    def _parse_lxml_message_element(self, element, previous_sender: str = None) -> Optional[Dict]:
+        """Equivalente de _parse_message_element para elementos de lxml"""
+        return self._walk_message_element(element, LxmlNodes, previous_sender)
+    
+    def _walk_message_element(self, element, nodes, previous_sender: str = None) -> Optional[Dict]:
+        """Extrae todos los campos de un div.message recorriendo su subárbol una sola vez.
+        
+        nodes adapta el árbol (LxmlNodes o SoupNodes). Se visitan en orden de documento los
+        descendientes con clase: el primer .date y el primer .text ganan, el .from_name dentro de
+        .forwarded es el autor original y el enlace de .reply_to da el id del mensaje respondido.
+        Los mensajes de servicio y los que solo tienen un adjunto también se devuelven, con su tipo;
+        de los adjuntos se guardan la ruta del archivo y el tamaño/duración de su texto de estado.
+        """
+        message_id = element.get('id')  # "message12345" en exportaciones de Telegram
+        
+        if 'service' in nodes.classes(element):
+            if message_id and DATE_SEPARATOR_ID_RE.match(message_id):
+                return None
+            content = nodes.text(element)
+            if not content:
+                return None
+            return {'sender': None, 'content': content, 'timestamp': None,
+                    'type': 'service', 'message_id': message_id}
+        
+        sender = forwarded_from = date_str = content = reply_to = media_type = None
+        forwarded = media_path = media_status = None
+        for node, classes in nodes.classed_descendants(element):
+            if 'from_name' in classes:
+                name = nodes.own_text(node) or nodes.text(node)
+                if forwarded is not None and nodes.is_inside(node, forwarded):
+                    forwarded_from = forwarded_from or name
+                elif sender is None:
+                    sender = name
+            elif 'date' in classes:
+                if date_str is None:
+                    date_str = node.get('title', '') or nodes.text(node)
+            elif 'text' in classes:
+                if content is None:
+                    content = nodes.text(node)
+            elif 'reply_to' in classes:
+                match = REPLY_TO_RE.search(nodes.link(node))
+                if match and reply_to is None:
+                    reply_to = f"message{match.group(1)}"
+            elif 'forwarded' in classes:
+                forwarded = forwarded if forwarded is not None else node
+            elif media_type is None:
+                for css_class in classes:
+                    if css_class in TELEGRAM_MEDIA_CLASSES:
+                        media_type = TELEGRAM_MEDIA_CLASSES[css_class]
+                        media_path = node.get('href')
+                        break
+            elif media_status is None and ('status' in classes or 'video_duration' in classes):
+                media_status = nodes.text(node)
+        
+        if not content and not media_type:
+            return None
+        
+        message = {
+            'sender': sender or previous_sender,
+            'content': content or '',
+            'timestamp': self._parse_date(date_str) if date_str else None,
+            'type': media_type or 'text',
+            'message_id': message_id
+        }
+        if reply_to:
+            message['reply_to'] = reply_to
+        if forwarded_from:
+            message['forwarded_from'] = forwarded_from
+        if media_type:
+            # Ruta relativa a la carpeta de la exportación; los archivos no se copian
+            if media_path and '://' not in media_path and not media_path.startswith('#'):
+                message['media_path'] = media_path
+            size, duration = parse_media_status(media_status)
+            if size is not None:
+                message['media_size'] = size
+            if duration is not None:
+                message['media_duration'] = duration
+        return message
+    
     def _extract_chat_name(self, soup):
         name_element = soup.select_one('.page_header .text')
         if name_element:
@@ -1160,75 +2707,37 @@ class TelegramHTMLParser:
         for msg_elem in message_elements:
             message_data = self._parse_message_element(msg_elem, current_sender)
             if message_data:
-                self.messages.append(message_data)
-                current_sender = message_data.get('sender')
-                
-                sender = message_data.get('sender')
-                if sender:
-                    if sender not in self.participants:
-                        self.participants[sender] = {
-                            'name': sender,
-                            'message_count': 0,
-                            'first_message': message_data.get('timestamp'),
-                            'last_message': message_data.get('timestamp')
-                        }
-                    self.participants[sender]['message_count'] += 1
-                    self.participants[sender]['last_message'] = message_data.get('timestamp')
+                self._add_message(message_data)
+                current_sender = message_data.get('sender') or current_sender
+    
+    def _add_message(self, message_data: Dict):
+        self.messages.append(message_data)
+        
+        sender = message_data.get('sender')
+        if sender:
+            if sender not in self.participants:
+                self.participants[sender] = {
+                    'name': sender,
+                    'message_count': 0,
+                    'first_message': message_data.get('timestamp'),
+                    'last_message': message_data.get('timestamp')
+                }
+            self.participants[sender]['message_count'] += 1
+            self.participants[sender]['last_message'] = message_data.get('timestamp')
     
     def _parse_message_element(self, element, previous_sender: str = None) -> Optional[Dict]:
-        message = {
-            'sender': None,
-            'content': '',
-            'timestamp': None,
-            'type': 'text'
-        }
-        
-        sender_elem = element.select_one('.from_name')
-        if sender_elem:
-            message['sender'] = sender_elem.get_text(strip=True)
-        else:
-            message['sender'] = previous_sender
-            
-        date_elem = element.select_one('.date')
-        if date_elem:
-            date_str = date_elem.get('title', '') or date_elem.get_text(strip=True)
-            message['timestamp'] = self._parse_date(date_str)
-            
-        text_elem = element.select_one('.text')
-        if text_elem:
-            message['content'] = text_elem.get_text(strip=True)
-            
-        if message['content']:
-            return message
-        return None
+        return self._walk_message_element(element, SoupNodes, previous_sender)
     
     def _parse_date(self, date_str: str) -> Optional[str]:
-        if not date_str:
-            return None
-        
-        # Limpiar zona horaria UTC+XX:XX o UTC-XX:XX
-        clean_date = re.sub(r'\s*UTC[+-]\d{2}:\d{2}', '', date_str.strip())
-        
-        formats = [
-            '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M',
-            '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
-            '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M',
-            '%d %B %Y',  # Para fechas de servicio como "4 April 2021"
-        ]
-        for fmt in formats:
-            try:
-                dt = datetime.strptime(clean_date.strip(), fmt)
-                return dt.isoformat()
-            except ValueError:
-                continue
-        return date_str
+        """Fecha ISO 8601 con su desfase UTC (p. ej. 2021-04-02T11:21:00+02:00)"""
+        return self.date_parser.parse(date_str)
     
     def _calculate_date_range(self):
         if not self.messages:
             return
-        dates = [m['timestamp'] for m in self.messages if m.get('timestamp')]
-        if dates:
-            self.date_range = (min(dates), max(dates))
+        start, end = self.messages.date_range()
+        if start:
+            self.date_range = (start, end)
             
     def _clean_participants(self):
         # Eliminar participantes con nombres que parecen combinados o con 0 mensajes
@@ -1249,14 +2758,18 @@ class TelegramHTMLParser:
     
     def _extract_links(self):
         """Extrae todos los enlaces de los mensajes"""
-        import re
+        self.links = self.collect_links(self.messages)
+    
+    @staticmethod
+    def collect_links(messages: List[Dict]) -> List[Dict]:
+        """Agrupa por URL los enlaces encontrados en una lista de mensajes"""
         url_pattern = re.compile(
             r'https?://[^\s<>"{}|\\^`\[\]]+'
         )
         
         link_counts = {}  # Para contar ocurrencias
         
-        for msg in self.messages:
+        for msg in messages:
             content = msg.get('content', '')
             sender = msg.get('sender', '')
             timestamp = msg.get('timestamp', '')
@@ -1292,7 +2805,53 @@ class TelegramHTMLParser:
                         'timestamp': timestamp
                     })
         
-        self.links = list(link_counts.values())
+        return list(link_counts.values())
+
+
+def message_dedup_key(message: Dict) -> str:
+    """Clave estable de un mensaje para importaciones incrementales.
+    
+    Usa el id del elemento de Telegram ("message12345") y, si no existe,
+    un hash de remitente + fecha + contenido.
+    """
+    if message.get('message_id'):
+        return message['message_id']
+    raw = '\x1f'.join(str(message.get(key) or '') for key in ('sender', 'timestamp', 'content'))
+    return 'sha1:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def legacy_message_key(sender: str, timestamp: str, content: str) -> str:
+    """Clave de los mensajes guardados antes de message_key (ver Database._backfill_message_keys).
+    
+    Esas filas no conservan el id de Telegram y su fecha se guardó sin desfase UTC, así que
+    se usa un hash de remitente + fecha local (sin zona) + contenido.
+    """
+    raw = '\x1f'.join((sender or '', (timestamp or '')[:19], content or ''))
+    return 'legacy:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def index_messages_by_sender(messages: List[Dict]) -> Dict[str, List[int]]:
+    """Posiciones de los mensajes de cada remitente, calculadas en una sola pasada"""
+    if isinstance(messages, MessageStore):
+        return messages.sender_index()
+    index = {}
+    for position, message in enumerate(messages):
+        index.setdefault(message.get('sender'), []).append(position)
+    return index
+
+
+def file_content_hash(file_path: str) -> str:
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_export_file(file_path: str) -> Dict:
+    """Parsea un archivo de exportación con un parser propio (apto para ProcessPoolExecutor)"""
+    return TelegramHTMLParser().parse_file(file_path)
 
 
 # ============================================================
@@ -1343,11 +2902,633 @@ class PersonProfile:
     commitments: List[Dict] = None
 
 
+# ============================================================
+# RESPUESTAS ESTRUCTURADAS (JSON)
+# ============================================================
+
+_SCHEMA_TYPES = {str: 'string', float: 'number', int: 'integer', bool: 'boolean'}
+
+
+def _type_schema(tp) -> Dict:
+    """Esquema JSON (formato neutro) de una anotación de tipo"""
+    if isinstance(tp, type) and issubclass(tp, Enum):
+        return {'type': 'string', 'enum': [member.value for member in tp]}
+    if is_dataclass(tp):
+        return dataclass_schema(tp)
+    origin = get_origin(tp)
+    if origin in (list, List):
+        args = get_args(tp)
+        return {'type': 'array', 'items': _type_schema(args[0]) if args else {'type': 'string'}}
+    if origin is Optional or (origin is not None and type(None) in get_args(tp)):
+        inner = [arg for arg in get_args(tp) if arg is not type(None)][0]
+        return {**_type_schema(inner), 'nullable': True}
+    return {'type': _SCHEMA_TYPES.get(tp, 'string')}
+
+
+def dataclass_schema(cls, exclude: tuple = (), overrides: Dict = None) -> Dict:
+    """Esquema JSON de un dataclass; los campos sin valor por defecto son obligatorios"""
+    hints = get_type_hints(cls)
+    overrides = overrides or {}
+    properties = {}
+    required = []
+    for field in fields(cls):
+        if field.name in exclude:
+            continue
+        schema = overrides.get(field.name) or _type_schema(hints[field.name])
+        if field.default is None:
+            schema = {**schema, 'nullable': True}
+        properties[field.name] = schema
+        if field.default is MISSING and field.default_factory is MISSING:
+            required.append(field.name)
+    return {'type': 'object', 'properties': properties, 'required': required}
+
+
+def _object_schema(properties: Dict, required: List[str] = None) -> Dict:
+    return {'type': 'object', 'properties': properties, 'required': required or list(properties)}
+
+
+def _string_list_schema() -> Dict:
+    return {'type': 'array', 'items': {'type': 'string'}}
+
+
+_COMMITMENT_SCHEMA = _object_schema({
+    'title': {'type': 'string'},
+    'type': {'type': 'string', 'enum': ['promise', 'agreement', 'deadline']},
+    'due_date': {'type': 'string', 'nullable': True},
+    'evidence': {'type': 'string'},
+}, ['title'])
+
+_ALERT_TYPES = ['inconsistency', 'knowledge_abuse', 'emotional_manipulation', 'possible_lies', 'red_flags']
+_SEVERITIES = ['low', 'medium', 'high']
+
+# Esquemas de respuesta por tipo de análisis (structured output / JSON mode)
+AI_RESPONSE_SCHEMAS = {
+    'tasks': _object_schema({'tasks': {'type': 'array', 'items': dataclass_schema(TaskExtracted)}}),
+    'person_profile': dataclass_schema(
+        PersonProfile, exclude=('name',),
+        overrides={'commitments': {'type': 'array', 'items': _COMMITMENT_SCHEMA}}
+    ),
+    'patterns': _object_schema({'patterns': {'type': 'array', 'items': _object_schema({
+        'name': {'type': 'string'},
+        'type': {'type': 'string'},
+        'description': {'type': 'string'},
+        'persons_involved': _string_list_schema(),
+        'examples': _string_list_schema(),
+        'recommendations': {'type': 'string'},
+    }, ['name', 'description'])}}),
+    'behavior_alerts': _object_schema({'alerts': {'type': 'array', 'items': _object_schema({
+        'alert_type': {'type': 'string', 'enum': _ALERT_TYPES},
+        'severity': {'type': 'string', 'enum': _SEVERITIES},
+        'title': {'type': 'string'},
+        'description': {'type': 'string'},
+        'evidence': {'type': 'string'},
+        'message_examples': _string_list_schema(),
+        'recommendation': {'type': 'string'},
+        'confidence': {'type': 'number'},
+    }, ['alert_type', 'severity', 'title', 'confidence'])}}),
+    'person_analysis': _object_schema({
+        'role': {'type': 'string', 'enum': [role.value for role in PersonRole]},
+        'role_confidence': {'type': 'number'},
+        'sentiment': {'type': 'string', 'enum': ['positive', 'neutral', 'negative']},
+        'sentiment_score': {'type': 'number'},
+        'client_type': {'type': 'string', 'nullable': True},
+        'skills': {'type': 'array', 'items': _object_schema({
+            'name': {'type': 'string'},
+            'level': {'type': 'number'},
+            'category': {'type': 'string'},
+        }, ['name', 'level'])},
+        'commitments': {'type': 'array', 'items': _COMMITMENT_SCHEMA},
+        'tasks': {'type': 'array', 'items': _object_schema({
+            'title': {'type': 'string'},
+            'status': {'type': 'string', 'enum': ['pending', 'in_progress', 'completed']},
+            'priority': {'type': 'string', 'enum': ['low', 'medium', 'high', 'urgent']},
+            'due_date': {'type': 'string', 'nullable': True},
+            'evidence': {'type': 'string'},
+        }, ['title', 'status'])},
+        'projects': {'type': 'array', 'items': _object_schema({
+            'name': {'type': 'string'},
+            'status': {'type': 'string'},
+            'description': {'type': 'string'},
+        }, ['name'])},
+        'alerts': {'type': 'array', 'items': _object_schema({
+            'type': {'type': 'string', 'enum': _ALERT_TYPES},
+            'severity': {'type': 'string', 'enum': _SEVERITIES},
+            'title': {'type': 'string'},
+            'description': {'type': 'string'},
+            'evidence': {'type': 'string'},
+        }, ['type', 'severity', 'title'])},
+        'summary': {'type': 'string'},
+    }, ['role', 'sentiment', 'skills', 'tasks', 'summary']),
+}
+
+
+def gemini_response_schema(schema: Dict) -> Dict:
+    """Esquema neutro -> response_schema de Gemini (tipos en mayúsculas, sin 'required' vacíos)"""
+    converted = {}
+    for key, value in schema.items():
+        if key == 'type':
+            converted[key] = value.upper()
+        elif key == 'properties':
+            converted[key] = {name: gemini_response_schema(prop) for name, prop in value.items()}
+        elif key == 'items':
+            converted[key] = gemini_response_schema(value)
+        elif key == 'required' and not value:
+            continue
+        else:
+            converted[key] = value
+    return converted
+
+
+def openai_response_schema(schema: Dict) -> Dict:
+    """Esquema neutro -> JSON Schema de OpenAI ('nullable' pasa a type: [t, 'null'])"""
+    converted = {}
+    for key, value in schema.items():
+        if key == 'nullable':
+            continue
+        if key == 'properties':
+            converted[key] = {name: openai_response_schema(prop) for name, prop in value.items()}
+        elif key == 'items':
+            converted[key] = openai_response_schema(value)
+        else:
+            converted[key] = value
+    if schema.get('nullable'):
+        converted['type'] = [schema['type'], 'null']
+    return converted
+
+
+_json_decoder = json.JSONDecoder()
+
+
+def decode_partial_json(text: str) -> Optional[Any]:
+    """Decodifica el primer objeto JSON de un texto, aunque esté incompleto.
+    
+    Ignora texto alrededor (```json, explicaciones). Si el JSON está cortado (respuesta
+    truncada o todavía llegando por streaming) se recorta al último valor completo y se
+    cierran los objetos/listas abiertos, así que se recupera todo lo que ya había llegado.
+    """
+    if not text:
+        return None
+    text = str(text)
+    start = text.find('{')
+    if start < 0:
+        start = text.find('[')
+    if start < 0:
+        return None
+    
+    try:
+        value, _ = _json_decoder.raw_decode(text, start)
+        return value
+    except json.JSONDecodeError:
+        pass
+    
+    # Puntos de corte seguros: justo tras abrir un contenedor, tras cerrar uno anidado
+    # o antes de una coma; con la pila de cierres pendientes en ese punto
+    closers = []
+    cuts = []
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            inside_list = bool(closers) and closers[-1] == ']'
+            closers.append('}' if ch == '{' else ']')
+            if not (ch == '{' and inside_list):  # Sin elementos {} vacíos en las listas
+                cuts.append((i + 1, ''.join(reversed(closers))))
+        elif ch in '}]':
+            if len(closers) <= 1:
+                break  # El objeto raíz se cerró pero no era JSON válido
+            closers.pop()
+            cuts.append((i + 1, ''.join(reversed(closers))))
+        elif ch == ',':
+            cuts.append((i, ''.join(reversed(closers))))
+    
+    for position, suffix in reversed(cuts[-64:]):
+        try:
+            return json.loads(text[start:position].rstrip() + suffix)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def parse_json_response(text: str) -> Dict:
+    """Objeto JSON de una respuesta de la IA ({} si no se puede recuperar nada)"""
+    value = decode_partial_json(text)
+    return value if isinstance(value, dict) else {}
+
+
+# Análisis de una persona por bloques (map-reduce) en lugar de truncar el historial
+CHARS_PER_TOKEN = 4  # Aproximación suficiente para texto en español
+PERSON_ANALYSIS_CHUNK_TOKENS = 12000  # Presupuesto de mensajes por llamada a la IA
+AI_MAX_CONCURRENT_REQUESTS = 8  # Llamadas simultáneas a la IA en los análisis por lotes
+
+# Presupuesto de tokens para los mensajes de cada prompt, por modelo
+AI_PROMPT_TOKEN_BUDGETS = {
+    'gemini-2.5-flash': 24000,
+    'gpt-4.1-mini': 16000,
+}
+AI_DEFAULT_PROMPT_TOKEN_BUDGET = 8000
+AI_MAX_MESSAGE_TOKENS = 400  # Los mensajes más largos se recortan para no acaparar el presupuesto
+
+# Reacciones sin contenido ("ok", "jajaja", "👍"...): lo último que entra en un prompt
+LOW_SIGNAL_MESSAGE_RE = re.compile(
+    r'^(?:ok|okay|vale|va|sí|si|no|gracias|grax|thx|bien|genial|perfecto|claro|ja|je|lol|xd|[^\w])+$',
+    re.IGNORECASE
+)
+
+# Límites de la API por proveedor (peticiones y tokens por minuto). Los de Gemini son los del
+# nivel gratuito de gemini-2.5-flash y los de OpenAI los del nivel 1 de gpt-4.1-mini.
+AI_RATE_LIMITS = {
+    'gemini': {'rpm': 10, 'tpm': 250000},
+    'openai': {'rpm': 500, 'tpm': 200000},
+}
+AI_EXPECTED_OUTPUT_TOKENS = 1024  # Tokens de respuesta reservados por petición
+AI_MAX_RETRIES = 5
+AI_BACKOFF_BASE_SECONDS = 2.0
+AI_BACKOFF_MAX_SECONDS = 60.0
+AI_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Batch API: el proveedor procesa el lote en diferido (hasta 24 h) con su propia cuota, sin pasar
+# por los límites interactivos. Lotes mayores que el límite del archivo se reparten en varios trabajos
+AI_BATCH_LIMITS = {
+    'gemini': {'max_requests': None, 'max_bytes': 2 * 1024 ** 3},
+    'openai': {'max_requests': 50000, 'max_bytes': 200 * 1024 ** 2},
+    'local': {'max_requests': None, 'max_bytes': None},
+}
+AI_BATCH_DIR = 'ai_batches'  # Archivos JSONL de los trabajos, junto a la base de datos
+AI_BATCH_MIN_MESSAGES = 5  # Mínimo de mensajes para incluir a una persona en el análisis nocturno
+
+
+class RateLimitScheduler:
+    """Reparte las peticiones a la IA dentro de los límites RPM/TPM de un proveedor.
+    
+    Ventana deslizante de 60 s compartida por todos los threads que usan el mismo
+    proveedor. reserve() no bloquea: devuelve 0 si la petición puede salir ya (y la
+    registra) o los segundos que hay que esperar antes de volver a intentarlo.
+    """
+    WINDOW_SECONDS = 60.0
+    
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._sent = []  # (instante, tokens) de las peticiones de la última ventana
+        self._paused_until = 0.0
+    
+    def reserve(self, tokens: int) -> float:
+        tokens = min(tokens, self.tpm)  # Una petición mayor que el TPM saldría igualmente sola
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            
+            window_start = now - self.WINDOW_SECONDS
+            self._sent = [(sent_at, used) for sent_at, used in self._sent if sent_at > window_start]
+            
+            wait = 0.0
+            if len(self._sent) >= self.rpm:
+                wait = self._sent[-self.rpm][0] - window_start
+            used_tokens = sum(used for _, used in self._sent)
+            if used_tokens + tokens > self.tpm:
+                # Esperar a que caduquen suficientes tokens de la ventana
+                freed = 0
+                for sent_at, used in self._sent:
+                    freed += used
+                    if used_tokens - freed + tokens <= self.tpm:
+                        wait = max(wait, sent_at - window_start)
+                        break
+            if wait > 0:
+                return wait
+            
+            self._sent.append((now, tokens))
+            return 0.0
+    
+    def pause(self, seconds: float):
+        """Detiene todas las peticiones (p. ej. tras un 429 del proveedor)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_rate_schedulers: Dict[str, RateLimitScheduler] = {}
+_rate_schedulers_lock = threading.Lock()
+
+
+def get_rate_scheduler(provider: str, rpm: int = None) -> RateLimitScheduler:
+    """Scheduler compartido por proveedor; rpm sustituye al límite por defecto (nivel de pago)"""
+    with _rate_schedulers_lock:
+        limits = AI_RATE_LIMITS.get(provider, AI_RATE_LIMITS['openai'])
+        scheduler = _rate_schedulers.get(provider)
+        if scheduler is None:
+            scheduler = RateLimitScheduler(limits['rpm'], limits['tpm'])
+            _rate_schedulers[provider] = scheduler
+        scheduler.rpm = rpm or limits['rpm']
+        return scheduler
+
+
+class AIRequestError(Exception):
+    """La llamada a la IA falló: error no reintentable o reintentos agotados.
+    
+    Distingue un fallo de la petición de una respuesta vacía del modelo ('{}').
+    partial guarda lo recibido antes del corte en las llamadas en streaming.
+    """
+    def __init__(self, message: str, partial: str = ''):
+        super().__init__(message)
+        self.partial = partial
+
+
+def _ai_error_status(error: Exception) -> Optional[int]:
+    """Código HTTP de un error de google-genai (code) u openai (status_code)"""
+    for attr in ('status_code', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _is_retryable_ai_error(error: Exception) -> bool:
+    status = _ai_error_status(error)
+    if status is not None:
+        return status in AI_RETRYABLE_STATUS
+    # Timeouts y errores de conexión (httpx, openai, aiohttp) no llevan código HTTP
+    name = type(error).__name__.lower()
+    message = str(error).lower()
+    return ('timeout' in name or 'connection' in name or 'resource_exhausted' in message
+            or 'rate limit' in message or 'timed out' in message)
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Backoff exponencial con jitter completo; respeta Retry-After si el proveedor lo envía"""
+    delay = random.uniform(0, min(AI_BACKOFF_MAX_SECONDS, AI_BACKOFF_BASE_SECONDS * 2 ** attempt))
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        retry_after = float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        retry_after = 0.0
+    return max(delay, min(retry_after, AI_BACKOFF_MAX_SECONDS))
+
+
+def llm_cache_key(provider: str, model: str, system_prompt: Optional[str], prompt: str,
+                  schema: str = None) -> str:
+    """Clave de caché: hash del proveedor, modelo, system prompt, prompt y esquema de respuesta"""
+    parts = [provider or '', model or '', system_prompt or '', prompt or '']
+    if schema:
+        parts.append(schema)
+    payload = '\x1f'.join(parts)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación aproximada del número de tokens de un texto"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_information_score(content: str) -> float:
+    """Puntuación de cuánta información aporta un mensaje para el análisis"""
+    text = (content or '').strip()
+    if not text:
+        return 0.0
+    if len(text) <= 40 and LOW_SIGNAL_MESSAGE_RE.match(text.replace(' ', '')):
+        return 0.1
+    score = float(min(len(text.split()), 60))  # Más largo = más señal, con rendimientos decrecientes
+    if '?' in text:
+        score += 5  # Preguntas y peticiones
+    if re.search(r'\d', text):
+        score += 5  # Fechas, importes, cantidades
+    if 'http' in text:
+        score += 3
+    return score
+
+
+def pack_messages(messages: List[Dict], token_budget: int, format_line) -> List[Dict]:
+    """Selecciona los mensajes más informativos que caben en token_budget.
+    
+    format_line(msg) devuelve la línea que ocupará el mensaje en el prompt (o '' si se
+    descarta). Los mensajes elegidos se devuelven en su orden original.
+    """
+    candidates = []
+    for index, message in enumerate(messages):
+        line = format_line(message)
+        if line:
+            cost = estimate_tokens(line) + 1  # +1 por el salto de línea
+            candidates.append((message_information_score(message.get('content')), index, cost))
+    
+    if sum(cost for _, _, cost in candidates) <= token_budget:
+        return [messages[index] for _, index, _ in candidates]
+    
+    # Los más informativos primero; a igualdad, los más recientes
+    chosen = []
+    used = 0
+    for score, index, cost in sorted(candidates, key=lambda c: (-c[0], -c[1])):
+        if used + cost <= token_budget:
+            chosen.append(index)
+            used += cost
+    return [messages[index] for index in sorted(chosen)]
+
+
+def split_text_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """Divide un texto por líneas en bloques de como máximo max_tokens.
+    
+    Las líneas nunca se parten salvo que por sí solas superen el presupuesto.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    current = []
+    current_tokens = 0
+    
+    for line in text.splitlines():
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or ['']
+        for piece in pieces:
+            piece_tokens = estimate_tokens(piece) + 1  # +1 por el salto de línea
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def _weighted_vote(partials: List[Dict], weights: List[int], key: str,
+                   ignore: tuple = ('', None, 'desconocido')) -> Optional[str]:
+    """Valor más votado de un campo, ponderado por el tamaño de cada bloque"""
+    votes = {}
+    for partial, weight in zip(partials, weights):
+        value = partial.get(key)
+        if isinstance(value, str):
+            value = value.strip().lower()
+        if value in ignore:
+            continue
+        votes[value] = votes.get(value, 0) + weight
+    if not votes:
+        return None
+    return max(votes, key=votes.get)
+
+
+def _merge_items(partials: List[Dict], key: str, identity) -> List[Dict]:
+    """Une listas de elementos sin duplicados. Los bloques van en orden
+    cronológico, así que los datos de bloques posteriores (estado, fechas)
+    actualizan a los anteriores."""
+    merged = {}
+    for partial in partials:
+        for item in partial.get(key) or []:
+            if not isinstance(item, dict):
+                continue
+            item_id = identity(item)
+            if not item_id:
+                continue
+            if item_id in merged:
+                merged[item_id].update({k: v for k, v in item.items() if v not in (None, '', [])})
+            else:
+                merged[item_id] = dict(item)
+    return list(merged.values())
+
+
+def _normalize_title(value) -> str:
+    return re.sub(r'\s+', ' ', str(value or '')).strip().lower()
+
+
+def format_profile_digest(snapshot: Dict, max_items: int = 15) -> str:
+    """Resumen compacto de un perfil ya analizado para el análisis incremental"""
+    lines = [
+        f"Rol: {snapshot.get('role') or 'desconocido'} (confianza {snapshot.get('role_confidence') or 0:.1f})",
+        f"Sentimiento: {snapshot.get('sentiment') or 'neutral'} ({snapshot.get('sentiment_score') or 0:+.1f})",
+    ]
+    if snapshot.get('profile_summary'):
+        lines.append(f"Resumen: {snapshot['profile_summary']}")
+    
+    sections = [
+        ('Skills', snapshot.get('skills'), lambda s: f"{s['name']} ({s['score']:.0f})"),
+        ('Tareas', snapshot.get('tasks'), lambda t: f"{t['title']} [{t['status']}]"),
+        ('Compromisos', snapshot.get('commitments'), lambda c: f"{c['title']} [{c['status']}]"),
+        ('Proyectos', snapshot.get('projects'), lambda p: f"{p['name']} [{p['status']}]"),
+        ('Alertas', snapshot.get('alerts'), lambda a: f"{a['title']} ({a['alert_type']}, {a['severity']})"),
+    ]
+    for label, items, fmt in sections:
+        if items:
+            more = f" (+{len(items) - max_items} más)" if len(items) > max_items else ""
+            lines.append(f"{label}: " + "; ".join(fmt(item) for item in items[:max_items]) + more)
+    return "\n".join(lines)
+
+
+# Secciones del análisis de una persona que se guardan en cuanto llegan completas (streaming)
+PERSON_ANALYSIS_SECTIONS = {
+    'role': ('role', 'role_confidence'),
+    'sentiment': ('sentiment', 'sentiment_score'),
+    'client_type': ('client_type',),
+    'skills': ('skills',),
+    'commitments': ('commitments',),
+    'tasks': ('tasks',),
+    'projects': ('projects',),
+    'alerts': ('alerts',),
+    'summary': ('summary',),
+}
+PERSON_ANALYSIS_LIST_SECTIONS = ('skills', 'commitments', 'tasks', 'projects', 'alerts')
+
+
+def person_analysis_section(result: Dict, section: str):
+    """Valor de una sección: el campo directamente o un dict si agrupa varios"""
+    keys = [key for key in PERSON_ANALYSIS_SECTIONS[section] if key in result]
+    if len(PERSON_ANALYSIS_SECTIONS[section]) == 1:
+        return result.get(keys[0]) if keys else None
+    return {key: result[key] for key in keys} or None
+
+
+def merge_person_analyses(partials: List[Dict], weights: List[int] = None) -> Dict:
+    """Fase reduce: combina los análisis parciales de cada bloque en un único perfil"""
+    weights = weights or [1] * len(partials)
+    result = {'role': 'desconocido', 'skills': [], 'patterns': []}
+    if not partials:
+        return result
+    
+    # Rol: voto ponderado por tamaño de bloque y confianza
+    role_weights = [w * float(p.get('role_confidence') or 0.5) for p, w in zip(partials, weights)]
+    role = _weighted_vote(partials, role_weights, 'role')
+    if role:
+        agreeing = [(float(p.get('role_confidence') or 0.5), w) for p, w in zip(partials, weights)
+                    if str(p.get('role') or '').strip().lower() == role]
+        result['role'] = role
+        result['role_confidence'] = round(sum(c * w for c, w in agreeing) / sum(w for _, w in agreeing), 2)
+    
+    # Sentimiento: etiqueta más votada y score medio ponderado
+    sentiment = _weighted_vote(partials, weights, 'sentiment')
+    if sentiment:
+        result['sentiment'] = sentiment
+    scored = []
+    for partial, weight in zip(partials, weights):
+        try:
+            scored.append((float(partial['sentiment_score']), weight))
+        except (KeyError, TypeError, ValueError):
+            continue
+    if scored:
+        result['sentiment_score'] = round(sum(s * w for s, w in scored) / sum(w for _, w in scored), 2)
+    
+    client_type = _weighted_vote(partials, weights, 'client_type')
+    if client_type:
+        result['client_type'] = client_type
+    
+    # Skills: se conserva el nivel más alto detectado en cualquier bloque
+    skills = {}
+    for partial in partials:
+        for skill in partial.get('skills') or []:
+            if not isinstance(skill, dict):
+                continue
+            name_key = _normalize_title(skill.get('name'))
+            if not name_key:
+                continue
+            try:
+                level = float(skill.get('level', skill.get('score', 50)))
+            except (TypeError, ValueError):
+                level = 50
+            existing = skills.get(name_key)
+            if existing is None or level > existing['level']:
+                skills[name_key] = {**(existing or {}), **skill, 'level': level}
+            elif not existing.get('category') and skill.get('category'):
+                existing['category'] = skill['category']
+    # add_person_skill lee 'score'
+    result['skills'] = [{**skill, 'score': skill['level']} for skill in skills.values()]
+    
+    result['commitments'] = _merge_items(partials, 'commitments', lambda c: _normalize_title(c.get('title')))
+    result['tasks'] = _merge_items(partials, 'tasks', lambda t: _normalize_title(t.get('title')))
+    result['projects'] = _merge_items(partials, 'projects', lambda p: _normalize_title(p.get('name')))
+    result['alerts'] = _merge_items(
+        partials, 'alerts',
+        lambda a: (a.get('type') or 'red_flags', _normalize_title(a.get('title'))) if a.get('title') else None
+    )
+    
+    # Resumen del bloque con más mensajes
+    summaries = [(w, p.get('summary')) for p, w in zip(partials, weights) if p.get('summary')]
+    if summaries:
+        result['summary'] = max(summaries, key=lambda item: item[0])[1]
+    
+    return result
+
+
 class AIAnalyzer:
-    def __init__(self, api_key: str = None, provider: str = "gemini"):
+    def __init__(self, api_key: str = None, provider: str = "gemini",
+                 max_concurrency: int = AI_MAX_CONCURRENT_REQUESTS, db_path: str = None):
         self.provider = provider
         self.client = None
         self.model = None
+        self.prompt_token_budget = AI_DEFAULT_PROMPT_TOKEN_BUDGET
+        self.max_concurrency = max(1, max_concurrency)
+        self.db_path = db_path  # Base de datos con la caché de respuestas (None = sin caché)
+        self.scheduler = get_rate_scheduler(provider, self._configured_rpm())
+        self.on_throttle = None  # Callback(str) para informar de esperas por límites de la API
         
         if provider == "gemini":
             self._init_gemini(api_key)
@@ -1357,9 +3538,10 @@ class AIAnalyzer:
     def _init_gemini(self, api_key: str = None):
         try:
             from google import genai
-            api_key = api_key or os.environ.get('GEMINI_API_KEY')
-            self.client = genai.Client(api_key=api_key)
+            self.api_key = api_key or os.environ.get('GEMINI_API_KEY')
+            self.client = genai.Client(api_key=self.api_key)
             self.model = "gemini-2.5-flash"
+            self.prompt_token_budget = AI_PROMPT_TOKEN_BUDGETS.get(self.model, AI_DEFAULT_PROMPT_TOKEN_BUDGET)
         except ImportError:
             raise ImportError("Instala google-genai: pip install google-genai")
             
@@ -1368,36 +3550,285 @@ class AIAnalyzer:
             from openai import OpenAI
             self.client = OpenAI()
             self.model = "gpt-4.1-mini"
+            self.prompt_token_budget = AI_PROMPT_TOKEN_BUDGETS.get(self.model, AI_DEFAULT_PROMPT_TOKEN_BUDGET)
         except ImportError:
             raise ImportError("Instala openai: pip install openai")
     
-    def _call_ai(self, prompt: str, system_prompt: str = None) -> str:
+    def _configured_rpm(self) -> Optional[int]:
+        """Límite de peticiones por minuto configurado en Configuración (None = por defecto)"""
+        if not self.db_path:
+            return None
         try:
-            if self.provider == "gemini":
-                full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=full_prompt
-                )
-                result = response.text
-            else:
-                messages = []
-                if system_prompt:
-                    messages.append({"role": "system", "content": system_prompt})
-                messages.append({"role": "user", "content": prompt})
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages
-                )
-                result = response.choices[0].message.content
-            
-            # Asegurar que nunca retornamos None
-            return result if result else '{}'
-        except Exception as e:
-            print(f"Error en _call_ai: {e}")
-            return '{}'
+            value = get_connection_manager(self.db_path).connection().get_setting('ai_rpm')
+            return int(value) if value else None
+        except (sqlite3.Error, ValueError):
+            return None
+    
+    def _get_cached_response(self, prompt: str, system_prompt: str = None, schema: str = None) -> Optional[str]:
+        if not self.db_path:
+            return None
+        try:
+            db = get_connection_manager(self.db_path).connection()
+            return db.get_cached_llm_response(llm_cache_key(self.provider, self.model, system_prompt, prompt, schema))
+        except sqlite3.Error as e:
+            print(f"Error leyendo caché de IA: {e}")
+            return None
+    
+    def _store_cached_response(self, prompt: str, system_prompt: str, response: str, schema: str = None):
+        # '{}' es una respuesta vacía del modelo: no se guarda para poder reintentar
+        if not self.db_path or not response or response == '{}':
+            return
+        try:
+            db = get_connection_manager(self.db_path).connection()
+            db.set_cached_llm_response(
+                llm_cache_key(self.provider, self.model, system_prompt, prompt, schema),
+                self.provider, self.model, response
+            )
+        except sqlite3.Error as e:
+            print(f"Error guardando caché de IA: {e}")
+    
+    def _notify_throttle(self, message: str):
+        print(message)
+        if self.on_throttle:
+            self.on_throttle(message)
+    
+    def _request_tokens(self, prompt: str, system_prompt: str = None) -> int:
+        return estimate_tokens(prompt) + estimate_tokens(system_prompt) + AI_EXPECTED_OUTPUT_TOKENS
+    
+    def _schedule_wait(self, tokens: int, waited: float) -> float:
+        """Segundos a esperar antes de enviar; avisa una vez si la espera es apreciable"""
+        wait = self.scheduler.reserve(tokens)
+        if wait > 1 and waited == 0:
+            self._notify_throttle(f"⏳ Límite de la API ({self.scheduler.rpm} pet/min): esperando {wait:.0f}s...")
+        return wait
+    
+    def _handle_call_error(self, error: Exception, attempt: int, label: str, partial: str = '') -> float:
+        """Segundos hasta el siguiente reintento; lanza AIRequestError si no se debe reintentar"""
+        if attempt >= AI_MAX_RETRIES or not _is_retryable_ai_error(error):
+            print(f"Error en {label}: {error}")
+            raise AIRequestError(f"La llamada a la IA falló: {error}", partial) from error
+        delay = _retry_delay(error, attempt)
+        if _ai_error_status(error) == 429:
+            self.scheduler.pause(delay)
+        self._notify_throttle(
+            f"⏳ La API no responde o ha limitado las peticiones; reintento {attempt + 1}/{AI_MAX_RETRIES} en {delay:.0f}s..."
+        )
+        return delay
+    
+    def _gemini_config(self, schema: str = None) -> Optional[Dict]:
+        """Salida estructurada de Gemini: JSON validado contra el esquema del análisis"""
+        if not schema:
+            return None
+        return {
+            'response_mime_type': 'application/json',
+            'response_schema': gemini_response_schema(AI_RESPONSE_SCHEMAS[schema]),
+        }
+    
+    def _openai_response_format(self, schema: str = None) -> Optional[Dict]:
+        """Structured outputs de OpenAI (json_schema no estricto: admite campos opcionales)"""
+        if not schema:
+            return None
+        return {
+            'type': 'json_schema',
+            'json_schema': {
+                'name': schema,
+                'schema': openai_response_schema(AI_RESPONSE_SCHEMAS[schema]),
+                'strict': False,
+            },
+        }
+    
+    def _openai_messages(self, prompt: str, system_prompt: str = None) -> List[Dict]:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    def _request(self, prompt: str, system_prompt: str = None, schema: str = None) -> str:
+        if self.provider == "gemini":
+            full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+            response = self.client.models.generate_content(
+                model=self.model,
+                contents=full_prompt,
+                config=self._gemini_config(schema)
+            )
+            return response.text
+        kwargs = {'response_format': self._openai_response_format(schema)} if schema else {}
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._openai_messages(prompt, system_prompt),
+            **kwargs
+        )
+        return response.choices[0].message.content
+    
+    async def _request_async(self, prompt: str, system_prompt: str, async_client, schema: str = None) -> str:
+        if self.provider == "gemini":
+            full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+            response = await async_client.models.generate_content(
+                model=self.model,
+                contents=full_prompt,
+                config=self._gemini_config(schema)
+            )
+            return response.text
+        kwargs = {'response_format': self._openai_response_format(schema)} if schema else {}
+        response = await async_client.chat.completions.create(
+            model=self.model,
+            messages=self._openai_messages(prompt, system_prompt),
+            **kwargs
+        )
+        return response.choices[0].message.content
+    
+    def _request_stream(self, prompt: str, system_prompt: str = None, schema: str = None):
+        """Generador con los fragmentos de texto de la respuesta según los envía el proveedor"""
+        if self.provider == "gemini":
+            full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+            for chunk in self.client.models.generate_content_stream(
+                model=self.model,
+                contents=full_prompt,
+                config=self._gemini_config(schema)
+            ):
+                if chunk.text:
+                    yield chunk.text
+            return
+        kwargs = {'response_format': self._openai_response_format(schema)} if schema else {}
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._openai_messages(prompt, system_prompt),
+            stream=True,
+            **kwargs
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def _wait_for_slot(self, tokens: int):
+        """Bloquea hasta que el scheduler permite enviar la petición"""
+        waited = 0.0
+        wait = self._schedule_wait(tokens, waited)
+        while wait > 0:
+            time.sleep(wait)
+            waited += wait
+            wait = self._schedule_wait(tokens, waited)
+    
+    def stream_ai(self, prompt: str, system_prompt: str = None, schema: str = None, on_text=None) -> str:
+        """Como _call_ai pero en streaming: on_text(texto_acumulado) se invoca con cada fragmento.
+        
+        Si el stream se corta sin poder reintentar se lanza AIRequestError con lo recibido
+        hasta entonces en partial, que parse_json_response puede aprovechar parcialmente.
+        """
+        cached = self._get_cached_response(prompt, system_prompt, schema)
+        if cached is not None:
+            if on_text:
+                on_text(cached)
+            return cached
+        
+        tokens = self._request_tokens(prompt, system_prompt)
+        received = ''
+        for attempt in range(AI_MAX_RETRIES + 1):
+            self._wait_for_slot(tokens)
+            received = ''
+            try:
+                for piece in self._request_stream(prompt, system_prompt, schema):
+                    received += piece
+                    if on_text:
+                        on_text(received)
+                result = received or '{}'
+                self._store_cached_response(prompt, system_prompt, result, schema)
+                return result
+            except Exception as e:
+                time.sleep(self._handle_call_error(e, attempt, 'stream_ai', received))
+        raise AIRequestError("La llamada a la IA falló tras agotar los reintentos", received)
+    
+    def _call_ai(self, prompt: str, system_prompt: str = None, schema: str = None) -> str:
+        """Llamada síncrona; schema es una clave de AI_RESPONSE_SCHEMAS para pedir JSON estructurado.
+        
+        Lanza AIRequestError si la petición falla tras los reintentos.
+        """
+        cached = self._get_cached_response(prompt, system_prompt, schema)
+        if cached is not None:
+            return cached
+        
+        tokens = self._request_tokens(prompt, system_prompt)
+        for attempt in range(AI_MAX_RETRIES + 1):
+            self._wait_for_slot(tokens)
+            try:
+                # Asegurar que nunca retornamos None
+                result = self._request(prompt, system_prompt, schema) or '{}'
+                self._store_cached_response(prompt, system_prompt, result, schema)
+                return result
+            except Exception as e:
+                time.sleep(self._handle_call_error(e, attempt, '_call_ai'))
+        raise AIRequestError("La llamada a la IA falló tras agotar los reintentos")
+    
+    async def _call_ai_async(self, prompt: str, system_prompt: Optional[str], schema: Optional[str],
+                             async_client, semaphore: asyncio.Semaphore) -> str:
+        """Versión asíncrona de _call_ai; el semáforo, compartido por el lote, limita las llamadas simultáneas"""
+        cached = self._get_cached_response(prompt, system_prompt, schema)
+        if cached is not None:
+            return cached
+        
+        tokens = self._request_tokens(prompt, system_prompt)
+        for attempt in range(AI_MAX_RETRIES + 1):
+            # Esperar turno del scheduler fuera del semáforo para no bloquear a las demás
+            waited = 0.0
+            wait = self._schedule_wait(tokens, waited)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                waited += wait
+                wait = self._schedule_wait(tokens, waited)
+            try:
+                async with semaphore:
+                    result = await self._request_async(prompt, system_prompt, async_client, schema) or '{}'
+                self._store_cached_response(prompt, system_prompt, result, schema)
+                return result
+            except Exception as e:
+                await asyncio.sleep(self._handle_call_error(e, attempt, '_call_ai_async'))
+        raise AIRequestError("La llamada a la IA falló tras agotar los reintentos")
+    
+    async def _call_many_async(self, requests: List[tuple], on_done=None,
+                               return_exceptions: bool = False) -> List[str]:
+        # Clientes asíncronos creados dentro de este event loop: los de un asyncio.run anterior
+        # quedan ligados a un loop ya cerrado
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.provider == "gemini":
+            from google import genai
+            async_client = genai.Client(api_key=self.api_key).aio
+        else:
+            from openai import AsyncOpenAI
+            async_client = AsyncOpenAI()
+        
+        async def call(index: int, prompt: str, system_prompt: str = None, schema: str = None) -> str:
+            result = await self._call_ai_async(prompt, system_prompt, schema, async_client, semaphore)
+            if on_done:
+                on_done(index, result)
+            return result
+        
+        try:
+            return await asyncio.gather(*(call(i, *request) for i, request in enumerate(requests)),
+                                        return_exceptions=return_exceptions)
+        finally:
+            close = getattr(async_client, 'aclose', None) or getattr(async_client, 'close', None)
+            if close is not None:
+                await close()
+    
+    def call_many(self, requests: List[tuple], on_done=None, return_exceptions: bool = False) -> List[str]:
+        """Lanza varias llamadas (prompt, system_prompt[, schema]) a la vez y devuelve las respuestas en orden.
+        
+        Como mucho max_concurrency llamadas están en vuelo simultáneamente, así que el lote
+        tarda aproximadamente lo que la llamada más lenta. on_done(index, respuesta) se invoca al
+        completarse cada una con éxito. Si una llamada falla se lanza su AIRequestError; con
+        return_exceptions=True la excepción ocupa su posición en la lista y el resto continúa.
+        Debe llamarse desde un thread sin event loop (los workers).
+        """
+        if not requests:
+            return []
+        return asyncio.run(self._call_many_async(requests, on_done, return_exceptions))
     
     def extract_tasks(self, messages: List[Dict]) -> List[TaskExtracted]:
+        return self._parse_tasks(self._call_ai(*self._tasks_request(messages)))
+    
+    def _tasks_request(self, messages: List[Dict]) -> tuple:
+        """(prompt, system_prompt, schema) para extraer tareas"""
         messages_text = self._format_messages(messages)
         
         system_prompt = """Eres un experto en análisis de conversaciones y gestión de proyectos.
@@ -1434,11 +3865,11 @@ Responde SOLO con JSON válido:
 IMPORTANTE: En assigned_to, indica claramente QUIÉN debe realizar la tarea, no quién la mencionó."""
 
         prompt = f"Analiza esta conversación y extrae TODAS las tareas:\n\n{messages_text}\n\nResponde SOLO con JSON válido."
-
+        return prompt, system_prompt, 'tasks'
+    
+    def _parse_tasks(self, response: str) -> List[TaskExtracted]:
         try:
-            response = self._call_ai(prompt, system_prompt)
-            json_str = self._extract_json(response)
-            data = json.loads(json_str)
+            data = parse_json_response(response)
             
             tasks = []
             for t in data.get('tasks', []):
@@ -1459,6 +3890,18 @@ IMPORTANTE: En assigned_to, indica claramente QUIÉN debe realizar la tarea, no
             return []
     
     def analyze_person(self, name: str, messages: List[Dict], is_me: bool = False) -> PersonProfile:
+        return self._parse_person_profile(name, self._call_ai(*self._person_request(name, messages, is_me)))
+    
+    def analyze_persons(self, persons: List[tuple], on_done=None) -> Dict[str, PersonProfile]:
+        """Analiza varias personas (name, messages, is_me) en paralelo"""
+        responses = self.call_many(
+            [self._person_request(name, messages, is_me) for name, messages, is_me in persons], on_done
+        )
+        return {name: self._parse_person_profile(name, response)
+                for (name, _, _), response in zip(persons, responses)}
+    
+    def _person_request(self, name: str, messages: List[Dict], is_me: bool = False) -> tuple:
+        """(prompt, system_prompt, schema) para el perfil de una persona"""
         messages_text = self._format_messages(messages, include_sender=False)
         
         extra_instructions = ""
@@ -1491,11 +3934,11 @@ Responde SOLO con JSON válido:
 }}"""
 
         prompt = f"Analiza el perfil profesional de {name} basándote en sus mensajes:\n\n{messages_text}\n\nResponde SOLO con JSON válido."
-
+        return prompt, system_prompt, 'person_profile'
+    
+    def _parse_person_profile(self, name: str, response: str) -> PersonProfile:
         try:
-            response = self._call_ai(prompt, system_prompt)
-            json_str = self._extract_json(response)
-            data = json.loads(json_str)
+            data = parse_json_response(response)
             
             skills = []
             for s in data.get('skills', []):
@@ -1533,7 +3976,11 @@ Responde SOLO con JSON válido:
                                sentiment='neutral', sentiment_score=0.0, commitments=[])
     
     def detect_patterns(self, messages: List[Dict], participants: Dict) -> List[Dict]:
-        messages_text = self._format_messages(messages[:200])
+        return self._parse_patterns(self._call_ai(*self._patterns_request(messages, participants)))
+    
+    def _patterns_request(self, messages: List[Dict], participants: Dict) -> tuple:
+        """(prompt, system_prompt, schema) para detectar patrones"""
+        messages_text = self._format_messages(messages)
         
         system_prompt = """Identifica patrones de comunicación, dinámicas de grupo y temas recurrentes.
 Sé específico y proporciona recomendaciones accionables.
@@ -1553,11 +4000,11 @@ Responde SOLO con JSON válido:
 }"""
 
         prompt = f"Analiza los patrones de comunicación en esta conversación:\n\n{messages_text}\n\nResponde SOLO con JSON válido."
-
+        return prompt, system_prompt, 'patterns'
+    
+    def _parse_patterns(self, response: str) -> List[Dict]:
         try:
-            response = self._call_ai(prompt, system_prompt)
-            json_str = self._extract_json(response)
-            data = json.loads(json_str)
+            data = parse_json_response(response)
             return data.get('patterns', [])
         except Exception as e:
             print(f"Error detectando patrones: {e}")
@@ -1565,7 +4012,21 @@ Responde SOLO con JSON válido:
     
     def detect_behavior_alerts(self, messages: List[Dict], person_name: str, my_name: str = None) -> List[Dict]:
         """Detecta comportamientos problemáticos de una persona hacia el usuario"""
-        messages_text = self._format_messages(messages[:150])
+        response = self._call_ai(*self._behavior_request(messages, person_name, my_name))
+        return self._parse_behavior_alerts(person_name, response)
+    
+    def detect_behavior_alerts_many(self, persons: List[tuple], my_name: str = None,
+                                    on_done=None) -> List[List[Dict]]:
+        """Detecta alertas de varias personas (messages, person_name) en paralelo"""
+        responses = self.call_many(
+            [self._behavior_request(messages, person_name, my_name) for messages, person_name in persons], on_done
+        )
+        return [self._parse_behavior_alerts(person_name, response)
+                for (_, person_name), response in zip(persons, responses)]
+    
+    def _behavior_request(self, messages: List[Dict], person_name: str, my_name: str = None) -> tuple:
+        """(prompt, system_prompt, schema) para detectar alertas de comportamiento"""
+        messages_text = self._format_messages(messages)
         
         system_prompt = f"""Eres un experto en psicología y comunicación interpersonal.
 Analiza los mensajes de {person_name} para detectar comportamientos problemáticos hacia {my_name or 'el usuario'}.
@@ -1600,11 +4061,11 @@ Responde SOLO con JSON válido:
 IMPORTANTE: Solo incluye alertas con confidence >= 0.6. Mejor pocos alertas certeras que muchos falsos positivos."""
 
         prompt = f"Analiza los mensajes de {person_name} y detecta comportamientos problemáticos:\n\n{messages_text}\n\nResponde SOLO con JSON válido."
-
+        return prompt, system_prompt, 'behavior_alerts'
+    
+    def _parse_behavior_alerts(self, person_name: str, response: str) -> List[Dict]:
         try:
-            response = self._call_ai(prompt, system_prompt)
-            json_str = self._extract_json(response)
-            data = json.loads(json_str)
+            data = parse_json_response(response)
             
             # Filtrar por confidence
             alerts = [a for a in data.get('alerts', []) if float(a.get('confidence', 0)) >= 0.6]
@@ -1613,31 +4074,408 @@ IMPORTANTE: Solo incluye alertas con confidence >= 0.6. Mejor pocos alertas cert
             print(f"Error detectando alertas para {person_name}: {e}")
             return []
     
+    # === MODO BATCH (análisis nocturno) ===
+    def batch_backend(self, name: str = None, responder=None) -> 'BatchBackend':
+        """Backend de lotes del proveedor; 'local' es el sustituto sin conexión"""
+        name = name or self.provider
+        if name == 'local':
+            return LocalBatchBackend(self, responder)
+        if name == 'gemini':
+            return GeminiBatchBackend(self)
+        return OpenAIBatchBackend(self)
+    
+    def batch_requests(self, persons: List[tuple], chats: List[tuple] = None, my_name: str = None) -> List[Dict]:
+        """Peticiones del análisis nocturno: perfil y alertas de cada persona y tareas de cada chat.
+        
+        persons son (persona, mensajes) y chats (chat_id, mensajes). Cada petición lleva lo
+        necesario para guardar su resultado cuando se ingiera el lote.
+        """
+        requests = []
+        for person, messages in persons:
+            watermark = self._packed_watermark(messages, include_sender=False)
+            is_me = bool(person.get('is_me'))
+            built = [self._person_request(person['name'], messages, is_me)]
+            if not is_me:
+                built.append(self._behavior_request(messages, person['name'], my_name))
+            for prompt, system_prompt, schema in built:
+                requests.append({
+                    'custom_id': f"{schema}-{person['id']}", 'schema': schema,
+                    'person_id': person['id'], 'watermark': watermark,
+                    'prompt': prompt, 'system_prompt': system_prompt,
+                })
+        for chat_id, messages in chats or []:
+            prompt, system_prompt, schema = self._tasks_request(messages)
+            requests.append({
+                'custom_id': f"{schema}-{chat_id}", 'schema': schema,
+                'prompt': prompt, 'system_prompt': system_prompt,
+            })
+        return requests
+    
+    def submit_batch(self, db: 'Database', requests: List[Dict], backend: 'BatchBackend' = None) -> List[int]:
+        """Empaqueta las peticiones en archivos JSONL del Batch API y los envía como trabajos.
+        
+        Se crean tantos trabajos como exijan los límites del proveedor (AI_BATCH_LIMITS);
+        cada uno queda registrado en ai_batch_jobs. Devuelve sus ids.
+        """
+        backend = backend or self.batch_backend()
+        batch_dir = os.path.join(os.path.dirname(os.path.abspath(db.db_path)), AI_BATCH_DIR)
+        os.makedirs(batch_dir, exist_ok=True)
+        
+        job_ids = []
+        for group in backend.split(requests):
+            path = os.path.join(batch_dir, f"{backend.name}_{datetime.now():%Y%m%d_%H%M%S_%f}.jsonl")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(line for _, line in group)
+            job_id = db.add_ai_batch_job(self.provider, self.model, backend.name, path, [r for r, _ in group])
+            try:
+                remote_id = backend.submit(path)
+            except Exception as e:
+                db.update_ai_batch_job(job_id, 'failed', error=str(e))
+                raise
+            db.update_ai_batch_job(job_id, 'submitted', remote_id=remote_id)
+            job_ids.append(job_id)
+        return job_ids
+    
+    def ingest_batches(self, db: 'Database', backend: 'BatchBackend' = None) -> Dict[str, int]:
+        """Consulta los trabajos pendientes del proveedor y guarda los resultados de los terminados"""
+        summary = {'pending': 0, 'ingested': 0, 'failed': 0, 'responses': 0}
+        for job in db.get_pending_ai_batch_jobs(self.provider):
+            job_backend = backend if backend and backend.name == job['backend'] else self.batch_backend(job['backend'])
+            try:
+                status, error = job_backend.poll(job['remote_id'])
+                if status == 'completed':
+                    results = job_backend.fetch_results(job['remote_id'])
+            except Exception as e:
+                print(f"Error consultando el trabajo batch {job['remote_id']}: {e}")
+                summary['pending'] += 1
+                continue
+            
+            if status == 'running':
+                db.update_ai_batch_job(job['id'], 'running')
+                summary['pending'] += 1
+                continue
+            if status == 'failed':
+                db.update_ai_batch_job(job['id'], 'failed', error=error)
+                summary['failed'] += 1
+                continue
+            
+            for request in db.get_ai_batch_requests(job['id']):
+                response = results.get(request['custom_id'])
+                if not response:
+                    continue
+                self._store_cached_response(request['prompt'], request['system_prompt'], response, request['schema'])
+                self._ingest_batch_response(db, request, response)
+                summary['responses'] += 1
+            db.update_ai_batch_job(job['id'], 'ingested')
+            summary['ingested'] += 1
+        return summary
+    
+    def _ingest_batch_response(self, db: 'Database', request: Dict, response: str) -> int:
+        """Guarda el resultado de una petición del lote y devuelve cuántos elementos guardó"""
+        # Una respuesta vacía o ilegible no debe pisar el perfil ya guardado
+        if not parse_json_response(response):
+            return 0
+        
+        if request['schema'] == 'tasks':
+            saved = 0
+            for task in self._parse_tasks(response):
+                if not task.title:
+                    continue
+                assignee = db.get_person_by_name(task.assigned_to.strip()) if task.assigned_to else None
+                if task.assigned_to and not assignee:
+                    continue  # Nombre que no es de ningún participante: no se crean personas inventadas
+                db.upsert_task(
+                    task.title, assignee['id'] if assignee else None,
+                    task.description, task.status, task.priority,
+                    category=task.category, source_message=task.source_message
+                )
+                saved += 1
+            return saved
+        
+        person = db.get_person(request['person_id'])
+        if not person:
+            return 0
+        
+        if request['schema'] == 'behavior_alerts':
+            alerts = [alert for alert in self._parse_behavior_alerts(person['name'], response) if alert.get('title')]
+            for alert in alerts:
+                db.upsert_behavior_alert(
+                    person_id=person['id'],
+                    alert_type=alert.get('alert_type', 'red_flags'),
+                    title=alert['title'],
+                    description=alert.get('description'),
+                    severity=alert.get('severity', 'medium'),
+                    evidence=alert.get('evidence')
+                )
+            return len(alerts)
+        
+        profile = self._parse_person_profile(person['name'], response)
+        db.update_person(
+            person['id'], role=profile.role.value,
+            role_confidence=profile.role_confidence,
+            profile_summary=profile.summary or person.get('profile_summary'),
+            sentiment=profile.sentiment,
+            sentiment_score=profile.sentiment_score,
+            ai_analyzed=1, ai_analyzed_at=datetime.now().isoformat(),
+            ai_watermark_message_id=request['watermark_message_id']
+        )
+        for skill in profile.skills:
+            skill_id = db.add_skill(skill.name, skill.category)
+            db.add_person_skill(person['id'], skill_id, skill.score, skill.evidence)
+        for commitment in profile.commitments or []:
+            if commitment.get('title'):
+                db.upsert_commitment(
+                    person_id=person['id'],
+                    title=commitment['title'],
+                    commitment_type=commitment.get('type', 'promise'),
+                    due_date=commitment.get('due_date'),
+                    evidence=commitment.get('evidence')
+                )
+        return 1
+    
+    def _format_message_line(self, msg: Dict, include_sender: bool = True) -> str:
+        timestamp = msg.get('timestamp', '')[:16] if msg.get('timestamp') else ''
+        sender = msg.get('sender', 'Desconocido') or 'Desconocido'
+        content = msg.get('content', '') or ''  # Manejar None
+        if not content:  # Saltar mensajes vacíos
+            return ''
+        max_chars = AI_MAX_MESSAGE_TOKENS * CHARS_PER_TOKEN
+        if len(content) > max_chars:
+            content = content[:max_chars] + '…'
+        if include_sender:
+            return f"[{timestamp}] {sender}: {content}"
+        return f"[{timestamp}] {content}"
+    
+    def _packed_messages(self, messages: List[Dict], include_sender: bool = True) -> List[Dict]:
+        """Mensajes que entran en el prompt dentro del presupuesto de tokens"""
+        return pack_messages(messages, self.prompt_token_budget, lambda msg: self._format_message_line(msg, include_sender))
+    
+    def _packed_watermark(self, messages: List[Dict], include_sender: bool = True) -> Optional[int]:
+        """Id hasta el que todos los mensajes entran en el prompt (None si falta ya el primero).
+        
+        pack_messages elige por informatividad, así que el más reciente casi siempre entra:
+        el máximo de los empaquetados dejaría por debajo de la marca mensajes nunca enviados.
+        Los mensajes sin contenido no se envían nunca y no cortan la secuencia.
+        """
+        packed_ids = {m['id'] for m in self._packed_messages(messages, include_sender)}
+        watermark = None
+        for message in sorted(messages, key=lambda m: m['id']):
+            if message['id'] not in packed_ids and self._format_message_line(message, include_sender):
+                break
+            watermark = message['id']
+        return watermark
+    
     def _format_messages(self, messages: List[Dict], include_sender: bool = True) -> str:
-        lines = []
-        for msg in messages:
-            timestamp = msg.get('timestamp', '')[:16] if msg.get('timestamp') else ''
-            sender = msg.get('sender', 'Desconocido') or 'Desconocido'
-            content = msg.get('content', '') or ''  # Manejar None
-            if not content:  # Saltar mensajes vacíos
+        """Formatea los mensajes para el prompt, empaquetados dentro del presupuesto de tokens"""
+        packed = self._packed_messages(messages, include_sender)
+        return "\n".join(self._format_message_line(msg, include_sender) for msg in packed)
+
+
+# ============================================================
+# ANÁLISIS POR LOTES (BATCH API)
+# ============================================================
+
+class BatchBackend:
+    """Backend de trabajos por lotes: archivo JSONL → trabajo en el proveedor → resultados.
+    
+    format_line() convierte una petición de AIAnalyzer.batch_requests en una línea del
+    archivo; poll() devuelve ('running' | 'completed' | 'failed', error) y fetch_results()
+    las respuestas de un trabajo terminado indexadas por custom_id.
+    """
+    name = ''
+    
+    def __init__(self, analyzer: AIAnalyzer):
+        self.analyzer = analyzer
+        limits = AI_BATCH_LIMITS.get(self.name, {})
+        self.max_requests = limits.get('max_requests')
+        self.max_bytes = limits.get('max_bytes')
+    
+    def format_line(self, request: Dict) -> Dict:
+        raise NotImplementedError
+    
+    def split(self, requests: List[Dict]) -> List[List[tuple]]:
+        """Reparte las peticiones en grupos de (petición, línea JSONL) dentro de los límites del proveedor"""
+        groups = []
+        current, size = [], 0
+        for request in requests:
+            line = json.dumps(self.format_line(request), ensure_ascii=False) + '\n'
+            line_size = len(line.encode('utf-8'))
+            full = ((self.max_requests and len(current) >= self.max_requests) or
+                    (self.max_bytes and size + line_size > self.max_bytes))
+            if current and full:
+                groups.append(current)
+                current, size = [], 0
+            current.append((request, line))
+            size += line_size
+        if current:
+            groups.append(current)
+        return groups
+    
+    def submit(self, path: str) -> str:
+        raise NotImplementedError
+    
+    def poll(self, remote_id: str) -> tuple:
+        raise NotImplementedError
+    
+    def fetch_results(self, remote_id: str) -> Dict[str, str]:
+        raise NotImplementedError
+
+
+class GeminiBatchBackend(BatchBackend):
+    """Batch API de Gemini: archivo JSONL subido con la File API"""
+    name = 'gemini'
+    FAILED_STATES = {'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+    
+    def format_line(self, request: Dict) -> Dict:
+        system_prompt = request.get('system_prompt')
+        full_prompt = f"{system_prompt}\n\n{request['prompt']}" if system_prompt else request['prompt']
+        body = {'contents': [{'role': 'user', 'parts': [{'text': full_prompt}]}]}
+        config = self.analyzer._gemini_config(request.get('schema'))
+        if config:
+            body['generation_config'] = config
+        return {'key': request['custom_id'], 'request': body}
+    
+    def submit(self, path: str) -> str:
+        client = self.analyzer.client
+        uploaded = client.files.upload(
+            file=path, config={'display_name': os.path.basename(path), 'mime_type': 'jsonl'}
+        )
+        job = client.batches.create(
+            model=self.analyzer.model, src=uploaded.name,
+            config={'display_name': os.path.basename(path)}
+        )
+        return job.name
+    
+    def poll(self, remote_id: str) -> tuple:
+        job = self.analyzer.client.batches.get(name=remote_id)
+        state = getattr(job.state, 'name', str(job.state))
+        if state == 'JOB_STATE_SUCCEEDED':
+            return 'completed', None
+        if state in self.FAILED_STATES:
+            return 'failed', str(job.error or state)
+        return 'running', None
+    
+    def fetch_results(self, remote_id: str) -> Dict[str, str]:
+        client = self.analyzer.client
+        job = client.batches.get(name=remote_id)
+        content = client.files.download(file=job.dest.file_name).decode('utf-8')
+        results = {}
+        for line in content.splitlines():
+            if not line.strip():
                 continue
-            if include_sender:
-                lines.append(f"[{timestamp}] {sender}: {content}")
-            else:
-                lines.append(f"[{timestamp}] {content}")
-        return "\n".join(lines)
+            item = json.loads(line)
+            try:
+                parts = item['response']['candidates'][0]['content']['parts']
+                results[item['key']] = ''.join(part.get('text', '') for part in parts)
+            except (KeyError, IndexError, TypeError):
+                print(f"Petición batch {item.get('key')} sin respuesta: {item.get('error')}")
+        return results
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Batch API de OpenAI sobre /v1/chat/completions"""
+    name = 'openai'
+    ENDPOINT = '/v1/chat/completions'
+    FAILED_STATES = {'failed', 'expired', 'cancelled'}
+    
+    def format_line(self, request: Dict) -> Dict:
+        body = {
+            'model': self.analyzer.model,
+            'messages': self.analyzer._openai_messages(request['prompt'], request.get('system_prompt')),
+        }
+        if request.get('schema'):
+            body['response_format'] = self.analyzer._openai_response_format(request['schema'])
+        return {'custom_id': request['custom_id'], 'method': 'POST', 'url': self.ENDPOINT, 'body': body}
+    
+    def submit(self, path: str) -> str:
+        client = self.analyzer.client
+        with open(path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=input_file.id, endpoint=self.ENDPOINT, completion_window='24h'
+        )
+        return batch.id
+    
+    def poll(self, remote_id: str) -> tuple:
+        batch = self.analyzer.client.batches.retrieve(remote_id)
+        if batch.status == 'completed':
+            return 'completed', None
+        if batch.status in self.FAILED_STATES:
+            # Un lote caducado o cancelado conserva las respuestas que llegó a completar
+            if batch.output_file_id:
+                return 'completed', None
+            return 'failed', str(batch.errors or batch.status)
+        return 'running', None
+    
+    def fetch_results(self, remote_id: str) -> Dict[str, str]:
+        client = self.analyzer.client
+        batch = client.batches.retrieve(remote_id)
+        results = {}
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get('response') or {}
+            if response.get('status_code') != 200:
+                print(f"Petición batch {item.get('custom_id')} sin respuesta: {item.get('error')}")
+                continue
+            results[item['custom_id']] = response['body']['choices'][0]['message']['content']
+        return results
+
+
+class LocalBatchBackend(BatchBackend):
+    """Sustituto local del Batch API para uso sin conexión.
+    
+    El trabajo es el propio archivo JSONL: al consultarlo se resuelve cada petición con
+    responder(prompt, system_prompt, schema) y las respuestas se guardan junto a él. Sin
+    responder todas las respuestas son '{}' y la ingesta no modifica nada.
+    """
+    name = 'local'
+    
+    def __init__(self, analyzer: AIAnalyzer, responder=None):
+        super().__init__(analyzer)
+        self.responder = responder or (lambda prompt, system_prompt, schema: '{}')
+    
+    def format_line(self, request: Dict) -> Dict:
+        return {
+            'custom_id': request['custom_id'], 'prompt': request['prompt'],
+            'system_prompt': request.get('system_prompt'), 'schema': request.get('schema'),
+        }
+    
+    def submit(self, path: str) -> str:
+        return path
     
-    def _extract_json(self, text: str) -> str:
-        if not text:
-            return '{}'
-        text = str(text)  # Asegurar que es string
-        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)```', text)
-        if json_match:
-            return json_match.group(1).strip()
-        json_match = re.search(r'\{[\s\S]*\}', text)
-        if json_match:
-            return json_match.group(0)
-        return text
+    def poll(self, remote_id: str) -> tuple:
+        output_path = remote_id + '.out'
+        if not os.path.exists(output_path):
+            with open(remote_id, encoding='utf-8') as f_in, open(output_path + '.tmp', 'w', encoding='utf-8') as f_out:
+                for line in f_in:
+                    item = json.loads(line)
+                    response = self.responder(item['prompt'], item['system_prompt'], item['schema'])
+                    f_out.write(json.dumps({'custom_id': item['custom_id'], 'response': response},
+                                           ensure_ascii=False) + '\n')
+            os.replace(output_path + '.tmp', output_path)
+        return 'completed', None
+    
+    def fetch_results(self, remote_id: str) -> Dict[str, str]:
+        with open(remote_id + '.out', encoding='utf-8') as f:
+            return {item['custom_id']: item['response'] for item in map(json.loads, f) if item}
+
+
+def submit_batch_analysis(db: Database, analyzer: AIAnalyzer, backend: BatchBackend = None) -> List[int]:
+    """Envía el análisis nocturno de todas las personas y chats como trabajos por lotes"""
+    messages_by_person = {}
+    messages_by_chat = {}
+    for message in db.get_all_messages():
+        message['sender'] = message['sender_name']
+        messages_by_person.setdefault(message['person_id'], []).append(message)
+        messages_by_chat.setdefault(message['chat_id'], []).append(message)
+    
+    persons = [(person, messages_by_person[person['id']])
+               for person in db.get_all_persons(AI_BATCH_MIN_MESSAGES) if person['id'] in messages_by_person]
+    me = db.get_me()
+    requests = analyzer.batch_requests(persons, list(messages_by_chat.items()), me['name'] if me else None)
+    return analyzer.submit_batch(db, requests, backend)
 
 
 # ============================================================
@@ -1783,296 +4621,359 @@ class StatCard(QFrame):
         """)
 
 
-class PersonCard(Card):
-    analyze_clicked = pyqtSignal(int)  # Señal para solicitar análisis de persona
-    edit_clicked = pyqtSignal(int, str)  # person_id, nombre actual
-    delete_clicked = pyqtSignal(int, str)  # person_id, nombre
-    avatar_clicked = pyqtSignal(int)  # person_id para cambiar avatar
+class PersonListModel(QAbstractListModel):
+    """Modelo de la rejilla de personas: una fila por persona (dict de la BD con 'skills')"""
+    PersonRole = Qt.ItemDataRole.UserRole
     
-    def __init__(self, person_id: int, name: str, role: str, skills: list = None,
-                 message_count: int = 0, is_me: bool = False, ai_analyzed: bool = False,
-                 sentiment: str = 'neutral', sentiment_score: float = 0.0, 
-                 avatar_path: str = None, parent=None):
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.person_id = person_id
-        self.name = name
-        self.ai_analyzed = ai_analyzed
-        self.sentiment = sentiment
-        self.sentiment_score = sentiment_score
-        self.avatar_path = avatar_path
-        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
-        self.customContextMenuRequested.connect(self._show_context_menu)
-        self._setup_ui(name, role, skills, message_count, is_me, ai_analyzed, sentiment, sentiment_score, avatar_path)
-    
-    def _show_context_menu(self, pos):
-        """Muestra menú contextual con opciones de edición"""
-        menu = QMenu(self)
-        menu.setStyleSheet("""
-            QMenu {
-                background-color: white;
-                border: 1px solid #E2E8F0;
-                border-radius: 8px;
-                padding: 4px;
-            }
-            QMenu::item {
-                padding: 8px 16px;
-                border-radius: 4px;
-            }
-            QMenu::item:selected {
-                background-color: #F1F5F9;
-            }
-        """)
-        
-        edit_action = menu.addAction("✏️ Editar nombre")
-        avatar_action = menu.addAction("🖼️ Cambiar foto")
-        menu.addSeparator()
-        delete_action = menu.addAction("🗑️ Eliminar persona")
-        delete_action.setStyleSheet("color: #EF4444;")
-        
-        action = menu.exec(self.mapToGlobal(pos))
+        self._persons = []
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._persons)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        person = self._persons[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return person['name']
+        if role == self.PersonRole:
+            return person
+        return None
+    
+    def set_persons(self, persons: List[Dict]):
+        self.beginResetModel()
+        self._persons = persons
+        self.endResetModel()
+
+
+class PersonCardDelegate(QStyledItemDelegate):
+    """Pinta la tarjeta de una persona; solo se llama para las filas visibles"""
+    CARD_HEIGHT = 196
+    MIN_CARD_WIDTH = 300
+    MARGIN = 10
+    PADDING = 16
+    AVATAR_SIZE = 48
+    BUTTON_HEIGHT = 32
+    
+    SENTIMENT_BADGES = {
+        'positive': ('😊', '#D1FAE5'),
+        'neutral': ('😐', '#F3F4F6'),
+        'negative': ('😟', '#FEE2E2'),
+    }
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._avatar_cache = OrderedDict()  # (ruta, mtime) -> QPixmap escalado
+        self._avatar_cache_size = 256
+        self.card_width = self.MIN_CARD_WIDTH  # Lo ajusta PersonGridView según el ancho disponible
+    
+    def sizeHint(self, option, index):
+        return QSize(self.card_width, self.CARD_HEIGHT)
+    
+    # --- Geometría ---
+    def card_rect(self, rect: QRect) -> QRect:
+        return rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+    
+    def delete_button_rect(self, rect: QRect) -> QRect:
+        card = self.card_rect(rect)
+        return QRect(card.right() - self.PADDING - self.BUTTON_HEIGHT + 1,
+                     card.bottom() - self.PADDING - self.BUTTON_HEIGHT + 1,
+                     self.BUTTON_HEIGHT, self.BUTTON_HEIGHT)
+    
+    def analyze_button_rect(self, rect: QRect) -> QRect:
+        card = self.card_rect(rect)
+        delete_rect = self.delete_button_rect(rect)
+        left = card.left() + self.PADDING
+        return QRect(left, delete_rect.top(), delete_rect.left() - 8 - left, self.BUTTON_HEIGHT)
+    
+    def hit_test(self, rect: QRect, pos: QPoint) -> Optional[str]:
+        if self.analyze_button_rect(rect).contains(pos):
+            return 'analyze'
+        if self.delete_button_rect(rect).contains(pos):
+            return 'delete'
+        if self.card_rect(rect).contains(pos):
+            return 'card'
+        return None
+    
+    # --- Pintado ---
+    def paint(self, painter, option, index):
+        person = index.data(PersonListModel.PersonRole)
+        if not person:
+            return
         
-        if action == edit_action:
-            self.edit_clicked.emit(self.person_id, self.name)
-        elif action == avatar_action:
-            self.avatar_clicked.emit(self.person_id)
-        elif action == delete_action:
-            self.delete_clicked.emit(self.person_id, self.name)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         
-    def _setup_ui(self, name: str, role: str, skills: list, message_count: int, is_me: bool, ai_analyzed: bool,
-                   sentiment: str = 'neutral', sentiment_score: float = 0.0, avatar_path: str = None):
-        layout = QVBoxLayout(self)
-        layout.setSpacing(10)
-        layout.setContentsMargins(16, 16, 16, 16)
+        card = self.card_rect(option.rect)
+        hovered = bool(option.state & QStyle.StateFlag.State_MouseOver)
         
-        # Header con avatar e info
-        header = QHBoxLayout()
-        header.setSpacing(12)
+        # Fondo de la tarjeta
+        painter.setPen(QPen(QColor(COLORS['border'] if hovered else COLORS['border_light']), 1))
+        painter.setBrush(QColor(COLORS['bg_secondary']))
+        painter.drawRoundedRect(QRectF(card).adjusted(0.5, 0.5, -0.5, -0.5), 16, 16)
         
-        # Avatar (más pequeño) - con soporte para imagen personalizada
+        name = person.get('name') or '?'
+        role = person.get('role') or 'desconocido'
         role_colors = ROLE_COLORS.get(role.lower(), ROLE_COLORS['desconocido'])
-        avatar = QLabel()
-        avatar.setFixedSize(48, 48)
-        avatar.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        
-        if avatar_path and os.path.exists(avatar_path):
-            # Cargar imagen personalizada
-            pixmap = QPixmap(avatar_path)
-            pixmap = pixmap.scaled(48, 48, Qt.AspectRatioMode.KeepAspectRatioByExpanding, Qt.TransformationMode.SmoothTransformation)
-            # Crear máscara circular
-            mask = QPixmap(48, 48)
-            mask.fill(Qt.GlobalColor.transparent)
-            painter = QPainter(mask)
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-            painter.setBrush(Qt.GlobalColor.white)
-            painter.setPen(Qt.PenStyle.NoPen)
-            painter.drawEllipse(0, 0, 48, 48)
-            painter.end()
-            pixmap.setMask(mask.mask())
-            avatar.setPixmap(pixmap)
-            avatar.setStyleSheet("border-radius: 24px;")
-        else:
-            # Avatar con inicial
-            avatar.setText(name[0].upper() if name else "?")
-            avatar.setStyleSheet(f"""
-                background-color: {role_colors[1]};
-                color: {role_colors[0]};
-                border-radius: 24px;
-                font-size: 20px;
-                font-weight: 700;
-            """)
-        header.addWidget(avatar)
-        
-        # Info container
-        info_layout = QVBoxLayout()
-        info_layout.setSpacing(4)
-        
-        # Nombre con badges en fila
-        name_row = QHBoxLayout()
-        name_row.setSpacing(6)
-        
-        # Nombre (con elipsis si es muy largo)
-        name_label = QLabel(name)
-        name_label.setStyleSheet(f"""
-            color: {COLORS['text_primary']};
-            font-size: 15px;
-            font-weight: 600;
-        """)
-        name_label.setWordWrap(True)
-        name_label.setMaximumWidth(180)
-        name_row.addWidget(name_label, 1)
-        
-        # Badges en contenedor horizontal
-        badges_layout = QHBoxLayout()
-        badges_layout.setSpacing(4)
-        
-        if is_me:
-            me_badge = QLabel("TÚ")
-            me_badge.setStyleSheet(f"""
-                background-color: {COLORS['accent']};
-                color: white;
-                padding: 2px 6px;
-                border-radius: 4px;
-                font-size: 9px;
-                font-weight: 700;
-            """)
-            me_badge.setFixedHeight(18)
-            badges_layout.addWidget(me_badge)
+        ai_analyzed = bool(person.get('ai_analyzed', 0))
         
+        # Avatar
+        avatar_rect = QRect(card.left() + self.PADDING, card.top() + self.PADDING,
+                            self.AVATAR_SIZE, self.AVATAR_SIZE)
+        self._paint_avatar(painter, avatar_rect, name, person.get('avatar_path'), role_colors)
+        
+        # Nombre + badges
+        text_left = avatar_rect.right() + 13
+        text_right = card.right() - self.PADDING
+        badges = []
+        if person.get('is_me'):
+            badges.append(("TÚ", COLORS['accent'], 'white'))
         if ai_analyzed:
-            ai_badge = QLabel("✓ IA")
-            ai_badge.setStyleSheet(f"""
-                background-color: {COLORS['success_soft']};
-                color: {COLORS['success']};
-                padding: 2px 6px;
-                border-radius: 4px;
-                font-size: 9px;
-                font-weight: 700;
-            """)
-            ai_badge.setFixedHeight(18)
-            ai_badge.setToolTip("Esta persona ya fue analizada con IA")
-            badges_layout.addWidget(ai_badge)
-            
-            # Badge de sentimiento (solo si ya fue analizado)
-            sentiment_config = {
-                'positive': ('😊', '#10B981', '#D1FAE5', 'Sentimiento positivo'),
-                'neutral': ('😐', '#6B7280', '#F3F4F6', 'Sentimiento neutro'),
-                'negative': ('😟', '#EF4444', '#FEE2E2', 'Sentimiento negativo')
-            }
-            emoji, color, bg_color, tooltip = sentiment_config.get(sentiment, sentiment_config['neutral'])
-            sentiment_badge = QLabel(emoji)
-            sentiment_badge.setStyleSheet(f"""
-                background-color: {bg_color};
-                padding: 2px 6px;
-                border-radius: 4px;
-                font-size: 12px;
-            """)
-            sentiment_badge.setFixedHeight(18)
-            sentiment_badge.setToolTip(f"{tooltip} ({sentiment_score:.1%})")
-            badges_layout.addWidget(sentiment_badge)
-        
-        name_row.addLayout(badges_layout)
-        name_row.addStretch()
-        info_layout.addLayout(name_row)
-        
-        # Role badge
-        role_badge = QLabel(role.capitalize())
-        role_badge.setStyleSheet(f"""
-            background-color: {role_colors[1]};
-            color: {role_colors[0]};
-            padding: 3px 10px;
-            border-radius: 5px;
-            font-size: 11px;
-            font-weight: 600;
-        """)
-        role_badge.setFixedWidth(role_badge.sizeHint().width() + 6)
-        info_layout.addWidget(role_badge)
-        
-        header.addLayout(info_layout, 1)
-        layout.addLayout(header)
+            badges.append(("✓ IA", COLORS['success_soft'], COLORS['success']))
+            emoji, bg_color = self.SENTIMENT_BADGES.get(person.get('sentiment'), self.SENTIMENT_BADGES['neutral'])
+            badges.append((emoji, bg_color, COLORS['text_primary']))
+        
+        badge_font = self._font(option.font, 9, QFont.Weight.Bold)
+        badge_metrics = QFontMetrics(badge_font)
+        badges_width = sum(badge_metrics.horizontalAdvance(text) + 12 + 4 for text, _, _ in badges)
+        
+        name_font = self._font(option.font, 15, QFont.Weight.DemiBold)
+        name_metrics = QFontMetrics(name_font)
+        name_width = max(0, min(180, text_right - text_left - badges_width - 6))
+        elided_name = name_metrics.elidedText(name, Qt.TextElideMode.ElideRight, name_width)
+        painter.setFont(name_font)
+        painter.setPen(QColor(COLORS['text_primary']))
+        name_rect = QRect(text_left, card.top() + self.PADDING, name_width, name_metrics.height())
+        painter.drawText(name_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, elided_name)
+        
+        badge_x = text_left + name_metrics.horizontalAdvance(elided_name) + 6
+        for text, bg_color, fg_color in badges:
+            badge_rect = QRect(badge_x, name_rect.center().y() - 9,
+                               badge_metrics.horizontalAdvance(text) + 12, 18)
+            self._paint_chip(painter, badge_rect, text, badge_font, bg_color, fg_color, 4)
+            badge_x = badge_rect.right() + 5
+        
+        # Badge de rol
+        role_font = self._font(option.font, 11, QFont.Weight.DemiBold)
+        role_text = role.capitalize()
+        role_rect = QRect(text_left, name_rect.bottom() + 6,
+                          QFontMetrics(role_font).horizontalAdvance(role_text) + 20, 20)
+        self._paint_chip(painter, role_rect, role_text, role_font, role_colors[1], role_colors[0], 5)
+        
+        # Mensajes
+        stats_font = self._font(option.font, 12)
+        painter.setFont(stats_font)
+        painter.setPen(QColor(COLORS['text_secondary']))
+        stats_top = avatar_rect.bottom() + 12
+        painter.drawText(QRect(card.left() + self.PADDING, stats_top, card.width() - 2 * self.PADDING, 18),
+                         Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                         f"💬 {person.get('total_messages', 0)} mensajes")
+        
+        # Skills
+        skill_font = self._font(option.font, 11)
+        skill_metrics = QFontMetrics(skill_font)
+        skill_x = card.left() + self.PADDING
+        for skill in (person.get('skills') or [])[:3]:
+            skill_name = skill.get('name', '') if isinstance(skill, dict) else str(skill)
+            if len(skill_name) > 12:
+                skill_name = skill_name[:10] + "..."
+            skill_rect = QRect(skill_x, stats_top + 26, skill_metrics.horizontalAdvance(skill_name) + 16, 22)
+            if skill_rect.right() > card.right() - self.PADDING:
+                break
+            self._paint_chip(painter, skill_rect, skill_name, skill_font,
+                             COLORS['bg_primary'], COLORS['text_secondary'], 6)
+            skill_x = skill_rect.right() + 7
+        
+        # Botones
+        cursor_pos = option.widget.viewport().mapFromGlobal(QCursor.pos()) if option.widget else QPoint(-1, -1)
+        button_font = self._font(option.font, 11, QFont.Weight.DemiBold)
+        
+        analyze_rect = self.analyze_button_rect(option.rect)
+        if analyze_rect.contains(cursor_pos):
+            btn_bg, btn_fg, btn_border = COLORS['accent'], 'white', COLORS['accent']
+        elif ai_analyzed:
+            btn_bg, btn_fg, btn_border = COLORS['bg_secondary'], COLORS['text_muted'], COLORS['text_muted']
+        else:
+            btn_bg, btn_fg, btn_border = COLORS['accent_soft'], COLORS['accent'], COLORS['accent']
+        btn_text = "🔄 Re-analizar" if ai_analyzed else "🤖 Analizar con IA"
+        self._paint_chip(painter, analyze_rect, btn_text, button_font, btn_bg, btn_fg, 6, btn_border)
         
-        # Stats
-        stats_label = QLabel(f"💬 {message_count} mensajes")
-        stats_label.setStyleSheet(f"""
-            color: {COLORS['text_secondary']};
-            font-size: 12px;
-        """)
-        layout.addWidget(stats_label)
-        
-        # Skills (con flow layout simulado - wrapping)
-        if skills:
-            skills_container = QWidget()
-            skills_layout = QHBoxLayout(skills_container)
-            skills_layout.setContentsMargins(0, 0, 0, 0)
-            skills_layout.setSpacing(6)
-            
-            for skill in skills[:3]:
-                skill_name = skill.get('name', skill) if isinstance(skill, dict) else skill
-                # Truncar skill si es muy largo
-                if len(skill_name) > 12:
-                    skill_name = skill_name[:10] + "..."
-                skill_badge = QLabel(skill_name)
-                skill_badge.setStyleSheet(f"""
-                    background-color: {COLORS['bg_primary']};
-                    color: {COLORS['text_secondary']};
-                    padding: 4px 8px;
-                    border-radius: 6px;
-                    font-size: 11px;
-                """)
-                skill_badge.setToolTip(skill.get('name', skill) if isinstance(skill, dict) else skill)
-                skills_layout.addWidget(skill_badge)
-            skills_layout.addStretch()
-            layout.addWidget(skills_container)
+        delete_rect = self.delete_button_rect(option.rect)
+        if delete_rect.contains(cursor_pos):
+            self._paint_chip(painter, delete_rect, "🗑️", self._font(option.font, 14),
+                             '#DC2626', 'white', 6, '#DC2626')
+        else:
+            self._paint_chip(painter, delete_rect, "🗑️", self._font(option.font, 14),
+                             '#FEE2E2', '#DC2626', 6, '#FECACA')
         
-        # Fila de botones: Analizar + Eliminar
-        buttons_row = QHBoxLayout()
-        buttons_row.setSpacing(8)
+        painter.restore()
+    
+    def _paint_avatar(self, painter, rect: QRect, name: str, avatar_path: str, role_colors: tuple):
+        pixmap = self._avatar_pixmap(avatar_path)
+        if pixmap is not None:
+            painter.save()
+            clip = QPainterPath()
+            clip.addEllipse(QRectF(rect))
+            painter.setClipPath(clip)
+            painter.drawPixmap(rect, pixmap)
+            painter.restore()
+            return
         
-        # Botón de analizar
-        btn_text = "🔄 Re-analizar" if ai_analyzed else "🤖 Analizar con IA"
-        btn_color = COLORS['text_muted'] if ai_analyzed else COLORS['accent']
-        btn_bg = COLORS['bg_secondary'] if ai_analyzed else COLORS['accent_soft']
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(role_colors[1]))
+        painter.drawEllipse(rect)
+        painter.setPen(QColor(role_colors[0]))
+        painter.setFont(self._font(painter.font(), 20, QFont.Weight.Bold))
+        painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, name[0].upper() if name else "?")
+    
+    def _avatar_pixmap(self, avatar_path: str) -> Optional[QPixmap]:
+        """Avatar escalado, cacheado por ruta y fecha de modificación (LRU acotada)"""
+        if not avatar_path or not os.path.exists(avatar_path):
+            return None
+        key = (avatar_path, os.path.getmtime(avatar_path))
+        pixmap = self._avatar_cache.get(key)
+        if pixmap is None:
+            pixmap = QPixmap(avatar_path).scaled(
+                self.AVATAR_SIZE, self.AVATAR_SIZE,
+                Qt.AspectRatioMode.KeepAspectRatioByExpanding, Qt.TransformationMode.SmoothTransformation
+            )
+            self._avatar_cache[key] = pixmap
+            if len(self._avatar_cache) > self._avatar_cache_size:
+                self._avatar_cache.popitem(last=False)
+        else:
+            self._avatar_cache.move_to_end(key)
+        return pixmap
+    
+    def _paint_chip(self, painter, rect: QRect, text: str, font: QFont, bg_color: str, fg_color: str,
+                    radius: int, border_color: str = None):
+        painter.setPen(QPen(QColor(border_color), 1) if border_color else Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(bg_color))
+        painter.drawRoundedRect(QRectF(rect).adjusted(0.5, 0.5, -0.5, -0.5), radius, radius)
+        painter.setFont(font)
+        painter.setPen(QColor(fg_color))
+        painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, text)
+    
+    @staticmethod
+    def _font(base: QFont, pixel_size: int, weight: QFont.Weight = QFont.Weight.Normal) -> QFont:
+        font = QFont(base)
+        font.setPixelSize(pixel_size)
+        font.setWeight(weight)
+        return font
+
+
+class PersonGridView(QListView):
+    """Rejilla virtualizada de personas (modelo + delegate en lugar de un QFrame por persona)"""
+    person_clicked = pyqtSignal(dict)
+    analyze_clicked = pyqtSignal(int)  # Señal para solicitar análisis de persona
+    edit_clicked = pyqtSignal(int, str)  # person_id, nombre actual
+    delete_clicked = pyqtSignal(int, str)  # person_id, nombre
+    avatar_clicked = pyqtSignal(int)  # person_id para cambiar avatar
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.person_model = PersonListModel(self)
+        self.card_delegate = PersonCardDelegate(self)
+        self.setModel(self.person_model)
+        self.setItemDelegate(self.card_delegate)
+        
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setFlow(QListView.Flow.LeftToRight)
+        self.setWrapping(True)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setMovement(QListView.Movement.Static)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self.setVerticalScrollMode(QListView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setMouseTracking(True)
+        self.viewport().setAttribute(Qt.WidgetAttribute.WA_Hover)
+        self.setStyleSheet("QListView { border: none; background: transparent; }")
+        self._update_grid_size()
+    
+    def set_persons(self, persons: List[Dict]):
+        self.person_model.set_persons(persons)
+    
+    def _update_grid_size(self):
+        # Reparte el ancho disponible entre columnas de tarjetas (máximo 4)
+        # Se reserva el ancho de la barra vertical para que la última columna no salte de fila
+        scroll_bar = self.verticalScrollBar()
+        width = self.viewport().width() - scroll_bar.style().pixelMetric(
+            QStyle.PixelMetric.PM_ScrollBarExtent, None, scroll_bar)
+        columns = max(1, min(4, width // PersonCardDelegate.MIN_CARD_WIDTH))
+        card_width = max(PersonCardDelegate.MIN_CARD_WIDTH, width // columns)
+        if card_width != self.card_delegate.card_width:
+            self.card_delegate.card_width = card_width
+            self.setGridSize(QSize(card_width, PersonCardDelegate.CARD_HEIGHT))
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._update_grid_size()
+    
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        self.viewport().update()  # Repinta el hover de los botones
+    
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        if event.button() != Qt.MouseButton.LeftButton:
+            return
+        pos = event.position().toPoint()
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return
+        person = index.data(PersonListModel.PersonRole)
+        target = self.card_delegate.hit_test(self.visualRect(index), pos)
+        if target == 'analyze':
+            self.analyze_clicked.emit(person['id'])
+        elif target == 'delete':
+            self.delete_clicked.emit(person['id'], person['name'])
+        elif target == 'card':
+            self.person_clicked.emit(person)
+    
+    def contextMenuEvent(self, event):
+        """Muestra menú contextual con opciones de edición"""
+        index = self.indexAt(event.pos())
+        if not index.isValid():
+            return
+        person = index.data(PersonListModel.PersonRole)
         
-        analyze_btn = QPushButton(btn_text)
-        analyze_btn.setStyleSheet(f"""
-            QPushButton {{
-                background-color: {btn_bg};
-                color: {btn_color};
-                border: 1px solid {btn_color};
-                border-radius: 6px;
-                padding: 6px 12px;
-                font-size: 11px;
-                font-weight: 600;
-            }}
-            QPushButton:hover {{
-                background-color: {COLORS['accent']};
-                color: white;
-                border-color: {COLORS['accent']};
-            }}
-        """)
-        analyze_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        analyze_btn.clicked.connect(self._on_analyze_clicked)
-        buttons_row.addWidget(analyze_btn, 1)
-        
-        # Botón de eliminar (papelera)
-        delete_btn = QPushButton("🗑️")
-        delete_btn.setFixedSize(32, 32)
-        delete_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #FEE2E2;
-                color: #DC2626;
-                border: 1px solid #FECACA;
-                border-radius: 6px;
-                font-size: 14px;
+        menu = QMenu(self)
+        menu.setStyleSheet("""
+            QMenu {
+                background-color: white;
+                border: 1px solid #E2E8F0;
+                border-radius: 8px;
+                padding: 4px;
             }
-            QPushButton:hover {
-                background-color: #DC2626;
-                color: white;
-                border-color: #DC2626;
+            QMenu::item {
+                padding: 8px 16px;
+                border-radius: 4px;
+            }
+            QMenu::item:selected {
+                background-color: #F1F5F9;
             }
         """)
-        delete_btn.setCursor(Qt.CursorShape.PointingHandCursor)
-        delete_btn.setToolTip("Eliminar persona")
-        delete_btn.clicked.connect(self._on_delete_clicked)
-        buttons_row.addWidget(delete_btn)
         
-        layout.addLayout(buttons_row)
+        edit_action = menu.addAction("✏️ Editar nombre")
+        avatar_action = menu.addAction("🖼️ Cambiar foto")
+        menu.addSeparator()
+        delete_action = menu.addAction("🗑️ Eliminar persona")
         
-        # Espaciador para empujar contenido arriba
-        layout.addStretch()
+        action = menu.exec(event.globalPos())
         
-        # Tamaño mínimo más flexible
-        self.setMinimumWidth(280)
-        self.setMinimumHeight(180)  # Siempre hay botón de analizar
-        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
-        self.setCursor(Qt.CursorShape.PointingHandCursor)
-    
-    def _on_analyze_clicked(self):
-        self.analyze_clicked.emit(self.person_id)
-    
-    def _on_delete_clicked(self):
-        self.delete_clicked.emit(self.person_id, self.name)
+        if action == edit_action:
+            self.edit_clicked.emit(person['id'], person['name'])
+        elif action == avatar_action:
+            self.avatar_clicked.emit(person['id'])
+        elif action == delete_action:
+            self.delete_clicked.emit(person['id'], person['name'])
 
 
+# Tareas que se cargan por página en la vista de Tareas
+TASKS_PAGE_SIZE = 50
+
 # Colores para categorías de tareas
 CATEGORY_COLORS = {
     'mentoría': ('#8B5CF6', '#EDE9FE'),      # Violeta
@@ -2489,43 +5390,57 @@ class AnalysisWorker(QThread):
     error = pyqtSignal(str)
     
     def __init__(self, messages: List[Dict], participants: Dict, 
-                 api_key: str = None, me_name: str = None):
+                 api_key: str = None, me_name: str = None, db_path: str = 'telegram_analyzer.db'):
         super().__init__()
-        self.messages = messages
+        self.messages = messages  # Lista de dicts o MessageStore
         self.participants = participants
         self.api_key = api_key
         self.me_name = me_name
+        self.db_path = db_path  # Para la caché de respuestas de la IA
         
     def run(self):
         try:
-            analyzer = AIAnalyzer(api_key=self.api_key)
+            analyzer = AIAnalyzer(api_key=self.api_key, db_path=self.db_path)
             results = {'tasks': [], 'person_profiles': {}, 'patterns': []}
             
-            total_steps = len(self.participants) + 2
-            current_step = 0
-            
-            # Extract tasks
-            self.progress.emit(current_step, total_steps, "Extrayendo tareas...")
-            results['tasks'] = analyzer.extract_tasks(self.messages[:150])
-            current_step += 1
-            
-            # Analyze persons
+            # Preparar todas las peticiones: tareas, una por persona y patrones.
+            # El índice por remitente evita recorrer todos los mensajes por cada participante
+            sender_index = index_messages_by_sender(self.messages)
+            persons = []
             for name in self.participants.keys():
-                self.progress.emit(current_step, total_steps, f"Analizando a {name}...")
-                person_messages = [m for m in self.messages if m.get('sender') == name]
-                if person_messages:
+                positions = sender_index.get(name)
+                if positions:
+                    person_messages = [self.messages[i] for i in positions]
                     is_me = (name == self.me_name) if self.me_name else False
-                    profile = analyzer.analyze_person(name, person_messages[:80], is_me=is_me)
-                    results['person_profiles'][name] = profile
-                current_step += 1
-                
-            # Detect patterns
-            self.progress.emit(current_step, total_steps, "Detectando patrones...")
-            results['patterns'] = analyzer.detect_patterns(self.messages, self.participants)
+                    persons.append((name, person_messages, is_me))
+            
+            requests = [analyzer._tasks_request(self.messages)]
+            requests += [analyzer._person_request(name, messages, is_me) for name, messages, is_me in persons]
+            requests.append(analyzer._patterns_request(self.messages, self.participants))
+            
+            # Lanzarlas todas a la vez (limitadas por max_concurrency y los límites de la API)
+            total_steps = len(requests)
+            completed = 0
+            analyzer.on_throttle = lambda message: self.progress.emit(completed, total_steps, message)
+            self.progress.emit(completed, total_steps, f"Analizando tareas, {len(persons)} personas y patrones...")
+            
+            def on_done(index: int, response: str):
+                nonlocal completed
+                completed += 1
+                self.progress.emit(completed, total_steps, f"Análisis completados: {completed}/{total_steps}")
+            
+            responses = analyzer.call_many(requests, on_done)
+            
+            results['tasks'] = analyzer._parse_tasks(responses[0])
+            for (name, _, _), response in zip(persons, responses[1:-1]):
+                results['person_profiles'][name] = analyzer._parse_person_profile(name, response)
+            results['patterns'] = analyzer._parse_patterns(responses[-1])
             
             self.finished.emit(results)
         except Exception as e:
             self.error.emit(str(e))
+        finally:
+            get_connection_manager(self.db_path).release()
 
 
 class BehaviorAnalysisWorker(QThread):
@@ -2543,25 +5458,37 @@ class BehaviorAnalysisWorker(QThread):
         
     def run(self):
         try:
-            # Crear conexión a BD en este thread
-            db = Database(self.db_path)
-            db.connect()
-            analyzer = AIAnalyzer(api_key=self.api_key)
+            # Conexión propia de este thread
+            db = get_connection_manager(self.db_path).connection()
+            analyzer = AIAnalyzer(api_key=self.api_key, db_path=self.db_path)
             
             total_alerts = 0
-            total_persons = len(self.persons)
             
-            for i, person in enumerate(self.persons):
-                self.progress.emit(f"Analizando {person['name']} ({i+1}/{total_persons})...")
-                
+            # Cargar los mensajes de cada persona antes de lanzar las peticiones
+            candidates = []
+            for person in self.persons:
                 messages = db.get_messages_for_person(person['id'])
-                if len(messages) < 5:
-                    continue
-                
-                alerts = analyzer.detect_behavior_alerts(messages, person['name'], self.me_name)
-                
+                if len(messages) >= 5:
+                    candidates.append((person, messages))
+            
+            total_persons = len(candidates)
+            completed = 0
+            self.progress.emit(f"Analizando {total_persons} personas...")
+            analyzer.on_throttle = self.progress.emit
+            
+            def on_done(index: int, response: str):
+                nonlocal completed
+                completed += 1
+                self.progress.emit(f"Analizadas {completed}/{total_persons} personas...")
+            
+            # Todas las personas en paralelo
+            alerts_by_person = analyzer.detect_behavior_alerts_many(
+                [(messages, person['name']) for person, messages in candidates], self.me_name, on_done
+            )
+            
+            for (person, _), alerts in zip(candidates, alerts_by_person):
                 for alert in alerts:
-                    db.add_behavior_alert(
+                    db.upsert_behavior_alert(
                         person_id=person['id'],
                         alert_type=alert.get('alert_type', 'red_flags'),
                         title=alert.get('title', 'Alerta detectada'),
@@ -2573,31 +5500,105 @@ class BehaviorAnalysisWorker(QThread):
                     )
                     total_alerts += 1
             
-            db.close()
             self.finished.emit(total_alerts)
         except Exception as e:
             self.error.emit(str(e))
+        finally:
+            get_connection_manager(self.db_path).release()
+
+
+class BatchAnalysisWorker(QThread):
+    """Worker para enviar el análisis nocturno por lotes ('submit') o ingerir sus resultados ('ingest')"""
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(dict)
+    error = pyqtSignal(str)
+    
+    def __init__(self, api_key: str, db_path: str, mode: str = 'submit'):
+        super().__init__()
+        self.api_key = api_key
+        self.db_path = db_path
+        self.mode = mode
+        
+    def run(self):
+        try:
+            db = get_connection_manager(self.db_path).connection()
+            analyzer = AIAnalyzer(api_key=self.api_key, db_path=self.db_path)
+            
+            if self.mode == 'submit':
+                self.progress.emit("Preparando y enviando el lote de análisis...")
+                job_ids = submit_batch_analysis(db, analyzer)
+                requests = sum(job['request_count'] for job in db.get_ai_batch_jobs(len(job_ids)))
+                self.finished.emit({'mode': 'submit', 'jobs': len(job_ids), 'requests': requests})
+            else:
+                self.progress.emit("Consultando los trabajos por lotes pendientes...")
+                self.finished.emit(dict(analyzer.ingest_batches(db), mode='ingest'))
+        except Exception as e:
+            self.error.emit(str(e))
+        finally:
+            get_connection_manager(self.db_path).release()
 
 
 class PersonAnalysisThread(QThread):
-    """Worker para analizar una persona individual en segundo plano"""
+    """Worker para analizar una persona individual en segundo plano.
+    
+    El historial se divide en bloques que caben en el contexto del modelo (map),
+    se analizan en paralelo y los resultados parciales se combinan (reduce).
+    """
     finished = pyqtSignal(int, dict)  # person_id, result
+    section_ready = pyqtSignal(int, str, object)  # person_id, sección, valor (ver PERSON_ANALYSIS_SECTIONS)
+    progress = pyqtSignal(str)  # Mensaje de progreso
     error = pyqtSignal(str)
     
-    def __init__(self, api_key: str, person_id: int, person_name: str, messages_text: str, db: 'Database'):
+    def __init__(self, api_key: str, person_id: int, person_name: str, messages_text: str,
+                 db_path: str = 'telegram_analyzer.db', previous_profile: str = None, watermark: int = None):
         super().__init__()
         self.api_key = api_key
         self.person_id = person_id
         self.person_name = person_name
         self.messages_text = messages_text
-        self.db_path = db.db_path if hasattr(db, 'db_path') else 'telegram_analyzer.db'
+        self.db_path = db_path
+        self.previous_profile = previous_profile  # Análisis incremental: perfil previo + solo mensajes nuevos
+        self.watermark = watermark  # Id del último mensaje incluido en este análisis
+        self.failed_parts = 0  # Bloques sin respuesta válida: entonces no se avanza la marca de agua
+        self._emitted_sections = set()
+    
+    def _emit_completed_sections(self, partial: Dict, final: bool = False):
+        """Emite las secciones ya completas de una respuesta parcial.
         
-    def run(self):
-        try:
-            analyzer = AIAnalyzer(api_key=self.api_key)
-            
-            # Analizar rol, skills, sentimiento, compromisos, TAREAS, proyectos y alertas
-            prompt = f"""Analiza TODOS los siguientes mensajes de {self.person_name} y extrae:
+        Una clave está completa cuando ya ha empezado la siguiente (el JSON llega en orden)
+        o cuando ha terminado la respuesta.
+        """
+        keys = list(partial)
+        complete = set(keys if final else keys[:-1])
+        for section, section_keys in PERSON_ANALYSIS_SECTIONS.items():
+            if section in self._emitted_sections:
+                continue
+            present = [key for key in section_keys if key in partial]
+            if not present or not all(key in complete for key in present):
+                continue
+            if not final and len(present) < len(section_keys):
+                continue  # Puede faltar aún un campo de la sección (p. ej. role_confidence)
+            self._emitted_sections.add(section)
+            self.section_ready.emit(self.person_id, section, person_analysis_section(partial, section))
+    
+    def _build_prompt(self, messages_text: str, part: int, total_parts: int) -> str:
+        """Prompt de análisis para un bloque del historial"""
+        part_note = f" (bloque {part} de {total_parts} de su historial, en orden cronológico)" if total_parts > 1 else ""
+        
+        previous_note = ""
+        if self.previous_profile:
+            previous_note = f"""PERFIL PREVIO (de un análisis anterior):
+{self.previous_profile}
+
+Los mensajes de abajo son solo los NUEVOS desde ese análisis. Devuelve el rol, skills, sentimiento y
+resumen ACTUALIZADOS teniendo en cuenta el perfil previo. En tareas, compromisos, proyectos y alertas
+incluye solo los nuevos o los que cambian (por ejemplo una tarea que pasa a completada), usando
+exactamente el mismo título si ya existían.
+
+"""
+        
+        # Analizar rol, skills, sentimiento, compromisos, TAREAS, proyectos y alertas
+        return f"""{previous_note}Analiza TODOS los siguientes mensajes de {self.person_name}{part_note} y extrae:
 
 1. ROL: ¿Qué rol tiene esta persona? (profesor, alumno, colaborador, cliente, manager, desconocido)
 2. SKILLS: Lista de habilidades detectadas con nivel estimado (1-100)
@@ -2609,7 +5610,7 @@ class PersonAnalysisThread(QThread):
 8. ALERTAS: Comportamientos problemáticos (inconsistencias, manipulación, abuso de confianza, etc.)
 
 Mensajes:
-{self.messages_text[:50000]}
+{messages_text}
 
 Responde SOLO con JSON válido en este formato:
 {{
@@ -2644,28 +5645,87 @@ IMPORTANTE:
 - Los tipos de alerta son: inconsistency, knowledge_abuse, emotional_manipulation, possible_lies, red_flags
 - Las severidades son: high, medium, low
 - Si no encuentras algo, devuelve array vacío []"""
+    
+    @staticmethod
+    def _parse_result(result) -> Optional[Dict]:
+        """Extrae el JSON de la respuesta de la IA (recupera lo que haya si viene incompleto).
+        
+        Devuelve None si la llamada falló o la respuesta no contiene JSON recuperable.
+        """
+        if isinstance(result, Exception):
+            return None
+        parsed = parse_json_response(result)
+        if not parsed:
+            print("Error parseando JSON: respuesta sin JSON recuperable")
+            return None
+        return parsed
+        
+    def run(self):
+        try:
+            analyzer = AIAnalyzer(api_key=self.api_key, db_path=self.db_path)
+            analyzer.on_throttle = self.progress.emit
+            
+            chunks = split_text_into_chunks(self.messages_text, PERSON_ANALYSIS_CHUNK_TOKENS)
+            total_parts = len(chunks)
+            if total_parts > 1:
+                self.progress.emit(f"Analizando {self.person_name} en {total_parts} bloques...")
+            
+            if total_parts <= 1:
+                # Un solo bloque: streaming, guardando cada sección en cuanto llega completa.
+                # stream_ai pasa el texto acumulado (se reinicia en cada reintento)
+                def on_text(text: str):
+                    self._emit_completed_sections(parse_json_response(text))
+                
+                response = analyzer.stream_ai(
+                    self._build_prompt(chunks[0] if chunks else '', 1, 1), None, 'person_analysis', on_text
+                )
+                result_dict = self._parse_result(response)
+                if result_dict is None:
+                    self.error.emit("La IA no devolvió un análisis válido; los mensajes se analizarán de nuevo")
+                    return
+                self._emit_completed_sections(result_dict, final=True)
+                self.finished.emit(self.person_id, result_dict)
+                return
             
-            result = analyzer._call_ai(prompt)
-            
-            # Intentar parsear JSON - proteger contra None
-            try:
-                if not result:
-                    result = '{}'
-                result = str(result)  # Asegurar que es string
-                # Buscar JSON en la respuesta
-                json_match = re.search(r'\{[\s\S]*\}', result)
-                if json_match:
-                    result_dict = json.loads(json_match.group())
+            done = 0
+            
+            def on_done(index: int, response: str):
+                nonlocal done
+                done += 1
+                self.progress.emit(f"Analizando {self.person_name}: bloque {done}/{total_parts} completado")
+                # Avance: las listas de cada bloque se guardan ya (upsert); el rol, sentimiento
+                # y resumen esperan al reduce
+                partial = parse_json_response(response)
+                for section in PERSON_ANALYSIS_LIST_SECTIONS:
+                    if partial.get(section):
+                        self.section_ready.emit(self.person_id, section, partial[section])
+            
+            # Map: un análisis por bloque, en paralelo; un bloque fallido no descarta los demás
+            responses = analyzer.call_many(
+                [(self._build_prompt(chunk, part, total_parts), None, 'person_analysis')
+                 for part, chunk in enumerate(chunks, 1)], on_done, return_exceptions=True
+            )
+            partials, weights = [], []
+            for chunk, response in zip(chunks, responses):
+                parsed = self._parse_result(response)
+                if parsed is None:
+                    self.failed_parts += 1
                 else:
-                    result_dict = {'role': 'desconocido', 'skills': [], 'patterns': []}
-            except (json.JSONDecodeError, TypeError) as e:
-                print(f"Error parseando JSON: {e}")
-                result_dict = {'role': 'desconocido', 'skills': [], 'patterns': []}
+                    partials.append(parsed)
+                    weights.append(len(chunk))
+            if not partials:
+                self.error.emit("La IA no devolvió ningún análisis válido; los mensajes se analizarán de nuevo")
+                return
+            
+            # Reduce: combinar los resultados parciales
+            result_dict = merge_person_analyses(partials, weights)
             
             self.finished.emit(self.person_id, result_dict)
             
         except Exception as e:
             self.error.emit(str(e))
+        finally:
+            get_connection_manager(self.db_path).release()
 
 
 class ImportWorker(QThread):
@@ -2674,82 +5734,183 @@ class ImportWorker(QThread):
     finished = pyqtSignal(dict)  # Resultado con estadísticas
     error = pyqtSignal(str)
     
-    def __init__(self, paths: list, db_path: str = 'telegram_analyzer.db'):
+    def __init__(self, paths: list, db_path: str = 'telegram_analyzer.db', batch_size: int = 5000):
         super().__init__()
-        self.paths = sorted(paths)  # Ordenar por nombre
+        self.paths = sorted(paths, key=self._file_order_key)  # messages.html, messages2.html ... messages80.html
         self.db_path = db_path
+        self.batch_size = batch_size  # Mensajes por executemany al guardar
+        
+    @staticmethod
+    def _file_order_key(path: str):
+        name = os.path.basename(path)
+        match = re.search(r'(\d+)\.html?$', name, re.IGNORECASE)
+        return (os.path.dirname(path), int(match.group(1)) if match else 1, name)
+    
+    def _parse_files(self, paths: List[str]):
+        """Parsea los archivos en un pool de procesos y los devuelve en orden de archivo"""
+        if len(paths) <= 1:
+            for path in paths:
+                yield parse_export_file(path)
+            return
+        
+        max_workers = min(len(paths), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            yield from executor.map(parse_export_file, paths)
+    
+    @staticmethod
+    def _merge_parsed_data(combined_data: Dict, data: Dict):
+        """Combina el resultado de un archivo posterior en los datos acumulados"""
+        # Combinar mensajes
+        combined_data['messages'].extend(data['messages'])
+        combined_data['total_messages'] += data['total_messages']
+        
+        # Combinar participantes
+        for name, info in data['participants'].items():
+            existing = combined_data['participants'].get(name)
+            if existing:
+                existing['message_count'] += info['message_count']
+                if info.get('first_message') and (
+                    not existing.get('first_message') or info['first_message'] < existing['first_message']
+                ):
+                    existing['first_message'] = info['first_message']
+                if info.get('last_message') and (
+                    not existing.get('last_message') or info['last_message'] > existing['last_message']
+                ):
+                    existing['last_message'] = info['last_message']
+            else:
+                combined_data['participants'][name] = info
+        
+        # Combinar rango de fechas
+        dates = [d for d in (*combined_data.get('date_range', (None, None)),
+                             *data.get('date_range', (None, None))) if d]
+        if dates:
+            combined_data['date_range'] = (min(dates), max(dates))
+        
+        # Combinar enlaces
+        links_by_url = {link['url']: link for link in combined_data.setdefault('links', [])}
+        for link in data.get('links', []):
+            existing_link = links_by_url.get(link['url'])
+            if existing_link is None:
+                combined_data['links'].append(link)
+                links_by_url[link['url']] = link
+                continue
+            existing_link['count'] += link['count']
+            existing_link['last_shared'] = link['last_shared']
+            for sender in link['shared_by']:
+                if sender not in existing_link['shared_by']:
+                    existing_link['shared_by'].append(sender)
+            free_slots = 3 - len(existing_link['contexts'])  # Max 3 contextos
+            if free_slots > 0:
+                existing_link['contexts'].extend(link['contexts'][:free_slots])
         
     def run(self):
         try:
-            # Crear conexión a BD en este thread (SQLite requiere conexión por thread)
-            db = Database(self.db_path)
-            db.connect()  # Abrir conexión
+            # Conexión propia de este thread (SQLite requiere conexión por thread)
+            db = get_connection_manager(self.db_path).connection()
             
-            parser = TelegramHTMLParser()
             combined_data = None
             total_files = len(self.paths)
             
-            # Fase 1: Parsear todos los archivos
-            for idx, path in enumerate(self.paths):
-                self.progress.emit(f"Leyendo archivo {idx + 1} de {total_files}...")
-                
-                data = parser.parse_file(path)
+            # Fase 0: Descartar archivos ya importados (mismo hash de contenido)
+            self.progress.emit("Comprobando archivos ya importados...")
+            file_hashes = {path: file_content_hash(path) for path in self.paths}
+            new_paths = [path for path in self.paths if not db.is_file_imported(file_hashes[path])]
+            skipped_files = total_files - len(new_paths)
+            
+            if not new_paths:
+                self.finished.emit({
+                    'total_files': total_files,
+                    'skipped_files': skipped_files,
+                    'total_messages': 0,
+                    'duplicate_messages': 0,
+                    'total_participants': 0,
+                    'total_links': 0,
+                    'total_attachments': 0,
+                    'chat_name': ''
+                })
+                return
+            
+            # Fase 1: Parsear todos los archivos (en paralelo, un archivo por proceso)
+            file_message_counts = []
+            for idx, data in enumerate(self._parse_files(new_paths)):
+                self.progress.emit(f"Leyendo archivo {idx + 1} de {len(new_paths)}...")
+                file_message_counts.append(data['total_messages'])
                 
                 if combined_data is None:
                     combined_data = data
                 else:
-                    # Combinar mensajes
-                    combined_data['messages'].extend(data['messages'])
-                    combined_data['total_messages'] += data['total_messages']
-                    
-                    # Combinar participantes
-                    for name, info in data['participants'].items():
-                        if name in combined_data['participants']:
-                            combined_data['participants'][name]['message_count'] += info['message_count']
-                        else:
-                            combined_data['participants'][name] = info
-                    
-                    # Combinar enlaces
-                    existing_urls = {link['url'] for link in combined_data.get('links', [])}
-                    for link in data.get('links', []):
-                        if link['url'] not in existing_urls:
-                            combined_data.setdefault('links', []).append(link)
-                            existing_urls.add(link['url'])
-                        else:
-                            for existing_link in combined_data['links']:
-                                if existing_link['url'] == link['url']:
-                                    existing_link['count'] += link['count']
-                                    break
-            
-            # Fase 2: Guardar en base de datos
+                    self._merge_parsed_data(combined_data, data)
+            
+            # Fase 2: Guardar en base de datos (reutilizando el chat si ya existe)
             self.progress.emit("Guardando chat en base de datos...")
-            chat_id = db.add_chat(combined_data['chat_name'], 'group', self.paths[0])
+            chat = db.get_chat_by_name(combined_data['chat_name'])
+            chat_id = chat['id'] if chat else db.add_chat(combined_data['chat_name'], 'group', new_paths[0])
+            
+            # Quedarse solo con los mensajes que aún no están en el chat (por posición en el almacén)
+            messages = combined_data['messages']
+            known_keys = db.get_message_keys(chat_id)
+            has_legacy_keys = any(key.startswith('legacy:') for key in known_keys)
+            new_messages = []
+            media_keys = []  # (posición, clave guardada) de todos los mensajes con adjunto
+            for position, msg in enumerate(messages):
+                key = message_dedup_key(msg)
+                if key not in known_keys and has_legacy_keys:
+                    legacy_key = legacy_message_key(msg.get('sender'), msg.get('timestamp'), msg.get('content'))
+                    if legacy_key in known_keys:
+                        key = legacy_key  # Ya importado por una versión anterior
+                if msg['type'] in TELEGRAM_MEDIA_TYPES:
+                    media_keys.append((position, key))
+                if key in known_keys:
+                    continue
+                known_keys.add(key)
+                new_messages.append((position, key))
+            duplicate_messages = len(messages) - len(new_messages)
             
             # Guardar participantes
             self.progress.emit("Guardando participantes...")
             person_ids = {}  # Cache de IDs para evitar búsquedas repetidas
-            for name, info in combined_data['participants'].items():
-                person_id = db.add_person(name)
-                db.update_person(person_id, total_messages=info['message_count'])
-                person_ids[name] = person_id
-            
-            # Guardar mensajes en lotes
-            total_msgs = len(combined_data['messages'])
+            for name in combined_data['participants']:
+                person_ids[name] = db.add_person(name)
+            
+            # Guardar mensajes en lotes (una transacción, executemany por lote).
+            # Los mensajes de servicio no tienen remitente: se guardan con person_id NULL
+            stored_positions = [
+                (position, key) for position, key in new_messages
+                if messages.sender(position) is None or messages.sender(position) in person_ids
+            ]
+            total_msgs = len(stored_positions)
             self.progress.emit(f"Guardando 0/{total_msgs} mensajes...")
             
-            for idx, msg in enumerate(combined_data['messages']):
-                sender = msg.get('sender')
-                if sender and sender in person_ids:
-                    db.add_message(chat_id, person_ids[sender], msg.get('content', ''), msg.get('timestamp'))
-                
-                # Actualizar progreso cada 200 mensajes
-                if (idx + 1) % 200 == 0:
-                    self.progress.emit(f"Guardando {idx + 1}/{total_msgs} mensajes...")
+            rows = (
+                (person_ids.get(messages.sender(position)), messages.content(position), messages.timestamp(position), key)
+                for position, key in stored_positions
+            )
+            inserted = db.add_messages_bulk(
+                chat_id, rows, batch_size=self.batch_size,
+                on_batch=lambda processed: self.progress.emit(f"Guardando {processed}/{total_msgs} mensajes...")
+            )
+            db.refresh_message_counts(chat_id, list(person_ids.values()))
+            
+            # Guardar metadatos de los adjuntos (los archivos no se copian). Se recorren todos los
+            # mensajes con adjunto, no solo los nuevos: los ya guardados por versiones anteriores
+            # no tenían fila en attachments y el INSERT OR IGNORE no duplica los existentes
+            self.progress.emit("Guardando adjuntos...")
+            attachment_rows = (
+                (key, messages.message_type(position), messages.media_path(position),
+                 messages.media_size(position), messages.media_duration(position))
+                for position, key in media_keys
+                if messages.sender(position) is None or messages.sender(position) in person_ids
+            )
+            attachments_count = db.add_attachments_bulk(chat_id, attachment_rows)
             
-            # Guardar enlaces
+            # Guardar enlaces (solo los de mensajes nuevos)
             self.progress.emit("Guardando enlaces...")
+            if duplicate_messages:
+                links = TelegramHTMLParser.collect_links(messages.select(position for position, _ in new_messages))
+            else:
+                links = combined_data.get('links', [])
             links_count = 0
-            for link_data in combined_data.get('links', []):
+            for link_data in links:
                 shared_by_id = None
                 if link_data['shared_by']:
                     shared_by_id = person_ids.get(link_data['shared_by'][0])
@@ -2763,14 +5924,19 @@ class ImportWorker(QThread):
                 )
                 links_count += 1
             
-            db.close()
+            # Registrar archivos importados para saltarlos en la próxima importación
+            for path, message_count in zip(new_paths, file_message_counts):
+                db.add_imported_file(chat_id, file_hashes[path], path, message_count)
             
             # Emitir resultado con estadísticas
             result = {
                 'total_files': total_files,
-                'total_messages': combined_data['total_messages'],
+                'skipped_files': skipped_files,
+                'total_messages': inserted,
+                'duplicate_messages': duplicate_messages,
                 'total_participants': len(combined_data['participants']),
                 'total_links': links_count,
+                'total_attachments': attachments_count,
                 'chat_name': combined_data['chat_name']
             }
             
@@ -2778,6 +5944,8 @@ class ImportWorker(QThread):
             
         except Exception as e:
             self.error.emit(str(e))
+        finally:
+            get_connection_manager(self.db_path).release()
 
 
 # ============================================================
@@ -4481,20 +7649,14 @@ class MainWindow(QMainWindow):
         """)
         layout.addWidget(header)
         
-        # Scroll area
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        scroll.setStyleSheet("QScrollArea { border: none; background: transparent; }")
-        
-        scroll_content = QWidget()
-        scroll_content.setStyleSheet("background: transparent;")
-        self.persons_grid = QGridLayout(scroll_content)
-        self.persons_grid.setSpacing(20)
-        self.persons_grid.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
-        
-        scroll.setWidget(scroll_content)
-        layout.addWidget(scroll)
+        # Rejilla virtualizada: solo se pintan las tarjetas visibles
+        self.persons_view = PersonGridView()
+        self.persons_view.person_clicked.connect(self._show_person_detail)
+        self.persons_view.analyze_clicked.connect(self._analyze_person_from_card)
+        self.persons_view.edit_clicked.connect(self._edit_person_name)
+        self.persons_view.delete_clicked.connect(self._delete_person)
+        self.persons_view.avatar_clicked.connect(self._change_person_avatar)
+        layout.addWidget(self.persons_view)
         
         self.persons_empty = EmptyState(
             "👥",
@@ -4580,6 +7742,11 @@ class MainWindow(QMainWindow):
         scroll.setWidget(scroll_content)
         layout.addWidget(scroll)
         
+        # Carga perezosa: se pide otra página al acercarse al final del scroll
+        self.tasks_scroll = scroll
+        scroll.verticalScrollBar().valueChanged.connect(self._on_tasks_scrolled)
+        scroll.verticalScrollBar().rangeChanged.connect(lambda _min, _max: self._on_tasks_scrolled())
+        
         self.tasks_empty = EmptyState(
             "✅",
             "No hay tareas",
@@ -4920,6 +8087,20 @@ class MainWindow(QMainWindow):
         key_layout.addStretch()
         api_layout.addLayout(key_layout)
         
+        # Límite de peticiones por minuto del plan de la API
+        rpm_layout = QHBoxLayout()
+        rpm_label = QLabel("Pet./minuto:")
+        rpm_label.setStyleSheet(f"color: {COLORS['text_primary']}; font-weight: 500;")
+        rpm_label.setFixedWidth(100)
+        self.rpm_input = QSpinBox()
+        self.rpm_input.setRange(0, 10000)
+        self.rpm_input.setSpecialValueText("Por defecto (plan gratuito)")
+        self.rpm_input.setFixedWidth(250)
+        rpm_layout.addWidget(rpm_label)
+        rpm_layout.addWidget(self.rpm_input)
+        rpm_layout.addStretch()
+        api_layout.addLayout(rpm_layout)
+        
         # Help text
         help_text = QLabel("💡 Obtén tu API key gratis en ai.google.dev (Gemini) o platform.openai.com (OpenAI)")
         help_text.setStyleSheet(f"color: {COLORS['text_muted']}; font-size: 13px;")
@@ -4962,6 +8143,16 @@ class MainWindow(QMainWindow):
         clear_btn.clicked.connect(self._clear_all_data)
         data_layout.addWidget(clear_btn)
         
+        # Caché de respuestas de la IA
+        self.llm_cache_label = QLabel("")
+        self.llm_cache_label.setStyleSheet(f"color: {COLORS['text_secondary']}; font-size: 13px;")
+        data_layout.addWidget(self.llm_cache_label)
+        
+        clear_cache_btn = QPushButton("♻️ Vaciar caché de IA")
+        clear_cache_btn.setFixedWidth(250)
+        clear_cache_btn.clicked.connect(self._clear_llm_cache)
+        data_layout.addWidget(clear_cache_btn)
+        
         layout.addWidget(data_card)
         
         # Update Card
@@ -5155,6 +8346,14 @@ class MainWindow(QMainWindow):
         analyze_action.triggered.connect(self._run_ai_analysis)
         file_menu.addAction(analyze_action)
         
+        batch_submit_action = QAction("Enviar análisis nocturno (por lotes)", self)
+        batch_submit_action.triggered.connect(lambda: self._run_batch_analysis('submit'))
+        file_menu.addAction(batch_submit_action)
+        
+        batch_ingest_action = QAction("Recoger resultados del análisis por lotes", self)
+        batch_ingest_action.triggered.connect(lambda: self._run_batch_analysis('ingest'))
+        file_menu.addAction(batch_ingest_action)
+        
         file_menu.addSeparator()
         
         exit_action = QAction("Salir", self)
@@ -5163,8 +8362,7 @@ class MainWindow(QMainWindow):
         file_menu.addAction(exit_action)
         
     def _init_database(self):
-        self.db = Database()
-        self.db.connect()
+        self.db = get_connection_manager().connection()
         
         api_key = self.db.get_setting('api_key')
         provider = self.db.get_setting('provider', 'gemini')
@@ -5173,9 +8371,13 @@ class MainWindow(QMainWindow):
             self.api_key_input.setText(api_key)
         if provider == 'openai':
             self.provider_combo.setCurrentIndex(1)
+        rpm = self.db.get_setting('ai_rpm')
+        if rpm:
+            self.rpm_input.setValue(int(rpm))
         
     def _load_data(self):
         self._update_dashboard()
+        self._update_llm_cache_label()
         self._load_persons()
         self._populate_person_filter()  # Llenar filtro de personas
         self._load_tasks()
@@ -5194,7 +8396,7 @@ class MainWindow(QMainWindow):
         
         # Recent tasks
         self._clear_layout(self.dashboard_tasks_container)
-        tasks = self.db.get_all_tasks()[:5]
+        tasks = self.db.get_all_tasks(limit=5)
         for task in tasks:
             item = TaskCard(
                 task['id'], task['title'], task.get('description', ''),
@@ -5323,55 +8525,15 @@ class MainWindow(QMainWindow):
         self._load_profile_tab_content(current_tab)
         
     def _load_persons(self):
-        self._clear_layout(self.persons_grid)
-        persons = self.db.get_all_persons(min_messages=1)
+        persons = self.db.get_all_persons_with_skills(min_messages=1)
+        self.persons_view.set_persons(persons)
         
         if not persons:
+            self.persons_view.hide()
             self.persons_empty.show()
             return
         self.persons_empty.hide()
-        
-        me = self.db.get_me()
-        # Calcular número de columnas basado en el ancho disponible
-        # Mínimo 1 columna, máximo 4
-        available_width = self.content_stack.width() - 100  # Margen
-        card_width = 300  # Ancho aproximado de tarjeta
-        max_cols = max(1, min(4, available_width // card_width)) if available_width > 0 else 3
-        
-        col, row = 0, 0
-        
-        for person in persons:
-            person_data = self.db.get_person_with_skills(person['id'])
-            skills = person_data.get('skills', []) if person_data else []
-            is_me = me and person['id'] == me['id']
-            ai_analyzed = bool(person.get('ai_analyzed', 0))
-            sentiment = person.get('sentiment', 'neutral')
-            sentiment_score = float(person.get('sentiment_score', 0.0) or 0.0)
-            
-            avatar_path = person.get('avatar_path')
-            
-            card = PersonCard(
-                person['id'], person['name'], person.get('role', 'desconocido'),
-                skills=skills, message_count=person.get('total_messages', 0),
-                is_me=is_me, ai_analyzed=ai_analyzed,
-                sentiment=sentiment, sentiment_score=sentiment_score,
-                avatar_path=avatar_path
-            )
-            card.clicked.connect(lambda p=person: self._show_person_detail(p))
-            card.analyze_clicked.connect(self._analyze_person_from_card)
-            card.edit_clicked.connect(self._edit_person_name)
-            card.delete_clicked.connect(self._delete_person)
-            card.avatar_clicked.connect(self._change_person_avatar)
-            self.persons_grid.addWidget(card, row, col)
-            
-            col += 1
-            if col >= max_cols:
-                col = 0
-                row += 1
-        
-        # Configurar stretch para que las columnas se expandan uniformemente
-        for i in range(max_cols):
-            self.persons_grid.setColumnStretch(i, 1)
+        self.persons_view.show()
     
     def _analyze_person_from_card(self, person_id: int):
         """Analiza una persona desde el botón de la tarjeta"""
@@ -5389,17 +8551,38 @@ class MainWindow(QMainWindow):
             self._navigate_to(5)  # Ir a configuración
             return
         
-        # Obtener mensajes de la persona
-        messages = self.db.get_messages_for_person(person_id)
+        # Análisis incremental: solo los mensajes posteriores al último análisis
+        watermark = person.get('ai_watermark_message_id') if person.get('ai_analyzed') else None
+        previous_profile = None
+        if watermark:
+            messages = self.db.get_messages_for_person(person_id, after_id=watermark)
+            if not messages:
+                reply = QMessageBox.question(
+                    self, "Sin mensajes nuevos",
+                    f"No hay mensajes nuevos de {person['name']} desde el último análisis.\n\n"
+                    f"¿Quieres repetir el análisis completo?",
+                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                    QMessageBox.StandardButton.No
+                )
+                if reply != QMessageBox.StandardButton.Yes:
+                    return
+                watermark = None
+            else:
+                previous_profile = format_profile_digest(self.db.get_person_analysis_snapshot(person_id))
+        
+        if not watermark:
+            messages = self.db.get_messages_for_person(person_id)
         if not messages:
             QMessageBox.warning(self, "Sin mensajes", f"No hay mensajes de {person['name']} para analizar.")
             return
+        new_watermark = max(m['id'] for m in messages)
         
         # Confirmación
+        scope = "nuevos desde el último análisis" if previous_profile else "TODOS"
         reply = QMessageBox.question(
             self, "Confirmar análisis con IA",
             f"Vas a analizar a {person['name']}:\n\n"
-            f"• {len(messages)} mensajes (TODOS)\n\n"
+            f"• {len(messages)} mensajes ({scope})\n\n"
             f"Se extraerán:\n"
             f"• Patrones de comportamiento\n"
             f"• Tareas y proyectos\n"
@@ -5455,104 +8638,166 @@ class MainWindow(QMainWindow):
         messages_text = "\n".join(messages_lines)
         
         self.person_analysis_thread = PersonAnalysisThread(
-            api_key, person_id, person['name'], messages_text, self.db
+            api_key, person_id, person['name'], messages_text, self.db.db_path,
+            previous_profile, new_watermark
         )
+        self._person_analysis_saved = {}  # sección -> (valor, elementos guardados)
         self.person_analysis_thread.finished.connect(self._on_person_analysis_finished)
+        self.person_analysis_thread.section_ready.connect(self._on_person_analysis_section)
+        self.person_analysis_thread.progress.connect(self.loading_overlay.show_indeterminate)
         self.person_analysis_thread.error.connect(self._on_person_analysis_error)
         self.person_analysis_thread.start()
     
-    def _on_person_analysis_finished(self, person_id: int, result: dict):
-        """Callback cuando termina el análisis de una persona"""
-        self.loading_overlay.hide()
-        
-        # Marcar como analizado
-        self.db.update_person(person_id, ai_analyzed=1, ai_analyzed_at=datetime.now().isoformat())
+    def _save_person_analysis_section(self, person_id: int, section: str, value) -> int:
+        """Guarda una sección del análisis de una persona (upsert) y devuelve cuántos elementos guardó"""
+        if section == 'summary':
+            self.db.update_person(person_id, profile_summary=value)
+            return 1
         
         # Actualizar rol si se detectó
-        if result.get('role'):
-            self.db.update_person(person_id, role=result['role'], role_confidence=result.get('role_confidence', 0.8))
+        if section == 'role':
+            if not value.get('role'):
+                return 0
+            self.db.update_person(person_id, role=value['role'], role_confidence=value.get('role_confidence', 0.8))
+            return 1
         
         # Actualizar sentimiento
-        if result.get('sentiment'):
+        if section == 'sentiment':
+            if not value.get('sentiment'):
+                return 0
             self.db.update_person(
                 person_id, 
-                sentiment=result.get('sentiment', 'neutral'),
-                sentiment_score=result.get('sentiment_score', 0.0)
+                sentiment=value.get('sentiment', 'neutral'),
+                sentiment_score=value.get('sentiment_score', 0.0)
             )
+            return 1
+        
+        # Actualizar tipo de cliente si se detectó
+        if section == 'client_type':
+            try:
+                self.db.update_person(person_id, client_type=value)
+            except:
+                pass
+            return 1
         
         # Guardar skills
-        if result.get('skills'):
-            for skill in result['skills']:
+        if section == 'skills':
+            for skill in value:
                 skill_id = self.db.add_skill(skill.get('name', ''), skill.get('category', 'otro'))
-                self.db.add_person_skill(person_id, skill_id, skill.get('score', 50), skill.get('evidence', ''))
+                self.db.add_person_skill(person_id, skill_id, skill.get('score', skill.get('level', 50)),
+                                         skill.get('evidence', ''))
+            return len(value)
         
         # Guardar compromisos detectados
-        commitments_count = 0
-        if result.get('commitments'):
-            for commitment in result['commitments']:
-                self.db.add_commitment(
+        saved = 0
+        if section == 'commitments':
+            for commitment in value:
+                if not commitment.get('title'):
+                    continue
+                self.db.upsert_commitment(
                     person_id=person_id,
-                    title=commitment.get('title', ''),
+                    title=commitment['title'],
                     commitment_type=commitment.get('type', 'promise'),
                     due_date=commitment.get('due_date'),
                     evidence=commitment.get('evidence')
                 )
-                commitments_count += 1
+                saved += 1
         
         # Guardar TAREAS detectadas
-        tasks_count = 0
-        if result.get('tasks'):
-            for task in result['tasks']:
+        elif section == 'tasks':
+            for task in value:
+                if not task.get('title'):
+                    continue
                 try:
-                    self.db.add_task(
-                        title=task.get('title', ''),
+                    self.db.upsert_task(
+                        title=task['title'],
                         description=task.get('evidence', ''),
                         status=task.get('status', 'pending'),
                         priority=task.get('priority', 'medium'),
                         assigned_to=person_id,
                         due_date=task.get('due_date')
                     )
-                    tasks_count += 1
+                    saved += 1
                 except Exception as e:
                     print(f"Error guardando tarea: {e}")
         
         # Guardar PROYECTOS detectados
-        projects_count = 0
-        if result.get('projects'):
-            for project in result['projects']:
+        elif section == 'projects':
+            for project in value:
+                if not project.get('name'):
+                    continue
                 try:
-                    self.db.add_project(
-                        name=project.get('name', ''),
+                    self.db.upsert_project(
+                        name=project['name'],
                         description=project.get('description', ''),
-                        client_id=person_id
+                        client_id=person_id,
+                        status=project.get('status')
                     )
-                    projects_count += 1
+                    saved += 1
                 except Exception as e:
                     print(f"Error guardando proyecto: {e}")
         
         # Guardar ALERTAS detectadas
-        alerts_count = 0
-        if result.get('alerts'):
-            for alert in result['alerts']:
+        elif section == 'alerts':
+            for alert in value:
+                if not alert.get('title'):
+                    continue
                 try:
-                    self.db.add_behavior_alert(
+                    self.db.upsert_behavior_alert(
                         person_id=person_id,
                         alert_type=alert.get('type', 'red_flags'),
                         severity=alert.get('severity', 'medium'),
-                        title=alert.get('title', ''),
+                        title=alert['title'],
                         description=alert.get('description', ''),
                         evidence=alert.get('evidence', '')
                     )
-                    alerts_count += 1
+                    saved += 1
                 except Exception as e:
                     print(f"Error guardando alerta: {e}")
+        return saved
+    
+    def _on_person_analysis_section(self, person_id: int, section: str, value):
+        """Guarda cada sección en cuanto el análisis en streaming la completa"""
+        if not value:
+            return
+        count = self._save_person_analysis_section(person_id, section, value)
+        self._person_analysis_saved[section] = (value, count)
+        
+        labels = {'role': 'Rol', 'sentiment': 'Sentimiento', 'client_type': 'Tipo de cliente',
+                  'skills': 'Skills', 'commitments': 'Compromisos', 'tasks': 'Tareas',
+                  'projects': 'Proyectos', 'alerts': 'Alertas', 'summary': 'Resumen'}
+        done = [
+            f"✓ {labels[name]}" + (f" ({saved[1]})" if name in PERSON_ANALYSIS_LIST_SECTIONS else "")
+            for name, saved in self._person_analysis_saved.items()
+        ]
+        self.loading_overlay.show_indeterminate(
+            f"Analizando a {self.person_analysis_thread.person_name}...\n" + "  ".join(done)
+        )
+    
+    def _on_person_analysis_finished(self, person_id: int, result: dict):
+        """Callback cuando termina el análisis de una persona"""
+        self.loading_overlay.hide()
         
-        # Actualizar tipo de cliente si se detectó
-        if result.get('client_type'):
-            try:
-                self.db.update_person(person_id, client_type=result.get('client_type'))
-            except:
-                pass
+        # Marcar como analizado hasta el último mensaje enviado a la IA, salvo que algún bloque
+        # fallara: entonces sus mensajes deben volver a entrar en el siguiente análisis
+        failed_parts = self.person_analysis_thread.failed_parts
+        if not failed_parts:
+            self.db.update_person(
+                person_id, ai_analyzed=1, ai_analyzed_at=datetime.now().isoformat(),
+                ai_watermark_message_id=self.person_analysis_thread.watermark
+            )
+        
+        # Guardar las secciones que no llegaron ya por streaming (o que el reduce ha cambiado)
+        counts = {}
+        for section in PERSON_ANALYSIS_SECTIONS:
+            value = person_analysis_section(result, section)
+            if not value:
+                continue
+            streamed = self._person_analysis_saved.get(section)
+            if streamed and streamed[0] == value:
+                counts[section] = streamed[1]
+            else:
+                counts[section] = self._save_person_analysis_section(person_id, section, value)
         
         # Recargar datos
         self._load_data()
@@ -5565,10 +8810,11 @@ class MainWindow(QMainWindow):
             f"• Rol detectado: {result.get('role', 'No detectado')}\n"
             f"• Sentimiento: {sentiment_emoji} {result.get('sentiment', 'neutral')}\n"
             f"• Skills: {len(result.get('skills', []))}\n"
-            f"• Compromisos: {commitments_count}\n"
-            f"• Tareas: {tasks_count}\n"
-            f"• Proyectos: {projects_count}\n"
-            f"• Alertas: {alerts_count}"
+            f"• Compromisos: {counts.get('commitments', 0)}\n"
+            f"• Tareas: {counts.get('tasks', 0)}\n"
+            f"• Proyectos: {counts.get('projects', 0)}\n"
+            f"• Alertas: {counts.get('alerts', 0)}"
+            + (f"\n\n⚠️ {failed_parts} bloque(s) fallaron; se volverán a analizar la próxima vez." if failed_parts else "")
         )
     
     def _on_person_analysis_error(self, error_msg: str):
@@ -5656,90 +8902,103 @@ class MainWindow(QMainWindow):
         # Verificar si agrupación está activa
         group_by_category = hasattr(self, 'group_toggle') and self.group_toggle.isChecked()
         
-        if group_by_category:
-            grouped_tasks = self.db.get_tasks_grouped_by_category(status, person_id)
-            
-            if not grouped_tasks:
-                self.tasks_empty.show()
-                return
-            self.tasks_empty.hide()
-            
-            # Orden de categorías
-            category_order = ['mentoría', 'mentoria', 'técnico', 'tecnico', 'marketing', 
-                            'ventas', 'negocio', 'diseño', 'contenido', 'administrativo', 'general']
-            
-            # Ordenar categorías
-            sorted_categories = sorted(grouped_tasks.keys(), 
-                key=lambda x: category_order.index(x.lower()) if x.lower() in category_order else 999)
-            
-            for category in sorted_categories:
-                tasks = grouped_tasks[category]
-                if not tasks:
-                    continue
-                    
-                # Header de categoría
-                cat_colors = CATEGORY_COLORS.get(category.lower(), CATEGORY_COLORS['general'])
-                
-                cat_header = QFrame()
-                cat_header.setStyleSheet(f"""
-                    QFrame {{
-                        background-color: {cat_colors[1]};
-                        border-radius: 10px;
-                        margin-top: 8px;
-                    }}
-                """)
-                cat_layout = QHBoxLayout(cat_header)
-                cat_layout.setContentsMargins(16, 12, 16, 12)
-                
-                cat_icon = QLabel("📁")
-                cat_icon.setStyleSheet("font-size: 18px;")
-                cat_layout.addWidget(cat_icon)
-                
-                cat_name = QLabel(category.capitalize())
-                cat_name.setStyleSheet(f"""
-                    color: {cat_colors[0]};
-                    font-size: 16px;
-                    font-weight: 700;
-                """)
-                cat_layout.addWidget(cat_name)
-                
-                cat_count = QLabel(f"{len(tasks)} tareas")
-                cat_count.setStyleSheet(f"""
-                    color: {cat_colors[0]};
-                    font-size: 13px;
-                    opacity: 0.8;
-                """)
-                cat_layout.addWidget(cat_count)
-                cat_layout.addStretch()
-                
-                self.tasks_list.addWidget(cat_header)
-                
-                # Tareas de esta categoría
-                for task in tasks:
-                    item = TaskCard(
-                        task['id'], task['title'], task.get('description', ''),
-                        task.get('status', 'pending'), task.get('priority', 'medium'),
-                        task.get('category', 'general'), task.get('assigned_to_name')
-                    )
-                    item.status_changed.connect(self._on_task_status_changed)
-                    self.tasks_list.addWidget(item)
+        # Estado de la paginación: cada cambio de filtro solo cuesta la primera página
+        self._tasks_page_state = {
+            'status': status,
+            'person_id': person_id,
+            'grouped': group_by_category,
+            'last_task': None,
+            'has_more': True,
+            'current_category': None,
+            'category_counts': self.db.get_task_counts_by_category(status, person_id) if group_by_category else {},
+        }
+        
+        if not self._load_tasks_page():
+            self.tasks_empty.show()
+            return
+        self.tasks_empty.hide()
+    
+    def _load_tasks_page(self) -> int:
+        """Añade la siguiente página de tareas a la lista; devuelve cuántas se añadieron"""
+        state = getattr(self, '_tasks_page_state', None)
+        if not state or not state['has_more']:
+            return 0
+        
+        if state['grouped']:
+            grouped_tasks = self.db.get_tasks_grouped_by_category(
+                state['status'], state['person_id'], limit=TASKS_PAGE_SIZE, after=state['last_task']
+            )
+            tasks = [task for category_tasks in grouped_tasks.values() for task in category_tasks]
         else:
-            # Sin agrupación - lista plana
-            tasks = self.db.get_all_tasks(status)
-            
-            if not tasks:
-                self.tasks_empty.show()
-                return
-            self.tasks_empty.hide()
+            tasks = self.db.get_all_tasks(
+                state['status'], state['person_id'], limit=TASKS_PAGE_SIZE, after=state['last_task']
+            )
+        
+        state['has_more'] = len(tasks) == TASKS_PAGE_SIZE
+        if tasks:
+            state['last_task'] = tasks[-1]
+        
+        for task in tasks:
+            if state['grouped']:
+                category = task.get('category', 'general') or 'general'
+                if category != state['current_category']:
+                    state['current_category'] = category
+                    self.tasks_list.addWidget(
+                        self._create_task_category_header(category, state['category_counts'].get(category, 0))
+                    )
             
-            for task in tasks:
-                item = TaskCard(
-                    task['id'], task['title'], task.get('description', ''),
-                    task.get('status', 'pending'), task.get('priority', 'medium'),
-                    task.get('category', 'general'), task.get('assigned_to_name')
-                )
-                item.status_changed.connect(self._on_task_status_changed)
-                self.tasks_list.addWidget(item)
+            item = TaskCard(
+                task['id'], task['title'], task.get('description', ''),
+                task.get('status', 'pending'), task.get('priority', 'medium'),
+                task.get('category', 'general'), task.get('assigned_to_name')
+            )
+            item.status_changed.connect(self._on_task_status_changed)
+            self.tasks_list.addWidget(item)
+        
+        return len(tasks)
+    
+    def _on_tasks_scrolled(self, value: int = None):
+        scroll_bar = self.tasks_scroll.verticalScrollBar()
+        # Con maximum() == 0 el contenido no llena la vista: cargar entonces encadenaría páginas
+        if scroll_bar.maximum() > 0 and scroll_bar.value() >= scroll_bar.maximum() - 300:
+            self._load_tasks_page()
+    
+    def _create_task_category_header(self, category: str, count: int) -> QFrame:
+        # Header de categoría
+        cat_colors = CATEGORY_COLORS.get(category.lower(), CATEGORY_COLORS['general'])
+        
+        cat_header = QFrame()
+        cat_header.setStyleSheet(f"""
+            QFrame {{
+                background-color: {cat_colors[1]};
+                border-radius: 10px;
+                margin-top: 8px;
+            }}
+        """)
+        cat_layout = QHBoxLayout(cat_header)
+        cat_layout.setContentsMargins(16, 12, 16, 12)
+        
+        cat_icon = QLabel("📁")
+        cat_icon.setStyleSheet("font-size: 18px;")
+        cat_layout.addWidget(cat_icon)
+        
+        cat_name = QLabel(category.capitalize())
+        cat_name.setStyleSheet(f"""
+            color: {cat_colors[0]};
+            font-size: 16px;
+            font-weight: 700;
+        """)
+        cat_layout.addWidget(cat_name)
+        
+        cat_count = QLabel(f"{count} tareas")
+        cat_count.setStyleSheet(f"""
+            color: {cat_colors[0]};
+            font-size: 13px;
+            opacity: 0.8;
+        """)
+        cat_layout.addWidget(cat_count)
+        cat_layout.addStretch()
+        return cat_header
     
     def _toggle_task_grouping(self):
         """Alternar entre vista agrupada y lista plana"""
@@ -5843,12 +9102,22 @@ class MainWindow(QMainWindow):
         total_files = result.get('total_files', 1)
         files_text = f"{total_files} archivos" if total_files > 1 else "1 archivo"
         
+        skipped_text = ""
+        if result.get('skipped_files') or result.get('duplicate_messages'):
+            skipped_text = (
+                f"Ya importados (omitidos):\n"
+                f"• {result.get('skipped_files', 0)} archivos\n"
+                f"• {result.get('duplicate_messages', 0)} mensajes\n\n"
+            )
+        
         QMessageBox.information(
             self, "Chat Importado",
             f"Se importaron ({files_text}):\n\n"
-            f"• {result.get('total_messages', 0)} mensajes\n"
+            f"• {result.get('total_messages', 0)} mensajes nuevos\n"
             f"• {result.get('total_participants', 0)} participantes\n"
-            f"• {result.get('total_links', 0)} enlaces\n\n"
+            f"• {result.get('total_links', 0)} enlaces\n"
+            f"• {result.get('total_attachments', 0)} adjuntos\n\n"
+            f"{skipped_text}"
             f"Para analizar con IA, haz clic en el botón\n"
             f"'🤖 Analizar con IA' en cada tarjeta de persona."
         )
@@ -5902,7 +9171,8 @@ class MainWindow(QMainWindow):
             self.current_chat_data['messages'],
             self.current_chat_data['participants'],
             api_key,
-            me_name
+            me_name,
+            self.db.db_path
         )
         self.analysis_worker.progress.connect(self._on_analysis_progress)
         self.analysis_worker.finished.connect(self._on_analysis_finished)
@@ -5972,6 +9242,52 @@ class MainWindow(QMainWindow):
     def _on_analysis_error(self, error: str):
         self.loading_overlay.hide()
         QMessageBox.critical(self, "Error en Análisis", f"Error:\n{error}")
+    
+    def _run_batch_analysis(self, mode: str):
+        """Envía el análisis de todas las personas al Batch API o ingiere los lotes terminados"""
+        api_key = self.api_key_input.text() or os.environ.get('GEMINI_API_KEY')
+        if not api_key:
+            QMessageBox.warning(
+                self, "API Key requerida", 
+                "Configura tu API key en la sección de Configuración para usar el análisis con IA."
+            )
+            self._navigate_to(5)
+            return
+        
+        if mode == 'submit':
+            reply = QMessageBox.question(self, "Análisis por lotes",
+                "Se enviará el análisis de todas las personas (perfil, alertas y tareas) como un "
+                "trabajo por lotes.\n\nEl proveedor lo procesa en diferido (hasta 24 h) a menor coste; "
+                "recoge los resultados después desde Archivo.\n\n¿Continuar?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                QMessageBox.StandardButton.No)
+            if reply != QMessageBox.StandardButton.Yes:
+                return
+        
+        self.loading_overlay.show_indeterminate("Análisis por lotes...")
+        self.batch_worker = BatchAnalysisWorker(api_key, self.db.db_path, mode)
+        self.batch_worker.progress.connect(self.loading_overlay.show_indeterminate)
+        self.batch_worker.finished.connect(self._on_batch_analysis_finished)
+        self.batch_worker.error.connect(self._on_analysis_error)
+        self.batch_worker.start()
+    
+    def _on_batch_analysis_finished(self, summary: dict):
+        self.loading_overlay.hide()
+        if summary['mode'] == 'submit':
+            QMessageBox.information(
+                self, "📦 Lote enviado",
+                f"Se enviaron {summary['requests']} peticiones en {summary['jobs']} trabajo(s).\n\n"
+                f"Recoge los resultados cuando el proveedor termine."
+            )
+            return
+        
+        self._load_data()
+        QMessageBox.information(
+            self, "📦 Resultados del lote",
+            f"• {summary['ingested']} trabajo(s) ingeridos ({summary['responses']} respuestas)\n"
+            f"• {summary['pending']} trabajo(s) aún en proceso\n"
+            f"• {summary['failed']} trabajo(s) fallidos"
+        )
         
     def _on_task_status_changed(self, task_id: int, new_status: str):
         self.db.update_task_status(task_id, new_status)
@@ -6373,6 +9689,7 @@ class MainWindow(QMainWindow):
         
         self.db.set_setting('api_key', api_key)
         self.db.set_setting('provider', provider)
+        self.db.set_setting('ai_rpm', str(self.rpm_input.value() or ''))
         
         QMessageBox.information(self, "✅ Guardado", "Configuración guardada correctamente.")
         
@@ -6389,13 +9706,25 @@ class MainWindow(QMainWindow):
             self._load_data()
             QMessageBox.information(self, "✅ Completado", "Todos los datos han sido eliminados.")
         
+    def _update_llm_cache_label(self):
+        stats = self.db.get_llm_cache_stats()
+        self.llm_cache_label.setText(
+            f"Caché de IA: {stats['entries']} respuestas ({stats['size_bytes'] / 1024:.0f} KB) · "
+            f"{stats['hits']} aciertos, {stats['misses']} fallos ({stats['hit_rate']:.0%})"
+        )
+    
+    def _clear_llm_cache(self):
+        self.db.clear_llm_cache()
+        self._update_llm_cache_label()
+        QMessageBox.information(self, "✅ Completado", "La caché de respuestas de IA se ha vaciado.")
+        
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.loading_overlay.setGeometry(self.rect())
         
     def closeEvent(self, event):
         if self.db:
-            self.db.close()
+            get_connection_manager(self.db.db_path).release()
         event.accept()
 
 
@@ -6425,4 +9754,27 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Necesario para el pool de procesos en el .exe
+    if '--query-plans' in sys.argv:
+        # Informe de planes de ejecución: python TelegramChatAnalyzer.py --query-plans [ruta.db]
+        args = [arg for arg in sys.argv[1:] if arg != '--query-plans']
+        db = Database(args[0] if args else "telegram_analyzer.db")
+        db.connect()
+        print(db.get_query_plan_report())
+        db.close()
+        sys.exit(0)
+    if '--batch-submit' in sys.argv or '--batch-ingest' in sys.argv:
+        # Análisis nocturno (p. ej. desde cron): --batch-submit y, más tarde, --batch-ingest [ruta.db]
+        # --batch-local usa el sustituto local del Batch API en lugar del proveedor
+        args = [arg for arg in sys.argv[1:] if not arg.startswith('--batch-')]
+        db_path = args[0] if args else "telegram_analyzer.db"
+        db = get_connection_manager(db_path).connection()
+        analyzer = AIAnalyzer(api_key=db.get_setting('api_key'), db_path=db_path)
+        backend = analyzer.batch_backend('local') if '--batch-local' in sys.argv else None
+        if '--batch-submit' in sys.argv:
+            print(f"Trabajos enviados: {submit_batch_analysis(db, analyzer, backend)}")
+        if '--batch-ingest' in sys.argv:
+            print(f"Resultados: {analyzer.ingest_batches(db, backend)}")
+        get_connection_manager(db_path).release()
+        sys.exit(0)
     main()